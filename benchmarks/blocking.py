@@ -0,0 +1,61 @@
+# benchmarks/blocking.py
+#
+# Compare matching two sites' CLKs all-pairs against matching only records which share a blocking key.
+# The second site holds half of the first site's patients, plus as many others.
+#
+#     python benchmarks/blocking.py --rows 20000
+
+import argparse
+import json
+import os
+
+import anonlink
+import pandas as pd
+
+from common import synthetic_patients, timed
+from pprl.blocking import BlockingKeys, blocking_function
+from pprl.hashing import CLKHasher
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+DEFINITIONS = {
+        'name_year': [{'field': 'last', 'transform': 'soundex'}, {'field': 'dob', 'transform': 'year'}],
+        'zip3_month': [{'field': 'zip', 'transform': 'prefix', 'length': 3}, {'field': 'dob', 'transform': 'month'}],
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    parser.add_argument("--threshold", type = float, default = 0.9)
+    args = parser.parse_args()
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    site_1 = synthetic_patients(args.rows, seed = 1)
+    site_2 = pd.concat([site_1.sample(frac = 0.5, random_state = 2), synthetic_patients(args.rows // 2, seed = 3)])
+
+    columns = ['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']
+    blocking = BlockingKeys("benchmark secret", DEFINITIONS, columns[2:])
+    clks, blocks = [], []
+    with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+        for site in [site_1, site_2]:
+            patients_df, _ = validate_input_fields(site)
+            patients_df = patients_df[columns].reset_index(drop = True)
+            clks.append(hasher.hash(patients_df))
+            blocks.append(blocking.columns(patients_df))
+
+    results = {}
+    for name, blocking_f in [("all pairs", None), ("blocked", blocking_function(blocks, blocking.column_names))]:
+        results[name], seconds = timed(anonlink.candidate_generation.find_candidate_pairs,
+                clks, anonlink.similarities.dice_coefficient, args.threshold, blocking_f = blocking_f)
+        print(f"{name:<10}{len(clks[0]):>8,} x {len(clks[1]):<8,} {seconds:>8.2f} s {len(results[name][0]):>8,} pairs")
+
+    all_pairs = set(zip(*results["all pairs"][2]))
+    blocked = set(zip(*results["blocked"][2]))
+    print(f"pairs found by blocking: {len(blocked & all_pairs) / len(all_pairs):.2%}")
+
+if __name__ == "__main__":
+    main()
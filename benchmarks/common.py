@@ -0,0 +1,72 @@
+# benchmarks/common.py
+# Shared helpers for the benchmark scripts in this folder.
+
+import string
+import time
+
+import numpy as np
+import pandas as pd
+
+def synthetic_patients(n, seed = 2026, invalid_fraction = 0.01):
+    """
+    Build a DataFrame of `n` synthetic patient records, in the format read by `read_dataframe_from_CSV()`.
+
+    Values are drawn from small vocabularies so that they repeat about as often as in real extracts,
+    and roughly `invalid_fraction` of the values in each field are malformed.
+    """
+    rng = np.random.default_rng(seed)
+
+    def words(count, low, high):
+        letters = np.array(list(string.ascii_uppercase))
+        return np.array([
+            ''.join(rng.choice(letters, size = rng.integers(low, high)))
+            for _ in range(count)
+            ], dtype=object)
+
+    def pick(vocabulary):
+        values = vocabulary[rng.integers(0, len(vocabulary), size = n)]
+        bad = rng.random(n) < invalid_fraction
+        values[bad] = rng.choice(np.array(['', '999', '@#$', 'NaN'], dtype=object), size = bad.sum())
+        return values
+
+    first_names = words(5_000, 3, 10)
+    last_names = words(20_000, 3, 12)
+    cities = words(2_000, 4, 14)
+    states = np.array(['MA', 'CT', 'RI', 'NH', 'VT', 'ME'], dtype=object)
+    zips = np.array([f"{z:05d}" for z in rng.integers(1_000, 99_999, size = 5_000)], dtype=object)
+    dobs = pd.date_range('1920-01-01', '2020-12-31').strftime('%Y-%m-%d').to_numpy(dtype=object)
+
+    return pd.DataFrame({
+        'row_id': np.arange(1, n + 1),
+        'source': 'bench',
+        'first': pick(first_names),
+        'last': pick(last_names),
+        'city': pick(cities),
+        'state': pick(states),
+        'zip': pick(zips),
+        'dob': pick(dobs),
+        })
+
+def timed(function, *args, **kwargs):
+    """
+    Call `function` and return its result along with the wall time in seconds
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def with_typos(patients, fraction, seed = 2026, columns = ('first', 'last')):
+    """
+    Copy `patients`, replacing one letter of a random one of `columns` in roughly `fraction` of the records,
+    so that those records no longer hash to the same CLK as the originals but still match them closely
+    """
+    rng = np.random.default_rng(seed)
+    patients = patients.copy()
+    letters = np.array(list(string.ascii_uppercase))
+    for row in np.flatnonzero(rng.random(len(patients)) < fraction):
+        column = patients.columns.get_loc(rng.choice(columns))
+        value = patients.iat[row, column]
+        if len(value) > 1:
+            n = rng.integers(0, len(value))
+            patients.iat[row, column] = value[:n] + rng.choice(letters) + value[n + 1:]
+    return patients
@@ -0,0 +1,30 @@
+# benchmarks/compact.py
+#
+# Compare the memory taken by synthetic patient records, as read and as validated,
+# with and without compact frames, and the time taken to normalize and validate them.
+#
+#     python benchmarks/compact.py --rows 1000000
+
+import argparse
+
+from common import synthetic_patients, timed
+from pprl.pprl import _normalize_and_validate
+from pprl.util import compact_frame
+
+def bytes_per_record(df):
+    return df.memory_usage(deep = True).sum() / len(df)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    patients = synthetic_patients(args.rows)
+
+    for label, raw_patients_df in [("object", patients), ("compact", compact_frame(patients))]:
+        (valid, _), seconds = timed(_normalize_and_validate, raw_patients_df)
+        print(f"{label:<9}{bytes_per_record(raw_patients_df):>7,.0f} bytes/record read "
+              f"{bytes_per_record(valid):>7,.0f} bytes/record validated {seconds:>8.2f} s")
+
+if __name__ == "__main__":
+    main()
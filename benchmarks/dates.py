@@ -0,0 +1,36 @@
+# benchmarks/dates.py
+#
+# Compare the per-value strptime cascade in _sanitize_date() with the column-wise date parser,
+# on every distinct date of birth in a century, written in each of the accepted formats.
+#
+#     python benchmarks/dates.py
+
+import argparse
+
+import pandas as pd
+
+from common import timed
+from pprl.util import _sanitize_date, _sanitize_date_column
+
+FORMATS = ['%Y/%m/%d', '%Y-%m-%d', '%m-%d-%Y', '%m/%d/%Y', '%m/%d/%y']
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--start", default = '1920-01-01')
+    parser.add_argument("--end", default = '2020-12-31')
+    args = parser.parse_args()
+
+    dates = pd.date_range(args.start, args.end)
+    print(f"{'format':<12}{'values':>10}{'per value':>12}{'column':>10}{'speedup':>10}")
+    for date_format in FORMATS:
+        column = pd.Series(dates.strftime(date_format), dtype=object)
+
+        expected, per_value_s = timed(lambda: [_sanitize_date(value) for value in column])
+        (cleaned, invalid), column_s = timed(_sanitize_date_column, column)
+        assert list(cleaned) == [clean for clean, _ in expected]
+        assert list(invalid) == [not is_valid for _, is_valid in expected]
+
+        print(f"{date_format:<12}{len(column):>10,}{per_value_s:>11.3f}s{column_s:>9.3f}s{per_value_s / column_s:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
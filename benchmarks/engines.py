@@ -0,0 +1,38 @@
+# benchmarks/engines.py
+#
+# Compare the throughput of the CLK engines on validated synthetic records, hashed in one process.
+#
+#     python benchmarks/engines.py --rows 200000
+
+import argparse
+import json
+import os
+
+from common import synthetic_patients, timed
+from pprl.hashing import ENGINES, CLKHasher
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 200_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    args = parser.parse_args()
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    patients_df, _ = validate_input_fields(synthetic_patients(args.rows))
+    patients_df = patients_df[['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']].reset_index(drop = True)
+
+    results = {}
+    for engine in ENGINES:
+        with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = engine) as hasher:
+            results[engine], seconds = timed(hasher.hash, patients_df)
+        print(f"{engine:<10}{len(patients_df):>10,} records {seconds:>8.2f} s {len(patients_df) / seconds:>10,.0f} records/s")
+
+    assert all(clks == results[ENGINES[0]] for clks in results.values())
+
+if __name__ == "__main__":
+    main()
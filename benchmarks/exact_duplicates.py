@@ -0,0 +1,67 @@
+# benchmarks/exact_duplicates.py
+#
+# Compare creating and self-matching a synthetic extract, in which a share of the patients appear
+# more than once under different row_ids, with and without the exact duplicates sidecar.
+#
+#     python benchmarks/exact_duplicates.py --rows 20000 --duplicates 0.3
+
+import argparse
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from common import synthetic_patients, timed
+from pprl import pprl
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--duplicates", type = float, default = 0.3)
+    parser.add_argument("--engine", default = "numpy")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        unique = round(args.rows * (1 - args.duplicates))
+        patients = synthetic_patients(unique)
+        rng = np.random.default_rng(1)
+        patients = pd.concat([patients, patients.iloc[rng.integers(0, unique, size = args.rows - unique)]])
+        patients['row_id'] = np.arange(1, len(patients) + 1)
+        patients.sample(frac = 1, random_state = 2).to_csv(os.path.join(temp_dir, "patients.csv"), index = False)
+        with open(os.path.join(temp_dir, "secret.txt"), "w") as f:
+            f.write("benchmark secret")
+
+        for exact_duplicates in [False, True]:
+            folder = os.path.join(temp_dir, str(exact_duplicates))
+            os.makedirs(folder)
+            _, create_seconds = timed(pprl._create_CLKs,
+                    patients = "patients.csv",
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = "hashes.csv",
+                    data_folder = temp_dir,
+                    schema_folder = SCHEMAS,
+                    output_folder = folder,
+                    engine = args.engine,
+                    exact_duplicates = exact_duplicates,
+                    )
+            _, match_seconds = timed(pprl._match_CLKs,
+                    hashes = ["hashes.csv"],
+                    threshold = 0.9,
+                    output = "linkages.csv",
+                    data_folder = folder,
+                    output_folder = folder,
+                    )
+            links = len(pd.read_csv(os.path.join(folder, "linkages.csv")))
+            label = "sidecar" if exact_duplicates else "no sidecar"
+            print(f"{label:<12}{len(patients):>8,} records create {create_seconds:>7.2f} s "
+                  f"match {match_seconds:>7.2f} s {links:>8,} links")
+
+if __name__ == "__main__":
+    main()
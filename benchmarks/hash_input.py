@@ -0,0 +1,53 @@
+# benchmarks/hash_input.py
+#
+# Compare the CSV round trip that used to hand validated records to clkhash with passing the records in memory.
+# Only the preparation of clkhash's input is timed: the hashing itself is identical.
+#
+#     python benchmarks/hash_input.py --rows 1000000
+
+import argparse
+import csv
+import io
+import tracemalloc
+
+from common import synthetic_patients, timed
+from pprl.hashing import _as_records
+from pprl.util import validate_input_fields
+
+def csv_round_trip(patients_df):
+    patients_str = io.StringIO()
+    patients_df.to_csv(patients_str)
+    patients_str.seek(0)
+    reader = csv.reader(patients_str)
+    next(reader)
+    return list(reader)
+
+def peak_memory(function, *args):
+    # traced separately, since tracing slows everything down
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    patients_df, _ = validate_input_fields(synthetic_patients(args.rows))
+
+    csv_records, csv_s = timed(csv_round_trip, patients_df)
+    records, records_s = timed(_as_records, patients_df)
+    assert [tuple(record) for record in csv_records] == records
+
+    del csv_records, records
+    csv_peak = peak_memory(csv_round_trip, patients_df)
+    records_peak = peak_memory(_as_records, patients_df)
+
+    print(f"records:               {len(patients_df):>10,}")
+    print(f"CSV round trip:        {csv_s:>10.2f} s {csv_peak / 2**20:>8.0f} MiB peak")
+    print(f"in-memory records:     {records_s:>10.2f} s {records_peak / 2**20:>8.0f} MiB peak")
+
+if __name__ == "__main__":
+    main()
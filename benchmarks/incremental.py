@@ -0,0 +1,58 @@
+# benchmarks/incremental.py
+#
+# Compare hashing every record with re-hashing through a CLK cache, when a small fraction of the records changed.
+#
+#     python benchmarks/incremental.py --rows 200000 --changed 0.01
+
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from common import synthetic_patients, timed
+from pprl.hashing import CLKCache, CLKHasher
+from pprl.util import validate_input_fields
+
+SCHEMA = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas", "100-patient-schema.json")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 200_000)
+    parser.add_argument("--changed", type = float, default = 0.01)
+    args = parser.parse_args()
+
+    with open(SCHEMA) as f:
+        schema_dict = json.load(f)
+    secret = "benchmark secret"
+
+    patients_df, _ = validate_input_fields(synthetic_patients(args.rows))
+    patients_df = patients_df[['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']].reset_index(drop = True)
+
+    # Next month's extract: a few records get a new last name
+    next_df = patients_df.copy()
+    changed = np.random.default_rng(0).random(len(next_df)) < args.changed
+    next_df.loc[changed, 'last'] = next_df.loc[changed, 'last'] + 'X'
+
+    with CLKHasher(secret, schema_dict, workers = 1) as hasher, tempfile.TemporaryDirectory() as temp_dir:
+        cache_path = os.path.join(temp_dir, "clk_cache.csv")
+        first_run = CLKCache(cache_path, secret, schema_dict)
+        _, first_s = timed(first_run.hash, hasher, patients_df)
+        first_run.commit()
+
+        second_run, load_s = timed(CLKCache, cache_path, secret, schema_dict)
+        (_, rehashed), second_s = timed(second_run.hash, hasher, next_df)
+        second_run.commit()
+
+        # last, so that it benefits from clkhash's token caches as much as the cached runs
+        _, full_s = timed(hasher.hash, next_df)
+
+    print(f"records / changed:          {len(next_df):>10,} / {sum(rehashed):,}")
+    print(f"hash every record:          {full_s:>10.2f} s")
+    print(f"first run with cache:       {first_s:>10.2f} s")
+    print(f"re-run with cache:          {load_s + second_s:>10.2f} s ({load_s:.2f} s reading the cache)")
+    print(f"                            {100 * (load_s + second_s) / full_s:>10.1f} % of hashing every record")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/lsh.py
+#
+# Compare matching two sites' CLKs all pairs with anonlink against the LSH engine of match,
+# for several numbers of bands and rows, and report the share of the all-pairs matches each one finds.
+# The second site holds half of the first site's patients, with a typo in the names of most of them,
+# plus as many others.
+#
+#     python benchmarks/lsh.py --rows 20000 --bands 32,48,64 --lsh-rows 16,20,24
+
+import argparse
+import json
+import logging
+import os
+
+import anonlink
+import pandas as pd
+
+from common import synthetic_patients, timed, with_typos
+from pprl.hashing import CLKHasher
+from pprl.matching import BitSampleLSH, clk_array
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    parser.add_argument("--threshold", type = float, default = 0.9)
+    parser.add_argument("--typos", type = float, default = 0.8)
+    parser.add_argument("--bands", default = "32,48,64")
+    parser.add_argument("--lsh-rows", default = "16,20,24")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    site_1 = synthetic_patients(args.rows, seed = 1)
+    shared = with_typos(site_1.sample(frac = 0.5, random_state = 2), args.typos, seed = 4)
+    site_2 = pd.concat([shared, synthetic_patients(args.rows // 2, seed = 3)])
+
+    columns = ['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']
+    clks = []
+    with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+        for site in [site_1, site_2]:
+            patients_df, _ = validate_input_fields(site)
+            clks.append(hasher.hash(patients_df[columns].reset_index(drop = True)))
+
+    result, seconds = timed(anonlink.candidate_generation.find_candidate_pairs,
+            clks, anonlink.similarities.dice_coefficient, args.threshold)
+    expected = set(zip(*result[2]))
+    print(f"{'anonlink':<16}{len(clks[0]):>8,} x {len(clks[1]):<8,} {seconds:>8.2f} s {len(expected):>8,} pairs")
+
+    arrays = [clk_array(x) for x in clks]
+    for bands in [int(x) for x in args.bands.split(",")]:
+        for rows in [int(x) for x in args.lsh_rows.split(",")]:
+            lsh = BitSampleLSH(arrays[0].shape[1] * 8, bands, rows)
+            (_, (left, right)), seconds = timed(lsh.find_candidate_pairs, *arrays, args.threshold)
+            found = set(zip(left.tolist(), right.tolist()))
+            recall = len(found & expected) / len(expected) if expected else 1.0
+            print(f"{f'lsh {bands}x{rows}':<16}{len(clks[0]):>8,} x {len(clks[1]):<8,} {seconds:>8.2f} s "
+                  f"{len(found):>8,} pairs recall {recall:.2%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# benchmarks/match_engines.py
+#
+# Compare the throughput of the exact match engines, in pairs of CLKs compared per second,
+# and check that they find the same pairs. The second site holds half of the first site's patients,
+# with a typo in the names of most of them, plus as many others.
+#
+#     python benchmarks/match_engines.py --rows 20000 --engines anonlink,numpy,blas
+
+import argparse
+import json
+import logging
+import os
+
+import pandas as pd
+
+from common import synthetic_patients, timed, with_typos
+from pprl.hashing import CLKHasher
+from pprl.matching import clk_array, find_matching_pairs
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    parser.add_argument("--threshold", type = float, default = 0.9)
+    parser.add_argument("--engines", default = "anonlink,numpy")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    site_1 = synthetic_patients(args.rows, seed = 1)
+    shared = with_typos(site_1.sample(frac = 0.5, random_state = 2), 0.8, seed = 4)
+    site_2 = pd.concat([shared, synthetic_patients(args.rows // 2, seed = 3)])
+
+    columns = ['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']
+    clks = []
+    with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+        for site in [site_1, site_2]:
+            patients_df, _ = validate_input_fields(site)
+            clks.append(clk_array(hasher.hash(patients_df[columns].reset_index(drop = True))))
+
+    pairs = {}
+    comparisons = len(clks[0]) * len(clks[1])
+    print(f"{len(clks[0]):,} x {len(clks[1]):,} CLKs of {clks[0].shape[1] * 8} bits")
+    for engine in args.engines.split(","):
+        (left, right), seconds = timed(find_matching_pairs, *clks, args.threshold, engine)
+        pairs[engine] = sorted(zip(left.tolist(), right.tolist()))
+        print(f"{engine:<10}{seconds:>8.2f} s {comparisons / seconds / 1e6:>8.1f} M pairs/s {len(left):>8,} pairs")
+    first = next(iter(pairs.values()))
+    print("same pairs:", all(x == first for x in pairs.values()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# benchmarks/normalization.py
+#
+# Compare transliterating every cell with the distinct-value normalization layer used by `pprl create`.
+#
+#     python benchmarks/normalization.py --rows 1000000 --chunk-size 100000
+
+import argparse
+
+from anyascii import anyascii
+
+from common import synthetic_patients, timed
+from pprl.pprl import _normalize_and_validate
+from pprl.util import NormalizationCache, validate_input_fields
+
+def every_cell(raw_patients_df):
+    patients_df = raw_patients_df.drop(['row_id', 'source'], axis=1).map(anyascii).map(lambda x: x.upper())
+    patients_df.insert(0, 'source', raw_patients_df['source'])
+    patients_df.insert(0, 'row_id', raw_patients_df['row_id'])
+    return validate_input_fields(patients_df)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    parser.add_argument("--chunk-size", type = int, default = 100_000)
+    args = parser.parse_args()
+
+    patients_df = synthetic_patients(args.rows)
+    chunks = [patients_df.iloc[i:i + args.chunk_size] for i in range(0, len(patients_df), args.chunk_size)]
+
+    _, per_cell_s = timed(lambda: [every_cell(chunk) for chunk in chunks])
+
+    cache = NormalizationCache()
+    _, distinct_s = timed(lambda: [_normalize_and_validate(chunk, cache) for chunk in chunks])
+
+    print(f"records / chunk size:            {args.rows:>10,} / {args.chunk_size:,}")
+    print(f"every cell, then validate:       {per_cell_s:>10.2f} s")
+    print(f"distinct values, cached:         {distinct_s:>10.2f} s")
+    print(f"speedup:                         {per_cell_s / distinct_s:>10.1f} x")
+    print(f"cache hit rate:                  {100 * cache.hit_rate:>10.1f} %")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# benchmarks/parallel_match.py
+#
+# Compare matching two sites' CLKs in one process against a MatchPool of several worker processes.
+# The second site holds half of the first site's patients, plus as many others.
+#
+#     python benchmarks/parallel_match.py --rows 20000 --workers 1,2,4
+
+import argparse
+import json
+import logging
+import os
+
+import pandas as pd
+
+from common import synthetic_patients, timed
+from pprl.hashing import CLKHasher
+from pprl.matching import MATCH_TASKS_PER_WORKER, MatchPool, clk_array, find_matching_pairs
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    parser.add_argument("--threshold", type = float, default = 0.9)
+    parser.add_argument("--workers", default = "1,2,4")
+    parser.add_argument("--engine", default = "anonlink")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    site_1 = synthetic_patients(args.rows, seed = 1)
+    site_2 = pd.concat([site_1.sample(frac = 0.5, random_state = 2), synthetic_patients(args.rows // 2, seed = 3)])
+
+    columns = ['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']
+    clks = []
+    with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+        for site in [site_1, site_2]:
+            patients_df, _ = validate_input_fields(site)
+            clks.append(clk_array(hasher.hash(patients_df[columns].reset_index(drop = True))))
+
+    print(f"{os.cpu_count()} CPUs")
+    (left, _), seconds = timed(find_matching_pairs, *clks, args.threshold, args.engine)
+    print(f"{'one process':<16}{len(clks[0]):>8,} x {len(clks[1]):<8,} {seconds:>8.2f} s {len(left):>8,} pairs")
+    for workers in [int(x) for x in args.workers.split(",")]:
+        with MatchPool(workers) as pool:
+            # Start the workers before timing, as a match of several tiles would only start them once
+            pool.find_matching_pairs(clks[0][:workers * MATCH_TASKS_PER_WORKER], clks[1][:1], args.threshold, args.engine)
+            (left, _), seconds = timed(pool.find_matching_pairs, *clks, args.threshold, args.engine)
+        print(f"{f'{workers} workers':<16}{len(clks[0]):>8,} x {len(clks[1]):<8,} {seconds:>8.2f} s {len(left):>8,} pairs")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/pipeline.py
+#
+# Compare creating CLKs for a synthetic patient file in chunks, one step after another,
+# against running the reading, validation, hashing and writing of the chunks side by side in a pipeline.
+# With --log, the pipeline reports how busy, idle and blocked each stage was.
+#
+#     python benchmarks/pipeline.py --rows 500000 --chunk-size 50000 --workers 2
+
+import argparse
+import logging
+import os
+import tempfile
+
+from common import synthetic_patients, timed
+from pprl import pprl
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 500_000)
+    parser.add_argument("--chunk-size", type = int, default = 50_000)
+    parser.add_argument("--workers", type = int, default = None)
+    parser.add_argument("--engine", default = "numpy")
+    parser.add_argument("--log", action = "store_true", help = "log each stage's statistics")
+    args = parser.parse_args()
+
+    if args.log:
+        logging.basicConfig(level = logging.WARNING)
+        logging.getLogger("pprl.pipeline").setLevel(logging.INFO)
+    else:
+        logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        synthetic_patients(args.rows).to_csv(os.path.join(temp_dir, "patients.csv"), index = False)
+        with open(os.path.join(temp_dir, "secret.txt"), "w") as f:
+            f.write("benchmark secret")
+
+        for pipeline in [False, True]:
+            output_folder = os.path.join(temp_dir, str(pipeline))
+            os.makedirs(output_folder)
+            _, seconds = timed(pprl._create_CLKs,
+                    patients = "patients.csv",
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = "hashes.csv",
+                    data_folder = temp_dir,
+                    schema_folder = SCHEMAS,
+                    output_folder = output_folder,
+                    chunk_size = args.chunk_size,
+                    workers = args.workers,
+                    engine = args.engine,
+                    pipeline = pipeline,
+                    )
+            label = "pipeline" if pipeline else "one step at a time"
+            print(f"{label:<20}{args.rows:>10,} records {seconds:>8.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# benchmarks/popcount_pruning.py
+#
+# Measure how many comparisons pruning by popcount rules out, and how much faster it makes the exact
+# match engines, in one process or across a MatchPool, checking that it finds the same pairs.
+# The patients are those of match_engines.py.
+#
+#     python benchmarks/popcount_pruning.py --rows 20000 --threshold 0.975 --workers 2
+
+import argparse
+import json
+import logging
+import os
+
+import pandas as pd
+
+from common import synthetic_patients, timed, with_typos
+from pprl.hashing import CLKHasher
+from pprl.matching import MatchPool, clk_array, find_matching_pairs, popcount_sort
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    parser.add_argument("--threshold", type = float, default = 0.975)
+    parser.add_argument("--engines", default = "anonlink,numpy,blas")
+    parser.add_argument("--workers", type = int, default = 1)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    site_1 = synthetic_patients(args.rows, seed = 1)
+    shared = with_typos(site_1.sample(frac = 0.5, random_state = 2), 0.8, seed = 4)
+    site_2 = pd.concat([shared, synthetic_patients(args.rows // 2, seed = 3)])
+
+    columns = ['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']
+    clks = []
+    with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+        for site in [site_1, site_2]:
+            patients_df, _ = validate_input_fields(site)
+            clks.append(clk_array(hasher.hash(patients_df[columns].reset_index(drop = True))))
+
+    _, _, windows = popcount_sort(*clks, args.threshold)
+    total = len(clks[0]) * len(clks[1])
+    pruned = total - sum((stop_1 - start_1) * (stop_2 - start_2) for start_1, stop_1, start_2, stop_2 in windows)
+    print(f"{len(clks[0]):,} x {len(clks[1]):,} CLKs of {clks[0].shape[1] * 8} bits, threshold {args.threshold}, {args.workers} workers")
+    print(f"popcount windows rule out {pruned:,} of {total:,} comparisons ({100 * pruned / total:.1f}%)")
+
+    pool = MatchPool(args.workers) if args.workers > 1 else None
+    match = find_matching_pairs if pool is None else pool.find_matching_pairs
+    if pool is not None:
+        # Start the workers before timing
+        match(clks[0][:args.workers * 4], clks[1][:10], args.threshold)
+    for engine in args.engines.split(","):
+        pairs = {}
+        times = {}
+        for prune in [False, True]:
+            (left, right), times[prune] = timed(match, *clks, args.threshold, engine, prune = prune)
+            pairs[prune] = sorted(zip(left.tolist(), right.tolist()))
+        print(f"{engine:<10}{times[False]:>8.2f} s unpruned {times[True]:>8.2f} s pruned "
+              f"({times[False] / times[True]:.1f}x) {len(pairs[True]):>8,} pairs, same pairs: {pairs[False] == pairs[True]}")
+    if pool is not None:
+        pool.close()
+
+if __name__ == "__main__":
+    main()
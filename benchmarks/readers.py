@@ -0,0 +1,40 @@
+# benchmarks/readers.py
+#
+# Compare the time and memory taken by each reader to load a synthetic patient file
+# which, like many extracts, carries a wide column the schema doesn't use.
+#
+#     python benchmarks/readers.py --rows 1000000
+
+import argparse
+import logging
+import os
+import tempfile
+
+from common import synthetic_patients, timed
+from pprl.pprl import READERS, read_dataframe_from_CSV
+
+COLUMNS = ['row_id', 'source', 'first', 'last', 'city', 'state', 'zip', 'dob']
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "patients.csv")
+        patients = synthetic_patients(args.rows)
+        patients['notes'] = 'SEEN IN CLINIC, FOLLOW UP IN SIX MONTHS'
+        patients.to_csv(file_path, index = False)
+        print(f"{args.rows:,} records, {os.path.getsize(file_path) / 2**20:,.0f} MiB")
+
+        for reader in READERS:
+            for columns, label in [(None, "all columns"), (COLUMNS, "schema columns")]:
+                df, seconds = timed(read_dataframe_from_CSV, file_path, columns = columns, reader = reader)
+                memory = df.memory_usage(deep = True).sum() / 2**20
+                print(f"{reader:<8}{label:<16}{seconds:>8.2f} s {memory:>10,.0f} MiB in memory")
+                del df
+
+if __name__ == "__main__":
+    main()
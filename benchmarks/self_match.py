@@ -0,0 +1,56 @@
+# benchmarks/self_match.py
+#
+# Compare deduplicating one site's CLKs by matching all pairs and keeping those with left < right,
+# as match used to, against comparing only those pairs. A tenth of the patients appear twice, most with a typo.
+#
+#     python benchmarks/self_match.py --rows 20000
+
+import argparse
+import json
+import logging
+import os
+
+import pandas as pd
+
+from common import synthetic_patients, timed, with_typos
+from pprl.hashing import CLKHasher
+from pprl.matching import clk_array, find_matching_pairs, find_self_matching_pairs
+from pprl.util import validate_input_fields
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def all_pairs(clks, threshold, engine):
+    left, right = find_matching_pairs(clks, clks, threshold, engine)
+    keep = left < right
+    return left[keep], right[keep]
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--schema", default = "100-patient-schema.json")
+    parser.add_argument("--threshold", type = float, default = 0.9)
+    parser.add_argument("--engines", default = "anonlink,lsh")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with open(os.path.join(SCHEMAS, args.schema)) as f:
+        schema_dict = json.load(f)
+
+    site = synthetic_patients(args.rows, seed = 1)
+    site = pd.concat([site, with_typos(site.sample(frac = 0.1, random_state = 2), 0.8, seed = 4)])
+
+    columns = ['source', 'row_id', 'first', 'last', 'city', 'state', 'zip', 'dob']
+    with CLKHasher("benchmark secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+        patients_df, _ = validate_input_fields(site)
+        clks = clk_array(hasher.hash(patients_df[columns].reset_index(drop = True)))
+
+    for engine in args.engines.split(","):
+        results = {}
+        for name, function in [("all pairs", all_pairs), ("upper triangle", find_self_matching_pairs)]:
+            results[name], seconds = timed(function, clks, args.threshold, engine)
+            print(f"{engine:<10}{name:<16}{len(clks):>8,} records {seconds:>8.2f} s {len(results[name][0]):>8,} pairs")
+        assert sorted(zip(*results["all pairs"])) == sorted(zip(*results["upper triangle"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# benchmarks/targets.py
+#
+# Compare hashing one synthetic extract for several secrets in a single `create` run
+# against one run per secret.
+#
+#     python benchmarks/targets.py --rows 100000 --targets 3
+
+import argparse
+import logging
+import os
+import tempfile
+
+from common import synthetic_patients, timed
+from pprl import pprl
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 100_000)
+    parser.add_argument("--targets", type = int, default = 3)
+    parser.add_argument("--engine", default = "numpy")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        synthetic_patients(args.rows).to_csv(os.path.join(temp_dir, "patients.csv"), index = False)
+        targets = []
+        for n in range(args.targets):
+            with open(os.path.join(temp_dir, f"secret_{n}.txt"), "w") as f:
+                f.write(f"benchmark secret {n}")
+            targets.append({'secret': f"secret_{n}.txt", 'output': f"hashes_{n}.csv"})
+
+        def create(output_folder, **kwargs):
+            output_folder = os.path.join(temp_dir, output_folder)
+            os.makedirs(output_folder)
+            pprl._create_CLKs(
+                    patients = "patients.csv",
+                    schema = "100-patient-schema.json",
+                    data_folder = temp_dir,
+                    schema_folder = SCHEMAS,
+                    output_folder = output_folder,
+                    engine = args.engine,
+                    **kwargs
+                    )
+
+        def separately():
+            for n, target in enumerate(targets):
+                create(f"separate_{n}", **target)
+
+        _, seconds = timed(separately)
+        print(f"{'one run per target':<22}{args.targets:>3} targets {seconds:>8.2f} s")
+        _, seconds = timed(create, "together", targets = targets)
+        print(f"{'one run, all targets':<22}{args.targets:>3} targets {seconds:>8.2f} s")
+
+if __name__ == "__main__":
+    main()
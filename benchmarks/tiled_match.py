@@ -0,0 +1,80 @@
+# benchmarks/tiled_match.py
+#
+# Compare the wall time and peak memory of matching two sites' hash files all at once against matching
+# them in tiles. Each match runs in a child process, so that its peak resident set size is its own.
+# The second site holds half of the first site's patients, plus as many others.
+#
+#     python benchmarks/tiled_match.py --rows 20000 --tile-sizes 2000,5000
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+
+from common import synthetic_patients, timed
+from pprl import pprl
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def run_match(folder, tile_size, engine):
+    logging.disable(logging.WARNING)
+    output_folder = os.path.join(folder, f"tiles_{tile_size}_{engine}")
+    os.makedirs(output_folder)
+    _, seconds = timed(pprl._match_CLKs,
+            hashes = ["hashes_1.csv", "hashes_2.csv"],
+            threshold = 0.9,
+            output = "linkages.csv",
+            data_folder = folder,
+            output_folder = output_folder,
+            engine = engine,
+            tile_size = tile_size,
+            )
+    links = len(pd.read_csv(os.path.join(output_folder, "linkages.csv")))
+    # Unlike ru_maxrss, the high water mark starts over when the child execs, so it doesn't count the parent's memory
+    with open("/proc/self/status") as f:
+        peak_mb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    label = "at once" if tile_size is None else f"tiles of {tile_size:,}"
+    print(f"{engine:<10}{label:<16}{seconds:>8.2f} s {peak_mb:>8.0f} MB peak {links:>8,} links")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 20_000)
+    parser.add_argument("--tile-sizes", default = "2000,5000")
+    parser.add_argument("--engine", default = "anonlink")
+    parser.add_argument("--run", nargs = 3, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        folder, tile_size, engine = args.run
+        run_match(folder, None if tile_size == "none" else int(tile_size), engine)
+        return
+
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        site_1 = synthetic_patients(args.rows, seed = 1, invalid_fraction = 0)
+        site_2 = pd.concat([site_1.sample(frac = 0.5, random_state = 2), synthetic_patients(args.rows // 2, seed = 3, invalid_fraction = 0)])
+        with open(os.path.join(temp_dir, "secret.txt"), "w") as f:
+            f.write("benchmark secret")
+        for n, site in enumerate([site_1, site_2], 1):
+            site.to_csv(os.path.join(temp_dir, f"patients_{n}.csv"), index = False)
+            pprl._create_CLKs(
+                    patients = f"patients_{n}.csv",
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = f"hashes_{n}.csv",
+                    data_folder = temp_dir,
+                    schema_folder = SCHEMAS,
+                    output_folder = temp_dir,
+                    engine = "numpy",
+                    exact_duplicates = False,
+                    )
+
+        for tile_size in ["none"] + args.tile_sizes.split(","):
+            subprocess.run([sys.executable, __file__, "--run", temp_dir, tile_size, args.engine], check = True)
+
+if __name__ == "__main__":
+    main()
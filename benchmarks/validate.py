@@ -0,0 +1,47 @@
+# benchmarks/validate.py
+#
+# Time `validate` on a synthetic patient file with each reader, and compare it with `create`,
+# which a site would otherwise have to run to find out whether its extract passes.
+#
+#     python benchmarks/validate.py --rows 2000000
+
+import argparse
+import logging
+import os
+import tempfile
+
+from common import synthetic_patients, timed
+from pprl import pprl
+
+SCHEMAS = os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 2_000_000)
+    parser.add_argument("--create", action = "store_true", help = "also time create with the numpy engine")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        synthetic_patients(args.rows).to_csv(os.path.join(temp_dir, "patients.csv"), index = False)
+        with open(os.path.join(temp_dir, "secret.txt"), "w") as f:
+            f.write("benchmark secret")
+        options = {
+                'patients': "patients.csv",
+                'schema': "100-patient-schema.json",
+                'data_folder': temp_dir,
+                'schema_folder': SCHEMAS,
+                'output_folder': temp_dir,
+                }
+
+        for reader in pprl.READERS:
+            _, seconds = timed(pprl._validate_patients, reader = reader, **options)
+            print(f"{'validate, ' + reader:<20}{args.rows:>12,} records {seconds:>8.2f} s {args.rows / seconds:>12,.0f} records/s")
+
+        if args.create:
+            _, seconds = timed(pprl._create_CLKs, secret = "secret.txt", output = "hashes.csv", engine = "numpy", **options)
+            print(f"{'create, numpy':<20}{args.rows:>12,} records {seconds:>8.2f} s {args.rows / seconds:>12,.0f} records/s")
+
+if __name__ == "__main__":
+    main()
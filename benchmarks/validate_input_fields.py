@@ -0,0 +1,42 @@
+# benchmarks/validate_input_fields.py
+#
+# Compare the column-wise validate_input_fields() with the original row-by-row version.
+#
+#     python benchmarks/validate_input_fields.py --rows 1000000
+#
+# The row-by-row version takes milliseconds per record, so by default it is only timed on the first
+# --reference-rows records and its time for the full input is extrapolated from that.
+
+import argparse
+
+from pandas.testing import assert_frame_equal
+
+from common import synthetic_patients, timed
+from pprl.util import validate_input_fields, _validate_input_fields_by_row
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    parser.add_argument("--reference-rows", type = int, default = 20_000)
+    args = parser.parse_args()
+
+    patients_df = synthetic_patients(args.rows)
+    reference_df = patients_df.iloc[:args.reference_rows]
+
+    (valid, invalid), columnwise_s = timed(validate_input_fields, patients_df)
+    (ref_valid, ref_invalid), rowwise_s = timed(_validate_input_fields_by_row, reference_df)
+
+    # Check that the results agree on the records validated by both
+    sample_valid, sample_invalid = validate_input_fields(reference_df)
+    assert_frame_equal(sample_valid, ref_valid)
+    assert_frame_equal(sample_invalid, ref_invalid)
+
+    rowwise_full_s = rowwise_s * len(patients_df) / len(reference_df)
+    print(f"records:                 {len(patients_df):>12,}")
+    print(f"valid / invalid:         {len(valid):>12,} / {len(invalid):,}")
+    print(f"column-wise:             {columnwise_s:>12.2f} s")
+    print(f"row-by-row (estimated):  {rowwise_full_s:>12.2f} s  ({rowwise_s:.2f} s for {len(reference_df):,} records)")
+    print(f"speedup:                 {rowwise_full_s / columnwise_s:>12.1f} x")
+
+if __name__ == "__main__":
+    main()
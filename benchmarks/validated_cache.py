@@ -0,0 +1,43 @@
+# benchmarks/validated_cache.py
+#
+# Compare reading and validating a synthetic patient file, as every `create` run does,
+# against loading the validated records cached by an earlier run, as when only the schema changes between runs.
+#
+#     python benchmarks/validated_cache.py --rows 1000000
+
+import argparse
+import logging
+import os
+import tempfile
+
+from common import synthetic_patients, timed
+from pprl.pprl import _read_and_validate
+from pprl.util import NormalizationCache, ValidatedRecordsCache
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 1_000_000)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "patients.csv")
+        patients = synthetic_patients(args.rows)
+        patients.to_csv(file_path, index = False)
+        columns = list(patients.columns)
+
+        (valid, invalid), seconds = timed(_read_and_validate, file_path, columns, 'pandas', False, NormalizationCache())
+        print(f"{'read and validate':<20}{args.rows:>10,} records {seconds:>8.2f} s")
+
+        cache = ValidatedRecordsCache(os.path.join(temp_dir, "validated"), file_path, columns)
+        _, seconds = timed(cache.store, valid, invalid)
+        print(f"{'store in cache':<20}{args.rows:>10,} records {seconds:>8.2f} s")
+
+        cache, seconds = timed(ValidatedRecordsCache, os.path.join(temp_dir, "validated"), file_path, columns)
+        print(f"{'digest patient file':<20}{args.rows:>10,} records {seconds:>8.2f} s")
+        _, seconds = timed(cache.load)
+        print(f"{'load from cache':<20}{args.rows:>10,} records {seconds:>8.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# benchmarks/watch.py
+#
+# Compare hashing small synthetic extracts by starting a fresh `pprl create` process for each one
+# against dropping them into a folder watched by a single `watch`, whose imports, hasher and caches stay warm.
+#
+#     python benchmarks/watch.py --rows 10000 --files 5
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import yaml
+
+from common import synthetic_patients, timed
+from pprl import pprl
+
+SCHEMAS = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src", "pprl", "tests", "schemas"))
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--rows", type = int, default = 10_000)
+    parser.add_argument("--files", type = int, default = 5)
+    parser.add_argument("--engine", default = "numpy")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        extracts = os.path.join(temp_dir, "extracts")
+        os.makedirs(extracts)
+        for n in range(args.files):
+            synthetic_patients(args.rows, seed = n).to_csv(os.path.join(extracts, f"extract_{n}.csv"), index = False)
+        with open(os.path.join(temp_dir, "secret.txt"), "w") as f:
+            f.write("benchmark secret")
+
+        # One process per extract, as an operator running `pprl create` by hand would
+        cold = os.path.join(temp_dir, "cold")
+        os.makedirs(cold)
+        seconds = []
+        for n in range(args.files):
+            output_folder = os.path.join(cold, str(n))
+            os.makedirs(output_folder)
+            config = os.path.join(output_folder, "create_CLKs.yml")
+            with open(config, "w") as f:
+                yaml.safe_dump({
+                        'patients': f"extract_{n}.csv",
+                        'secret': "../secret.txt",
+                        'schema': "100-patient-schema.json",
+                        'output': f"extract_{n}_CLKs.csv",
+                        'data_folder': extracts,
+                        'schema_folder': SCHEMAS,
+                        'output_folder': output_folder,
+                        'engine': args.engine,
+                        }, f)
+            _, elapsed = timed(subprocess.run, [sys.executable, "-m", "pprl.cli", "create", config],
+                    cwd = output_folder, check = True, capture_output = True)
+            seconds.append(elapsed)
+        print(f"{'pprl create per file':<24}{args.rows:>8,} records/file, {sum(seconds) / len(seconds):>6.2f} s per file")
+
+        # One watch, with each extract moved into the drop folder once the one before is hashed
+        drop = os.path.join(temp_dir, "drop")
+        warm = os.path.join(temp_dir, "warm")
+        os.makedirs(drop)
+        os.makedirs(warm)
+        os.replace(os.path.join(temp_dir, "secret.txt"), os.path.join(drop, "secret.txt"))
+        watcher = threading.Thread(target = pprl._watch_folder, kwargs = {
+                'schema': "100-patient-schema.json",
+                'secret': "secret.txt",
+                'data_folder': drop,
+                'schema_folder': SCHEMAS,
+                'output_folder': warm,
+                'engine': args.engine,
+                'poll_seconds': 0.2,
+                'settle_seconds': 0.5,
+                'max_files': args.files,
+                })
+        watcher.start()
+        for n in range(args.files):
+            os.replace(os.path.join(extracts, f"extract_{n}.csv"), os.path.join(drop, f"extract_{n}.csv"))
+            while not os.path.exists(os.path.join(warm, f"extract_{n}_CLKs.csv")):
+                time.sleep(0.05)
+        watcher.join()
+
+        metrics = pd.read_csv(os.path.join(warm, pprl.WATCH_METRICS_FILE_NAME))
+        print(f"{'watch, hashing':<24}{args.rows:>8,} records/file, {metrics['hash_seconds'].mean():>6.2f} s per file")
+        print(f"{'watch, landed to hashed':<24}{args.rows:>8,} records/file, {metrics['latency_seconds'].mean():>6.2f} s per file")
+
+if __name__ == "__main__":
+    main()
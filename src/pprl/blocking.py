@@ -0,0 +1,229 @@
+# blocking.py
+
+import hashlib
+import hmac
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Blocking keys are written to the hash file as columns named BLOCK_COLUMN_PREFIX + <name>
+BLOCK_COLUMN_PREFIX = 'block_'
+
+# Length of each written blocking key: 16 hex digits, i.e. the first 64 bits of an HMAC-SHA256
+BLOCKING_KEY_HEX_DIGITS = 16
+
+# Separates the components of a blocking key before they are HMACed
+_COMPONENT_SEPARATOR = '\x1f'
+
+_SOUNDEX_CODES = {
+        **dict.fromkeys('BFPV', '1'),
+        **dict.fromkeys('CGJKQSXZ', '2'),
+        **dict.fromkeys('DT', '3'),
+        'L': '4',
+        **dict.fromkeys('MN', '5'),
+        'R': '6',
+        **dict.fromkeys('HW', ''),
+        }
+
+def soundex(value):
+    """
+    American Soundex code of a name, e.g. "ROBERT" -> "R163". Returns '' if the name has no letters.
+    """
+    letters = [c for c in value.upper() if 'A' <= c <= 'Z']
+    if not letters:
+        return ''
+    code = letters[0]
+    previous = _SOUNDEX_CODES.get(letters[0], '0')
+    for c in letters[1:]:
+        digit = _SOUNDEX_CODES.get(c, '0')
+        # H and W don't separate letters with the same code, vowels do
+        if digit == '':
+            continue
+        if digit != '0' and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        previous = digit
+    return code.ljust(4, '0')
+
+def _soundex_column(values, length):
+    codes, uniques = pd.factorize(values)
+    return pd.Series(np.array([soundex(x) for x in uniques], dtype=object)[codes], index=values.index)
+
+# How each component of a blocking key is derived from a sanitized value.
+# Dates have already been sanitized to YYYY-MM-DD.
+BLOCKING_TRANSFORMS = {
+        'exact': lambda values, length: values,
+        'prefix': lambda values, length: values.str[:length],
+        'soundex': _soundex_column,
+        'year': lambda values, length: values.str[:4],
+        'month': lambda values, length: values.str[5:7],
+        }
+
+class BlockingKeys:
+    """
+    Derive keyed blocking columns from sanitized records.
+
+    `definitions` maps the name of each blocking key to a list of its components.
+    A component is either the name of a field, or a dict with a `field`, a `transform`
+    from `BLOCKING_TRANSFORMS` and, for `prefix`, a `length`:
+
+        ```
+            blocking:
+              name_year:
+                - {field: last, transform: soundex}
+                - {field: dob, transform: year}
+              zip3_month:
+                - {field: zip, transform: prefix, length: 3}
+                - {field: dob, transform: month}
+        ```
+
+    Each key is written as the truncated HMAC-SHA256 of its components, under a key derived from the secret,
+    the name and the definition. Sites that share the secret and the definition get the same keys for the
+    same values, and no cleartext leaves the site. A record with a blank component has no value for that key.
+    """
+    def __init__(self, secret, definitions, field_names):
+        if not isinstance(definitions, dict) or not definitions:
+            raise ValueError(f'blocking must map the name of each blocking key to a list of components, not {definitions!r}')
+
+        self.definitions = {
+                name: self._parse_definition(name, components, field_names)
+                for name, components in definitions.items()
+                }
+
+        master_key = hmac.new(secret.encode(), b'pprl blocking keys', hashlib.sha256).digest()
+        self._keys = {
+                name: hmac.new(master_key, json.dumps([name, components], sort_keys=True).encode(), hashlib.sha256).digest()
+                for name, components in self.definitions.items()
+                }
+
+    @staticmethod
+    def _parse_definition(name, components, field_names):
+        if not isinstance(components, list) or not components:
+            raise ValueError(f'Blocking key {name!r} must be a list of components, not {components!r}')
+
+        parsed = []
+        for component in components:
+            if isinstance(component, str):
+                component = {'field': component}
+            if not isinstance(component, dict) or set(component) - {'field', 'transform', 'length'}:
+                raise ValueError(f'Unexpected component of blocking key {name!r}: {component!r}')
+            component = {'transform': 'exact', **component}
+
+            if component.get('field') not in field_names:
+                raise ValueError(f'Blocking key {name!r} uses {component.get("field")!r}, which is not a hashed field: {", ".join(field_names)}')
+            if component['transform'] not in BLOCKING_TRANSFORMS:
+                raise ValueError(f'Blocking key {name!r} uses an unknown transform {component["transform"]!r}, not one of {", ".join(BLOCKING_TRANSFORMS)}')
+            if component['transform'] == 'prefix':
+                length = component.get('length')
+                if not isinstance(length, int) or length < 1:
+                    raise ValueError(f'The prefix in blocking key {name!r} needs a positive integer length, not {length!r}')
+            parsed.append(component)
+        return parsed
+
+    @property
+    def column_names(self):
+        return [BLOCK_COLUMN_PREFIX + name for name in self.definitions]
+
+    def columns(self, patients_df):
+        """
+        Return a DataFrame with the blocking key columns of each record in `patients_df` (sanitized values)
+        """
+        blocks = pd.DataFrame(index=patients_df.index)
+        for name, components in self.definitions.items():
+            parts = [
+                    BLOCKING_TRANSFORMS[c['transform']](patients_df[c['field']].fillna('').astype(str), c.get('length'))
+                    for c in components
+                    ]
+            blank = np.zeros(len(patients_df), dtype=bool)
+            for part in parts:
+                blank |= (part == '').to_numpy()
+            combined = parts[0].str.cat(parts[1:], sep=_COMPONENT_SEPARATOR) if len(parts) > 1 else parts[0]
+
+            # Each distinct combination is only HMACed once
+            codes, uniques = pd.factorize(combined)
+            key = self._keys[name]
+            digests = np.array([
+                hmac.new(key, x.encode(), hashlib.sha256).hexdigest()[:BLOCKING_KEY_HEX_DIGITS]
+                for x in uniques
+                ], dtype=object)
+            values = digests[codes]
+            values[blank] = ''
+            blocks[BLOCK_COLUMN_PREFIX + name] = values
+        return blocks
+
+def shared_block_columns(*hashes_dfs):
+    """
+    Return the blocking key columns present in every one of the hash files
+    """
+    columns = [
+            [c for c in df.columns if c.startswith(BLOCK_COLUMN_PREFIX)]
+            for df in hashes_dfs
+            ]
+    shared = [c for c in columns[0] if all(c in other for other in columns[1:])]
+    for df_columns in columns:
+        for c in df_columns:
+            if c not in shared:
+                logger.warning("Ignoring the blocking key %s, which is missing from the other hash file", c)
+    return shared
+
+def block_codes(hashes_dfs, block_columns):
+    """
+    Number the values of each blocking key across the hash files.
+
+    Returns, for each hash file, an int64 array with a row per record and a column per blocking key,
+    holding the same number wherever two records share a value of that key, and -1 where the key is blank.
+    """
+    codes = []
+    for column in block_columns:
+        values = pd.concat([df[column] for df in hashes_dfs], ignore_index=True)
+        column_codes, _ = pd.factorize(values.mask(values == ''))
+        codes.append(column_codes.astype(np.int64))
+    codes = np.stack(codes, axis=1) if codes else np.zeros((sum(len(df) for df in hashes_dfs), 0), dtype=np.int64)
+    codes = np.split(codes, np.cumsum([len(df) for df in hashes_dfs])[:-1])
+    for n, codes_n in enumerate(codes):
+        unblocked = int((codes_n < 0).all(axis=1).sum()) if len(block_columns) else 0
+        if unblocked:
+            logger.warning("%s records of hash file %s have no blocking keys, and won't be compared", unblocked, n + 1)
+    return codes
+
+def blocking_function(hashes_dfs, block_columns):
+    """
+    Return an anonlink blocking function, giving the blocking keys of each record in the hash files.
+
+    Records are only compared if they share a value of the same blocking key.
+    """
+    return codes_blocking_function(block_codes(hashes_dfs, block_columns))
+
+def codes_blocking_function(codes):
+    """
+    `blocking_function()` for the `block_codes()` of the hash files
+    """
+    record_blocks = [
+            [[(n, code) for n, code in enumerate(row) if code >= 0] for row in codes_n.tolist()]
+            for codes_n in codes
+            ]
+
+    def blocking_f(dataset_index, record_index, hash_):
+        return record_blocks[dataset_index][record_index]
+
+    return blocking_f
+
+def block_pair_filter(codes):
+    """
+    Return a function which, given arrays of record positions (left, right) in two hash files
+    with the `block_codes()` `codes`, returns which of those pairs share a value of the same blocking key.
+    """
+    codes_1, codes_2 = codes
+
+    def pair_filter(left, right):
+        shared = np.zeros(len(left), dtype=bool)
+        for column in range(codes_1.shape[1]):
+            left_codes = codes_1[left, column]
+            shared |= (left_codes == codes_2[right, column]) & (left_codes >= 0)
+        return shared
+
+    return pair_filter
@@ -9,7 +9,7 @@ import logging
 from pathlib import Path
 from datetime import datetime as dt
 
-from pprl.commands import create, match, synth, test, dedup, report
+from pprl.commands import create, match, synth, test, dedup, report, validate, watch
 
 curr_dt = dt.strftime(dt.now(), '%H%M%S')
 
@@ -19,7 +19,9 @@ COMMAND_MODULES = [
     test,
     report,
     synth,
+    validate,
     create,
+    watch,
     match,
     dedup,
 ]
@@ -51,7 +53,9 @@ def main(argv = None):
         pprl -> return usage.
         pprl test -> execute pytest.
         pprl synth -> create synthetic patient data
+        pprl validate -> run validate_patients()
         pprl create -> run create_CLKs()
+        pprl watch -> run watch_folder()
         pprl match -> run match_CLKs()
         pprl dedup -> Filter the patient identifier file for self-linkages
 
@@ -69,7 +73,7 @@ def main(argv = None):
     subparsers = parser.add_subparsers(
         dest="command",
         metavar="command",
-        help="Specify which subcommand to execute: [test, create, match, dedup]"
+        help="Specify which subcommand to execute: [test, validate, create, watch, match, dedup]"
     )
 
     # have each command module register itself
@@ -0,0 +1,52 @@
+#!./venv/bin/python
+
+import argparse
+import logging
+from pathlib import Path
+from pprl import pprl
+
+logger = logging.getLogger(__name__)
+
+def register_subcommand(subparsers):
+    """
+    register 'validate' as a subcommand within the top level entrypoint.
+    """
+    # set up validate_patients() command
+    validate_parser = subparsers.add_parser(
+        "validate",
+        help="Check the input data specified in create_CLKs.yml without hashing it"
+    )
+    validate_parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Enable verbose logging. (DEBUG)"
+    )
+    validate_parser.add_argument(
+        "config", nargs="?", default = "./my_files/create_CLKs.yml",
+        help="Name of the config file for hash creation. [Default: create_CLKs.yml]"
+    )
+    validate_parser.set_defaults(func=run_validate)
+
+def run_validate(args):
+    """
+    CLI handler for validate_patients()
+    """
+    cfg = Path(args.config)
+    logger.debug("Starting execution of 'validate_patients' with config: %s", cfg)
+
+    if not cfg.exists():
+        logger.error(f"Config file not found: %s", cfg)
+        return 1
+
+    # run it and log execution
+    try:
+        rc = pprl.validate_patients(args)
+        if rc == 0:
+            logger.debug("Execution of 'validate_patients' finished successfully.")
+        else:
+            logger.debug("Execution of 'validate_patients' failed with exit code %s", rc)
+        return rc
+    except Exception:
+        logger.exception("Unhandled error during 'validate_patients' execution.")
+        return 1
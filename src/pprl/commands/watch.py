@@ -0,0 +1,52 @@
+#!./venv/bin/python
+
+import argparse
+import logging
+from pathlib import Path
+from pprl import pprl
+
+logger = logging.getLogger(__name__)
+
+def register_subcommand(subparsers):
+    """
+    register 'watch' as a subcommand within the top level entrypoint.
+    """
+    # set up watch_folder() command
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Hash each patient file that lands in the folder specified in watch.yml"
+    )
+    watch_parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Enable verbose logging. (DEBUG)"
+    )
+    watch_parser.add_argument(
+        "config", nargs="?", default = "./my_files/watch.yml",
+        help="Name of the config file for watching a folder. [Default: watch.yml]"
+    )
+    watch_parser.set_defaults(func=run_watch)
+
+def run_watch(args):
+    """
+    CLI handler for watch_folder()
+    """
+    cfg = Path(args.config)
+    logger.debug("Starting execution of 'watch_folder' with config: %s", cfg)
+
+    if not cfg.exists():
+        logger.error(f"Config file not found: %s", cfg)
+        return 1
+
+    # run it and log execution
+    try:
+        rc = pprl.watch_folder(args)
+        if rc == 0:
+            logger.debug("Execution of 'watch_folder' finished successfully.")
+        else:
+            logger.debug("Execution of 'watch_folder' failed with exit code %s", rc)
+        return rc
+    except Exception:
+        logger.exception("Unhandled error during 'watch_folder' execution.")
+        return 1
@@ -0,0 +1,493 @@
+# hashing.py
+
+import hashlib
+import hmac
+import json
+import logging
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import md5, sha1
+from itertools import chain
+from operator import itemgetter
+
+from bitarray import bitarray
+from clkhash import clk
+from clkhash.field_formats import Ignore, InvalidEntryError
+from clkhash.key_derivation import generate_key_lists
+from clkhash.schema import from_json_dict
+from clkhash.serialization import serialize_bitarray
+from clkhash.stats import OnlineMeanVariance
+from clkhash.validate_data import EntryError, validate_header, validate_row_lengths
+from tqdm import tqdm
+
+from .util import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Below this many records per worker, splitting the work costs more than it saves.
+MIN_SHARD_SIZE = 1000
+
+# Ways to turn records into CLKs. Both give bit-identical CLKs.
+#   clkhash: clkhash's own encoder, one record at a time
+#   numpy:   NumpyCLKEncoder, a batch of records at a time
+ENGINES = ('clkhash', 'numpy')
+
+# Most records CLKHasher.hash() holds as Python strings at once
+RECORDS_SLICE_SIZE = 500_000
+
+# Set in each worker process by _init_worker()
+_worker_secret = None
+_worker_schema = None
+_worker_encoder = None
+
+def _init_worker(secret, schema_dict, engine):
+    """
+    Build the schema (and encoder) once per worker process; clkhash derives keys from the secret as each shard is hashed.
+    """
+    global _worker_secret, _worker_schema, _worker_encoder
+    _worker_secret = secret
+    _worker_schema = from_json_dict(schema_dict)
+    if engine == 'numpy':
+        _worker_encoder = NumpyCLKEncoder(_worker_schema, secret)
+
+def _hash_shard(records):
+    """
+    Hash one shard of records inside a worker process.
+
+    Returns the CLKs and, for the numpy engine, the memo hits and misses of each feature while hashing this shard.
+    """
+    before = _worker_encoder.memo_stats() if _worker_encoder is not None else {}
+    hashed_data = _generate_clks(records, _worker_schema, _worker_secret, False, 1, _worker_encoder)
+    after = _worker_encoder.memo_stats() if _worker_encoder is not None else {}
+    return hashed_data, {name: (hits - before[name][0], misses - before[name][1]) for name, (hits, misses) in after.items()}
+
+class CLKHasher:
+    """
+    Generate CLKs for schema-ordered records, optionally across a pool of worker processes.
+
+    - `workers = None`: leave it to clkhash, which may start its own processes (the original behaviour).
+    - `workers = 1`: hash everything in this process.
+    - `workers > 1`: split the records into shards, hash them in a process pool, and
+      return the CLKs in the original record order.
+
+    `engine` is one of `ENGINES`. The numpy engine never starts processes of its own.
+
+    Use it as a context manager so that the pool is shut down afterwards.
+    """
+    def __init__(self, secret, schema_dict, workers = None, engine = 'clkhash'):
+        if workers is not None and (not isinstance(workers, int) or workers < 1):
+            raise ValueError(f'workers must be a positive integer, not {workers!r}')
+        if engine not in ENGINES:
+            raise ValueError(f'engine must be one of {", ".join(ENGINES)}, not {engine!r}')
+        self.secret = secret
+        self.schema_dict = schema_dict
+        self.schema = from_json_dict(schema_dict)
+        self.workers = workers
+        self.engine = engine
+        self._pool = None
+        self._shard_memo_stats = {}
+
+        # Built up front, so that a schema the numpy engine can't encode fails before any records are read
+        self._encoder = NumpyCLKEncoder(self.schema, secret) if engine == 'numpy' else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            logger.debug("Shutting down the pool of %s hashing processes", self.workers)
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            logger.debug("Starting a pool of %s hashing processes", self.workers)
+            # Spawned workers inherit nothing, so each one rebuilds the schema from the same dict and secret.
+            self._pool = ProcessPoolExecutor(
+                    max_workers = self.workers,
+                    mp_context = multiprocessing.get_context("spawn"),
+                    initializer = _init_worker,
+                    initargs = (self.secret, self.schema_dict, self.engine),
+                    )
+        return self._pool
+
+    def hash(self, patients_df, progress_bar = False):
+        """
+        Return a list of CLKs (bitarrays), one for each row of `patients_df`, in the same order
+        """
+        if len(patients_df) <= RECORDS_SLICE_SIZE:
+            return self.hash_records(self.records(patients_df), progress_bar = progress_bar)
+
+        # Records are Python strings, so a large (or compact) frame is turned into records a slice at a time
+        self.records(patients_df.iloc[:0])
+        clks = []
+        for start in range(0, len(patients_df), RECORDS_SLICE_SIZE):
+            records = _as_records(patients_df.iloc[start:start + RECORDS_SLICE_SIZE])
+            clks += self.hash_records(records, progress_bar = progress_bar)
+        return clks
+
+    def records(self, patients_df):
+        """
+        Check the columns of `patients_df` against the schema and return its records in the form clkhash hashes
+        """
+        # clkhash checks the CSV header against the schema; the index is the schema's first, unnamed feature.
+        validate_header(self.schema.fields, [patients_df.index.name or '', *patients_df.columns])
+        return _as_records(patients_df)
+
+    def hash_records(self, records, progress_bar = False):
+        """
+        Return a list of CLKs (bitarrays), one for each record returned by `records()`, in the same order
+        """
+        if self.workers is None or self.workers == 1 or len(records) < 2 * MIN_SHARD_SIZE:
+            return _generate_clks(records, self.schema, self.secret, progress_bar, self.workers, self._encoder)
+
+        # A few shards per worker keeps every process busy when shards take uneven time.
+        num_shards = min(4 * self.workers, len(records) // MIN_SHARD_SIZE)
+        shard_size = -(-len(records) // num_shards)
+        shards = [records[start:start + shard_size] for start in range(0, len(records), shard_size)]
+        logger.debug("Hashing %s records in %s shards across %s processes", len(records), len(shards), self.workers)
+
+        # map() returns results in submission order, so the CLKs stay in row_id order.
+        hashed_data = []
+        for shard_hashes, memo_stats in self._get_pool().map(_hash_shard, shards):
+            hashed_data.extend(shard_hashes)
+            for name, (hits, misses) in memo_stats.items():
+                total_hits, total_misses = self._shard_memo_stats.get(name, (0, 0))
+                self._shard_memo_stats[name] = (total_hits + hits, total_misses + misses)
+        return hashed_data
+
+    def log_stats(self):
+        """
+        Log how often the numpy engine found each feature's values in its memo, in this process and in the workers
+        """
+        if self._encoder is None:
+            return
+        for name, (hits, misses) in self._encoder.memo_stats().items():
+            shard_hits, shard_misses = self._shard_memo_stats.get(name, (0, 0))
+            hits, misses = hits + shard_hits, misses + shard_misses
+            lookups = hits + misses
+            logger.debug("Bit-position memo for %s: %s hits, %s misses (%.1f%% hit rate)",
+                    name, hits, misses, 100 * hits / lookups if lookups else 0.0)
+
+def _generate_clks(records, schema, secret, progress_bar, max_workers, encoder = None):
+    """
+    Hash records with clkhash, or with `encoder` if one is given,
+    showing the same progress bar as `clk.generate_clk_from_csv()`
+    """
+    if encoder is not None:
+        generate_clks = encoder.generate_clks
+    else:
+        def generate_clks(records, callback = None):
+            return clk.generate_clks(records, schema, secret, callback = callback, max_workers = max_workers)
+
+    if not progress_bar:
+        return generate_clks(records)
+
+    stats = OnlineMeanVariance()
+    with tqdm(desc = "generating CLKs", total = len(records), unit = "clk", unit_scale = True,
+              postfix = {"mean": stats.mean(), "std": stats.std()}) as pbar:
+        def callback(tics, clk_stats):
+            stats.update(clk_stats)
+            pbar.set_postfix(mean = stats.mean(), std = stats.std(), refresh = False)
+            pbar.update(tics)
+
+        return generate_clks(records, callback = callback)
+
+def _as_records(patients_df):
+    """
+    Return the records as tuples of strings in the schema's column order, index first.
+
+    The strings are the ones clkhash would read back from `patients_df.to_csv()`: missing values become empty strings.
+    """
+    columns = [patients_df.index.to_series(), *(patients_df[name] for name in patients_df.columns)]
+    return list(zip(*(column.astype(str).mask(column.isna(), '').to_numpy(dtype=object) for column in columns)))
+
+# Records encoded together by NumpyCLKEncoder. This bounds the size of its temporary arrays.
+NUMPY_BATCH_SIZE = 100_000
+
+# Upper limit on the number of values of each feature whose Bloom filters NumpyCLKEncoder remembers
+BIT_POSITION_MEMO_SIZE = 50_000
+
+class NumpyCLKEncoder:
+    """
+    Encode records into CLKs a column at a time with NumPy, bit for bit as `clk.generate_clks()` does.
+
+    Each distinct value of a feature is formatted and tokenized once, by the schema's own field and comparator objects,
+    and each distinct token is hashed once with the feature's keys. The bit positions of all tokens are computed together
+    with array arithmetic and set in a matrix of packed 64-bit words, one row per distinct value,
+    and each record's row of the batch's matrix is the OR of its values' rows.
+
+    The rows of each feature's values are also kept in a bounded LRU memo for the life of the encoder,
+    so that common values (a state, a popular city or surname) are only validated and hashed the first time they're seen.
+
+    All of clkhash's comparisons, insertion strategies and key derivation settings are supported,
+    with the `doubleHash` (including `preventSingularity`) and `blakeHash` hash types.
+    The Bloom filter length must be a multiple of 64 bits.
+    """
+    def __init__(self, schema, secret):
+        self.check_schema(schema)
+        self.schema = schema
+        self.hash_l = schema.l * 2 ** schema.xor_folds
+        self.memos = {
+                field.identifier: LRUCache(BIT_POSITION_MEMO_SIZE)
+                for field in schema.fields if field.hashing_properties is not None
+                }
+        self.keys = generate_key_lists(
+                secret,
+                len(schema.fields),
+                key_size = schema.kdf_key_size,
+                salt = schema.kdf_salt,
+                info = schema.kdf_info,
+                kdf = schema.kdf_type,
+                hash_algo = schema.kdf_hash,
+                )
+
+    @staticmethod
+    def check_schema(schema):
+        """
+        Raise a ValueError if the schema uses anything this encoder can't reproduce
+        """
+        if schema.l % 64 != 0:
+            raise ValueError(f'The numpy engine needs a Bloom filter length that is a multiple of 64, not {schema.l}')
+        hash_l = schema.l * 2 ** schema.xor_folds
+        for field in schema.fields:
+            fhp = field.hashing_properties
+            if fhp is None:
+                continue
+            if fhp.hash_type not in ('doubleHash', 'blakeHash'):
+                raise ValueError(f"Unsupported hash type '{fhp.hash_type}'")
+            if fhp.hash_type == 'blakeHash' and hash_l & (hash_l - 1):
+                raise ValueError(
+                        'parameter "l" has to be a power of two for the BLAKE2 encoding, '
+                        f'but was: {hash_l}')
+
+    def generate_clks(self, records, callback = None):
+        """
+        Return a list of CLKs (bitarrays), one for each record, calling `callback(count, popcounts)` after each batch
+        """
+        validate_row_lengths(self.schema.fields, records)
+        clks = []
+        for start in range(0, len(records), NUMPY_BATCH_SIZE):
+            batch = self.encode(records[start:start + NUMPY_BATCH_SIZE], row_index_offset = start)
+            if callback is not None:
+                callback(len(batch), [x.count() for x in batch])
+            clks.extend(batch)
+        return clks
+
+    def encode(self, records, row_index_offset = 0):
+        """
+        Validate and encode one batch of records
+        """
+        columns = list(zip(*records))
+        factorized = [pd.factorize(np.array(column, dtype=object)) for column in columns]
+        self._validate(factorized, row_index_offset)
+
+        matrix = np.zeros((len(records), self.hash_l // 64), dtype='<u8')
+        for field, keys, (codes, uniques) in zip(self.schema.fields, self.keys, factorized):
+            if field.hashing_properties is not None:
+                def value_filters(values):
+                    return [row.tobytes() for row in self._value_filters(field, keys, values)]
+
+                rows = self.memos[field.identifier].get_many(field.identifier, uniques.tolist(), value_filters)
+                filters = np.frombuffer(b''.join(rows), dtype='<u8').reshape(len(uniques), matrix.shape[1])
+                matrix |= filters[codes]
+
+        for _ in range(self.schema.xor_folds):
+            half = matrix.shape[1] // 2
+            matrix = matrix[:, :half] ^ matrix[:, half:]
+
+        # Little-endian words hold the bytes of a big-endian bitarray in order
+        packed = np.ascontiguousarray(matrix).view(np.uint8)
+        clks = []
+        for row in packed:
+            bf = bitarray(endian = 'big')
+            bf.frombytes(row.tobytes())
+            clks.append(bf)
+        return clks
+
+    def _validate(self, factorized, row_index_offset):
+        """
+        Validate each distinct value, and raise the error clkhash would raise for the first invalid entry
+        """
+        first_error = None
+        for field, (codes, uniques) in zip(self.schema.fields, factorized):
+            memo = self.memos.get(field.identifier)
+            for code, value in enumerate(uniques):
+                # Only valid values make it into the memo
+                if memo is not None and (field.identifier, value) in memo:
+                    continue
+                try:
+                    field.validate(value)
+                except InvalidEntryError as e:
+                    row_n = int(np.argmax(codes == code))
+                    if first_error is None or row_n < first_error[0]:
+                        first_error = (row_n, e)
+        if first_error is not None:
+            row_n, e = first_error
+            row_index = row_n + row_index_offset
+            e_invalid_entry = EntryError(
+                    f"Invalid entry in row {row_index}, column '{e.field_spec.identifier}'. {e.args[0]}")
+            e_invalid_entry.field_spec = e.field_spec
+            e_invalid_entry.row_index = row_index
+            raise e_invalid_entry from e
+
+    def memo_stats(self):
+        """
+        Return the hits and misses of each feature's memo
+        """
+        return {name: (memo.hits, memo.misses) for name, memo in self.memos.items()}
+
+    def _value_filters(self, field, keys, uniques):
+        """
+        Return the Bloom filter of each distinct value on its own, as rows of packed 64-bit words
+        """
+        fhp = field.hashing_properties
+
+        # Tokenize each value, and number the distinct tokens
+        ngrams = [list(fhp.comparator.tokenize(field.format_value(value))) for value in uniques]
+        num_tokens = np.array([len(x) for x in ngrams], dtype=np.int64)
+        token_k = np.fromiter(
+                chain.from_iterable(fhp.strategy.bits_per_token(len(x)) for x in ngrams if x),
+                dtype=np.int64, count=int(num_tokens.sum()))
+        token_id, tokens = pd.factorize(np.fromiter(chain.from_iterable(ngrams), dtype=object, count=len(token_k)))
+        token_value = np.repeat(np.arange(len(uniques)), num_tokens)
+
+        # Each token sets k bits: i = 0, 1, ..., k - 1
+        occurrence = np.repeat(np.arange(len(token_k)), token_k)
+        i = np.arange(len(occurrence)) - np.repeat(np.cumsum(token_k) - token_k, token_k)
+
+        tokens = [token.encode(fhp.encoding) for token in tokens]
+        if len(occurrence) == 0:
+            positions = np.zeros(0, dtype=np.int64)
+        elif fhp.hash_type == 'doubleHash':
+            hashes = np.array([
+                    _double_hash_token(token, self.hash_l, keys[0], keys[1], fhp.prevent_singularity)
+                    for token in tokens
+                    ], dtype=np.int64)
+            md5hm = hashes[token_id[occurrence], 0]
+            sha1hm = hashes[token_id[occurrence], 1]
+            positions = (sha1hm + i * md5hm) % self.hash_l
+        else:
+            # Every 64-byte digest is read as 32 unsigned shorts in native byte order
+            num_macs = (int(token_k.max()) + 31) // 32
+            key = bytes(keys[0])
+            digests = b''.join(
+                    hashlib.blake2b(token, key = key, salt = str(n).encode()).digest()
+                    for token in tokens for n in range(num_macs))
+            shorts = np.frombuffer(digests, dtype=np.uint16).reshape(len(tokens), 32 * num_macs)
+            positions = shorts[token_id[occurrence], i].astype(np.int64) % self.hash_l
+
+        filters = np.zeros((len(uniques), self.hash_l // 64), dtype='<u8')
+        _set_bits(filters, token_value[occurrence], positions)
+        return filters
+
+def _double_hash_token(token, l, key_sha1, key_md5, non_singular):
+    """
+    The two hashes of a token used by clkhash's doubleHash, modulo `l`
+    """
+    sha1hm = int.from_bytes(hmac.new(key_sha1, token, sha1).digest(), 'big') % l
+    md5hm = int.from_bytes(hmac.new(key_md5, token, md5).digest(), 'big') % l
+    i = 0
+    while non_singular and md5hm == 0:
+        md5hm = int.from_bytes(hmac.new(key_md5, token + chr(i).encode(), md5).digest(), 'big') % l
+        i += 1
+    return md5hm, sha1hm
+
+def _set_bits(matrix, rows, positions):
+    """
+    Set bit `positions[n]` of row `rows[n]` of a matrix of packed 64-bit words, for every n
+    """
+    # Bit p of a big-endian bitarray is bit 7 - p % 8 of byte p // 8, and byte b is bits 8 * (b % 8) and up of word b // 8
+    shifts = (8 * ((positions & 63) >> 3) + 7 - (positions & 7)).astype(np.uint64)
+    np.bitwise_or.at(matrix, (rows, positions >> 6), np.left_shift(np.uint64(1), shifts))
+
+class CLKCache:
+    """
+    The CLKs from an earlier run, reused for records that haven't changed since.
+
+    The cache file holds the row_id, a fingerprint and the serialized CLK of every record hashed in the last run.
+    The fingerprint is a BLAKE2 hash of the values that go into the record's CLK, keyed by the secret and the schema,
+    so changing either one invalidates every entry and the file reveals nothing about the values without the secret.
+
+    New entries are written next to the cache file, which is only replaced by `commit()` once the whole run succeeds.
+    """
+    def __init__(self, path, secret, schema_dict):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        schema_digest = hashlib.sha256(json.dumps(schema_dict, sort_keys = True).encode()).digest()
+        self._key = hmac.new(secret.encode(), b'pprl clk cache' + schema_digest, hashlib.sha256).digest()
+
+        self._entries = {}
+        if os.path.isfile(path):
+            logger.debug("Reading cached CLKs from %s", path)
+            cache_df = pd.read_csv(path, dtype = {'row_id': 'int', 'fingerprint': str, 'clk': str})
+            self._entries = dict(zip(cache_df['row_id'], zip(cache_df['fingerprint'], cache_df['clk'])))
+            logger.info("Read %s cached CLKs from %s", len(self._entries), path)
+        else:
+            logger.info("No CLK cache at %s yet, so every record will be hashed", path)
+
+        self._new_path = f"{path}.new"
+        self._new_entries = 0
+
+    def fingerprint(self, values):
+        # repr() of a string or tuple of strings is an unambiguous encoding, and much quicker than json.dumps()
+        return hashlib.blake2b(repr(values).encode(), key = self._key, digest_size = 32).hexdigest()
+
+    def hash(self, hasher, patients_df, progress_bar = False):
+        """
+        Return the serialized CLK of each row of `patients_df`, and a boolean list flagging the rows that were (re-)hashed
+        """
+        records = hasher.records(patients_df)
+        # Ignored features, such as the index, don't change the CLK
+        hashed_values = itemgetter(*(n for n, field in enumerate(hasher.schema.fields) if not isinstance(field, Ignore)))
+        fingerprints = [self.fingerprint(hashed_values(record)) for record in records]
+
+        clks = []
+        changed = []
+        for row_id, fingerprint in zip(patients_df['row_id'], fingerprints):
+            cached_fingerprint, cached_clk = self._entries.get(row_id, (None, None))
+            hit = fingerprint == cached_fingerprint
+            clks.append(cached_clk if hit else None)
+            changed.append(not hit)
+
+        rows = [n for n, is_changed in enumerate(changed) if is_changed]
+        self.hits += len(records) - len(rows)
+        self.misses += len(rows)
+        logger.debug("Hashing %s new or changed records out of %s", len(rows), len(records))
+
+        hashed_data = hasher.hash_records([records[n] for n in rows], progress_bar = progress_bar) if rows else []
+        for n, clk in zip(rows, hashed_data):
+            clks[n] = serialize_bitarray(clk)
+
+        # Every field is a number, a hex digest or base64, so no quoting is needed (and to_csv() is much slower).
+        with open(self._new_path, 'w' if self._new_entries == 0 else 'a') as cache_file:
+            if self._new_entries == 0:
+                cache_file.write("row_id,fingerprint,clk\n")
+            cache_file.writelines(f"{row_id},{fingerprint},{clk}\n"
+                    for row_id, fingerprint, clk in zip(patients_df['row_id'], fingerprints, clks))
+        self._new_entries += len(records)
+
+        return clks, changed
+
+    def commit(self):
+        """
+        Replace the cache file with the CLKs of this run
+        """
+        if self._new_entries == 0:
+            with open(self._new_path, 'w') as cache_file:
+                cache_file.write("row_id,fingerprint,clk\n")
+        os.replace(self._new_path, self.path)
+        logger.debug("Wrote %s CLKs to the cache at %s", self._new_entries, self.path)
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        logger.info("CLK CACHE: reused %s of %s CLKs (%.1f%%), hashed %s",
+                self.hits, total, 100 * self.hits / total if total else 0.0, self.misses)
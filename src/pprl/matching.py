@@ -0,0 +1,644 @@
+# matching.py
+
+import anonlink
+import base64
+import logging
+import multiprocessing
+import numpy as np
+from bitarray import bitarray
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .blocking import block_pair_filter, codes_blocking_function
+
+logger = logging.getLogger(__name__)
+
+# Ways `match` can find the pairs of CLKs with a Dice coefficient of at least the threshold
+MATCH_ENGINES = ('anonlink', 'lsh', 'numpy', 'blas')
+
+# Default number of bands, and of sampled bits in each band, of the LSH engine.
+# Measured with benchmarks/lsh.py on the 100-patient schema at a threshold of 0.9.
+LSH_BANDS = 64
+LSH_ROWS = 28
+
+# Seed of the bit positions sampled for each band. Both inputs of a match use the same positions.
+LSH_SEED = 0
+
+# Rows of the first and second input the numpy engine compares at once. The temporaries of a block
+# (1 MB of ANDed words) stay in cache; measured with benchmarks/match_engines.py.
+NUMPY_BLOCK_ROWS = 16
+NUMPY_BLOCK_COLUMNS = 8192
+
+# Default memory, in MB, the blas engine's tiles of unpacked bits and intersection counts may take up
+BLAS_MEMORY_MB = 256
+
+# Fewest rows of the first input, sorted by popcount, the exact engines compare with one popcount window
+# of the second. Rows with nearby popcounts are grouped until there are this many, so that the window
+# widens a little rather than each popcount costing a separate call to the engine; with smaller groups
+# the calls cost more than they save (benchmarks/popcount_pruning.py).
+PRUNE_MIN_ROWS = 2048
+
+# Row ranges of the first input each worker of a MatchPool is given, so that a worker
+# which gets through its ranges quickly can take on others
+MATCH_TASKS_PER_WORKER = 4
+
+# Row ranges a self match is split into. Each range is compared with itself and the rows after it,
+# so about (1 + 1 / SELF_MATCH_RANGES) / 2 of all pairs are compared.
+SELF_MATCH_RANGES = 16
+
+# Candidate pairs verified at once, which bounds the memory used by verification
+_VERIFY_CHUNK_PAIRS = 1 << 20
+
+_POPCOUNT = np.array([bin(n).count('1') for n in range(256)], dtype=np.uint16)
+
+def clk_array(clks):
+    """
+    Return CLKs, either serialized or as bitarrays, as the rows of a 2-D uint8 array of their bytes
+    """
+    if not len(clks):
+        return np.zeros((0, 0), dtype=np.uint8)
+    if isinstance(clks[0], str):
+        data = [base64.b64decode(x) for x in clks]
+    else:
+        data = [x.tobytes() for x in clks]
+    return np.frombuffer(b''.join(data), dtype=np.uint8).reshape(len(data), -1)
+
+def bitarray_views(clks):
+    """
+    Bitarrays sharing the memory of each row of a CLK array, as anonlink compares them
+    """
+    buffer = memoryview(np.ascontiguousarray(clks)).cast('B')
+    width = clks.shape[1]
+    return [bitarray(buffer=buffer[n * width:(n + 1) * width], endian='big') for n in range(len(clks))]
+
+def popcounts(clks):
+    """
+    Number of bits set in each row of a CLK array
+    """
+    return _POPCOUNT[clks].sum(axis=1, dtype=np.int64)
+
+def packed_clks(clks):
+    """
+    A CLK array as a contiguous array of uint64 words, the last padded with zero bits
+    """
+    padding = -clks.shape[1] % 8
+    if padding:
+        clks = np.pad(clks, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(clks).view(np.uint64)
+
+def numpy_matching_pairs(clks_1, clks_2, threshold, codes = None):
+    """
+    `find_matching_pairs()` with NumPy: the CLKs are packed into uint64 words, and the number of bits
+    each pair of a block of rows shares is counted with one vectorized AND and `np.bitwise_count` per word.
+    """
+    words_1 = packed_clks(clks_1)
+    words_2 = packed_clks(clks_2)
+    counts_1 = np.bitwise_count(words_1).sum(axis=1, dtype=np.int64)
+    counts_2 = np.bitwise_count(words_2).sum(axis=1, dtype=np.int64)
+    # Each word of the second input's CLKs, contiguous across records, so that a block reads it in one run
+    columns_2 = np.ascontiguousarray(words_2.T)
+    pair_filter = block_pair_filter(codes) if codes is not None else None
+    # Slightly below the threshold, so that float32 rounding can't drop a pair; the exact Dice coefficient decides
+    bound = np.float32(threshold * (1 - 1e-6))
+    # Twice the bits a pair shares must fit, but counting in uint16 is faster whenever it does
+    shared_dtype = np.uint16 if 2 * 64 * words_1.shape[1] <= np.iinfo(np.uint16).max else np.uint32
+
+    lefts, rights = [], []
+    for start_1 in range(0, len(words_1), NUMPY_BLOCK_ROWS):
+        block_1 = words_1[start_1:start_1 + NUMPY_BLOCK_ROWS]
+        block_counts_1 = counts_1[start_1:start_1 + NUMPY_BLOCK_ROWS]
+        for start_2 in range(0, len(words_2), NUMPY_BLOCK_COLUMNS):
+            block_2 = columns_2[:, start_2:start_2 + NUMPY_BLOCK_COLUMNS]
+            block_counts_2 = counts_2[start_2:start_2 + NUMPY_BLOCK_COLUMNS]
+            shared = np.zeros((len(block_1), block_2.shape[1]), dtype=shared_dtype)
+            for word in range(block_1.shape[1]):
+                shared += np.bitwise_count(block_1[:, word, None] & block_2[word])
+            totals = block_counts_1[:, None].astype(np.float32) + block_counts_2[None, :].astype(np.float32)
+            left, right = np.divmod(np.flatnonzero(2 * shared >= bound * totals), block_2.shape[1])
+            left = left + start_1
+            right = right + start_2
+            # The same double precision Dice coefficient anonlink compares with the threshold
+            total = counts_1[left] + counts_2[right]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                keep = (total > 0) & (2 * shared[left - start_1, right - start_2] / total >= threshold)
+            if pair_filter is not None:
+                keep &= pair_filter(left, right)
+            lefts.append(left[keep])
+            rights.append(right[keep])
+    if not lefts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(lefts).astype(np.int64), np.concatenate(rights).astype(np.int64)
+
+def blas_tile_rows(bit_length, memory_mb = BLAS_MEMORY_MB):
+    """
+    Rows of each input in a tile of the blas engine, so that a tile takes up about `memory_mb` MB
+    """
+    # A tile of t rows of each input holds two t x (bit_length + 2) float32 matrices,
+    # and for each of its t * t pairs a float32 product and a bool for the threshold (5 bytes)
+    budget = memory_mb * 2**20
+    width = bit_length + 2
+    rows = (-8 * width + np.sqrt(64 * width**2 + 20 * budget)) / 10
+    return max(1, int(rows))
+
+def blas_matching_pairs(clks_1, clks_2, threshold, codes = None, memory_mb = BLAS_MEMORY_MB):
+    """
+    `find_matching_pairs()` by matrix multiplication. Tiles of CLKs are unpacked into float32 matrices of their bits,
+    which one BLAS call (multithreaded, if NumPy's BLAS is) multiplies for every pair of the tile. Each matrix has
+    two more columns, so that the product is 2 * shared - threshold * (count_1 + count_2) rather than the bits shared,
+    which is at least 0 exactly when the Dice coefficient clears the threshold.
+    Tiles are sized to fit in `memory_mb` MB.
+    """
+    counts_1 = popcounts(clks_1)
+    counts_2 = popcounts(clks_2)
+    pair_filter = block_pair_filter(codes) if codes is not None else None
+    tile = blas_tile_rows(8 * max(clks_1.shape[1], clks_2.shape[1]), memory_mb)
+    logger.debug("Matching with BLAS in tiles of %s x %s records", tile, tile)
+
+    def tile_matrix(clks, start, scale, last_columns):
+        bits = np.unpackbits(clks[start:start + tile], axis=1)
+        matrix = np.empty((len(bits), bits.shape[1] + 2), dtype=np.float32)
+        np.multiply(bits, scale, out=matrix[:, :-2])
+        matrix[:, -2:] = last_columns[start:start + tile]
+        return matrix
+
+    # [2 * bits_1, -threshold * count_1, -threshold] @ [bits_2, 1, count_2].T
+    last_columns_1 = np.stack([-threshold * counts_1, np.full(len(counts_1), -threshold)], axis=1)
+    last_columns_2 = np.stack([np.ones(len(counts_2)), counts_2], axis=1)
+    lefts, rights = [], []
+    for start_1 in range(0, len(clks_1), tile):
+        matrix_1 = tile_matrix(clks_1, start_1, 2, last_columns_1)
+        for start_2 in range(0, len(clks_2), tile):
+            matrix_2 = tile_matrix(clks_2, start_2, 1, last_columns_2)
+            # The bits' part of each product is an exact integer, so float32 rounding of the rest stays far below 0.5
+            margins = matrix_1 @ matrix_2.T
+            left, right = np.divmod(np.flatnonzero(margins >= -0.5), margins.shape[1])
+            lefts.append(left + start_1)
+            rights.append(right + start_2)
+    if not lefts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    left, right = np.concatenate(lefts).astype(np.int64), np.concatenate(rights).astype(np.int64)
+
+    # The same double precision Dice coefficient anonlink compares with the threshold
+    keep = (counts_1[left] + counts_2[right] > 0) & (dice_pairs(clks_1, clks_2, left, right, counts_1, counts_2) >= threshold)
+    if pair_filter is not None:
+        keep &= pair_filter(left, right)
+    return left[keep], right[keep]
+
+def dice_pairs(clks_1, clks_2, left, right, counts_1 = None, counts_2 = None):
+    """
+    Dice coefficient of each pair of rows (clks_1[left[n]], clks_2[right[n]]), as anonlink computes it
+    (0 if neither CLK has a bit set). `counts_1` and `counts_2` are the `popcounts()` of both arrays, if known.
+    """
+    counts_1 = popcounts(clks_1) if counts_1 is None else counts_1
+    counts_2 = popcounts(clks_2) if counts_2 is None else counts_2
+    similarities = np.empty(len(left), dtype=np.float64)
+    for start in range(0, len(left), _VERIFY_CHUNK_PAIRS):
+        chunk_left = left[start:start + _VERIFY_CHUNK_PAIRS]
+        chunk_right = right[start:start + _VERIFY_CHUNK_PAIRS]
+        shared = _POPCOUNT[clks_1[chunk_left] & clks_2[chunk_right]].sum(axis=1, dtype=np.int64)
+        total = counts_1[chunk_left] + counts_2[chunk_right]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarities[start:start + len(chunk_left)] = np.where(total > 0, 2 * shared / total, 0.0)
+    return similarities
+
+class BitSampleLSH:
+    """
+    Locality-sensitive hashing of CLKs by bit sampling.
+
+    Each of `bands` bands samples `rows` bit positions of the CLKs at random. Two CLKs land in the same bucket
+    of a band if they agree on all of its sampled bits, and only pairs which share a bucket in at least one band
+    are compared. Two CLKs agreeing on a fraction p of their bits share a bucket of some band with probability
+    1 - (1 - p^rows)^bands, so more rows make buckets smaller and faster to compare, and more bands find more
+    of the pairs which differ in a few bits.
+    """
+    def __init__(self, bit_length, bands = LSH_BANDS, rows = LSH_ROWS, seed = LSH_SEED):
+        if bands < 1:
+            raise ValueError(f"LSH needs at least one band, not {bands}")
+        if not 1 <= rows <= min(64, bit_length):
+            raise ValueError(f"Each LSH band samples between 1 and {min(64, bit_length)} bits, not {rows}")
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.default_rng(seed)
+        self.positions = np.stack([rng.choice(bit_length, size=rows, replace=False) for _ in range(bands)])
+
+    def band_keys(self, clks, band):
+        """
+        Bucket of each CLK in one band: its sampled bits, packed into a uint64
+        """
+        keys = np.zeros(len(clks), dtype=np.uint64)
+        for n, position in enumerate(self.positions[band]):
+            # bitarray (and so clkhash) stores the first bit of each byte in its high bit
+            bits = (clks[:, position // 8] >> (7 - position % 8)) & 1
+            keys |= bits.astype(np.uint64) << np.uint64(n)
+        return keys
+
+    def band_candidates(self, clks_1, clks_2, band):
+        """
+        Every pair of rows of the two CLK arrays which share a bucket in one band, as arrays of positions (left, right)
+        """
+        keys_1 = self.band_keys(clks_1, band)
+        keys_2 = keys_1 if clks_2 is clks_1 else self.band_keys(clks_2, band)
+        order = np.argsort(keys_2, kind='stable')
+        sorted_keys = keys_2[order]
+        starts = np.searchsorted(sorted_keys, keys_1, side='left')
+        counts = np.searchsorted(sorted_keys, keys_1, side='right') - starts
+        left = np.repeat(np.arange(len(clks_1)), counts)
+        # Offset of each pair within the bucket of its left record, then its position in the sorted keys
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(counts) - counts, counts)
+        right = order[np.repeat(starts, counts) + offsets]
+        return left, right
+
+    def find_candidate_pairs(self, clks_1, clks_2, threshold, pair_filter = None):
+        """
+        Find the pairs of rows of the two CLK arrays sharing a bucket in any band, with a Dice coefficient
+        of at least `threshold`. `pair_filter(left, right)`, if given, returns which candidate pairs to verify.
+
+        Returns (similarities, (left, right)) like anonlink's `find_candidate_pairs`, ordered by left then right.
+        """
+        counts_1 = popcounts(clks_1)
+        counts_2 = popcounts(clks_2)
+        width = np.int64(len(clks_2))
+        matches = []
+        candidates = 0
+        for band in range(self.bands):
+            left, right = self.band_candidates(clks_1, clks_2, band)
+            if pair_filter is not None:
+                keep = pair_filter(left, right)
+                left, right = left[keep], right[keep]
+            candidates += len(left)
+            similarities = dice_pairs(clks_1, clks_2, left, right, counts_1, counts_2)
+            found = similarities >= threshold
+            matches.append(left[found].astype(np.int64) * width + right[found])
+        # A pair sharing buckets in several bands is found once per band
+        pairs = np.unique(np.concatenate(matches)) if matches else np.zeros(0, dtype=np.int64)
+        left, right = pairs // width, pairs % width
+        logger.info("LSH made %s comparisons in %s bands of %s bits, against %s for all pairs",
+                candidates, self.bands, self.rows, len(clks_1) * len(clks_2))
+        return dice_pairs(clks_1, clks_2, left, right, counts_1, counts_2), (left, right)
+
+def popcount_bound(counts_1, counts_2, threshold):
+    """
+    Whether CLKs with popcounts `counts_1` and `counts_2` could have a Dice coefficient of at least `threshold`,
+    that is, whether it is cleared by 2 * min(count_1, count_2) / (count_1 + count_2), computed as anonlink
+    computes the Dice coefficient of CLKs sharing all the bits of the sparser one (0 if neither has a bit set)
+    """
+    counts_1 = np.asarray(counts_1, dtype=np.int64)
+    counts_2 = np.asarray(counts_2, dtype=np.int64)
+    total = counts_1 + counts_2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, 2 * np.minimum(counts_1, counts_2) / total, 0.0) >= threshold
+
+def popcount_windows(counts_1, counts_2, threshold, min_rows = PRUNE_MIN_ROWS):
+    """
+    Split the comparison of two CLK arrays whose popcounts, in ascending order, are `counts_1` and `counts_2`
+    into windows (start_1, stop_1, start_2, stop_2): rows start_1:stop_1 of the first array only need to be
+    compared with rows start_2:stop_2 of the second, as no other pair clears `popcount_bound()`.
+    Each window holds at least `min_rows` rows of the first array, unless there are fewer left.
+    """
+    values_1, starts_1 = np.unique(counts_1, return_index = True)
+    values_2, starts_2 = np.unique(counts_2, return_index = True)
+    starts_1 = np.append(starts_1, len(counts_1))
+    starts_2 = np.append(starts_2, len(counts_2))
+    bound = popcount_bound(values_1[:, None], values_2[None, :], threshold)
+
+    windows = []
+    first = 0
+    for last in range(len(values_1)):
+        if starts_1[last + 1] - starts_1[first] < min_rows and last + 1 < len(values_1):
+            continue
+        reachable = np.flatnonzero(bound[first:last + 1].any(axis = 0))
+        if len(reachable):
+            windows.append((int(starts_1[first]), int(starts_1[last + 1]),
+                            int(starts_2[reachable[0]]), int(starts_2[reachable[-1] + 1])))
+        first = last + 1
+    return windows
+
+def popcount_sort(clks_1, clks_2, threshold, min_rows = PRUNE_MIN_ROWS):
+    """
+    Sort two CLK arrays by popcount for a match pruned with `popcount_bound()`. Return the order of the rows of each,
+    and the `popcount_windows()` of the sorted arrays which need to be compared.
+
+    If `clks_2` is None, `clks_1` is matched with itself: its order is returned twice, and each window only reaches
+    from its first row on, as a self match only compares each row with the same or a later one.
+    Logs how many comparisons the windows leave.
+    """
+    counts_1 = popcounts(clks_1)
+    order_1 = np.argsort(counts_1, kind = 'stable')
+    if clks_2 is None:
+        order_2 = order_1
+        windows = [(start_1, stop_1, max(start_1, start_2), stop_2)
+                   for start_1, stop_1, start_2, stop_2 in popcount_windows(counts_1[order_1], counts_1[order_1], threshold, min_rows)]
+        # The pairs of a row with a later one in its window
+        compared = sum(int(np.clip(stop_2 - np.arange(start_1 + 1, stop_1 + 1), 0, None).sum())
+                       for start_1, stop_1, _, stop_2 in windows)
+        total = len(clks_1) * (len(clks_1) - 1) // 2
+    else:
+        counts_2 = popcounts(clks_2)
+        order_2 = np.argsort(counts_2, kind = 'stable')
+        windows = popcount_windows(counts_1[order_1], counts_2[order_2], threshold, min_rows)
+        compared = sum((stop_1 - start_1) * (stop_2 - start_2) for start_1, stop_1, start_2, stop_2 in windows)
+        total = len(clks_1) * len(clks_2)
+
+    logger.info("Popcounts ruled out %s of %s comparisons (%.1f%%) at a threshold of %s",
+            total - compared, total, 100 * (total - compared) / total if total else 0.0, threshold)
+    return order_1, order_2, windows
+
+def match_windows(clks_1, clks_2, windows, threshold, engine = 'anonlink', codes = None,
+                  blas_memory_mb = BLAS_MEMORY_MB, self_match = False):
+    """
+    Return the positions (left, right) of the pairs of rows of two CLK arrays sorted by `popcount_sort()`
+    with a Dice coefficient of at least `threshold`, comparing only the rows of each of its `windows` with one of
+    the exact engines. With `self_match`, both arrays are the same and only pairs with left < right are returned.
+    """
+    results = []
+    for start_1, stop_1, start_2, stop_2 in windows:
+        window_codes = None if codes is None else [codes[0][start_1:stop_1], codes[1][start_2:stop_2]]
+        left, right = _exact_matching_pairs(clks_1[start_1:stop_1], clks_2[start_2:stop_2], threshold,
+                                            engine, window_codes, blas_memory_mb)
+        left, right = left + start_1, right + start_2
+        if self_match:
+            keep = left < right
+            left, right = left[keep], right[keep]
+        results.append((left, right))
+    return _concatenate_pairs(results)
+
+def _unsorted_pairs(order_1, order_2, pairs, self_match = False):
+    """
+    Map pairs (left, right) of rows of arrays sorted by `popcount_sort()` back to the rows of the arrays,
+    with left < right if `self_match`
+    """
+    left, right = order_1[pairs[0]], order_2[pairs[1]]
+    if self_match:
+        left, right = np.minimum(left, right), np.maximum(left, right)
+    return left, right
+
+def find_matching_pairs(clks_1, clks_2, threshold, engine = 'anonlink', codes = None,
+                        lsh_bands = LSH_BANDS, lsh_rows = LSH_ROWS, blas_memory_mb = BLAS_MEMORY_MB, prune = False):
+    """
+    Return the positions (left, right) of the pairs of rows of two CLK arrays with a Dice coefficient of at least
+    `threshold`, comparing only rows sharing a blocking key if the `block_codes()` of both are given as `codes`.
+
+    With `prune`, the exact engines sort both arrays by popcount and only compare the windows of `popcount_sort()`
+    which can clear the threshold, which finds the same pairs.
+    """
+    if engine == 'lsh':
+        lsh = BitSampleLSH(8 * max(clks_1.shape[1], clks_2.shape[1]), lsh_bands, lsh_rows)
+        pair_filter = block_pair_filter(codes) if codes is not None else None
+        # Only pairs sharing a bucket of the LSH tables are compared, so a few matches may be missed
+        _, (left, right) = lsh.find_candidate_pairs(clks_1, clks_2, threshold, pair_filter = pair_filter)
+        return left, right
+    if not prune:
+        return _exact_matching_pairs(clks_1, clks_2, threshold, engine, codes, blas_memory_mb)
+
+    order_1, order_2, windows = popcount_sort(clks_1, clks_2, threshold)
+    sorted_codes = None if codes is None else [codes[0][order_1], codes[1][order_2]]
+    pairs = match_windows(clks_1[order_1], clks_2[order_2], windows, threshold, engine, sorted_codes, blas_memory_mb)
+    return _unsorted_pairs(order_1, order_2, pairs)
+
+def _exact_matching_pairs(clks_1, clks_2, threshold, engine, codes, blas_memory_mb):
+    """
+    `find_matching_pairs()` with one of the engines comparing every pair, without pruning
+    """
+    if engine == 'numpy':
+        return numpy_matching_pairs(clks_1, clks_2, threshold, codes)
+    if engine == 'blas':
+        return blas_matching_pairs(clks_1, clks_2, threshold, codes, blas_memory_mb)
+
+    blocking_f = codes_blocking_function(codes) if codes is not None else None
+    _, _, (left, right) = anonlink.candidate_generation.find_candidate_pairs(
+            [bitarray_views(clks_1), bitarray_views(clks_2)],
+            anonlink.similarities.dice_coefficient,
+            threshold,
+            blocking_f = blocking_f,
+            )
+    return np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64)
+
+def triangle_ranges(n, count):
+    """
+    Split rows 0 to n into about `count` ranges (start, stop) with about as many pairs each
+    of a row in the range and the same or a later row
+    """
+    bounds = np.unique(np.round(n * (1 - np.sqrt(1 - np.arange(count + 1) / count))).astype(int))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+def _match_suffix(clks, codes, start, stop, threshold, engine, engine_options):
+    """
+    The pairs (left, right), left < right, of a self match with left in rows start:stop
+    """
+    range_codes = None if codes is None else [codes[start:stop], codes[start:]]
+    left, right = find_matching_pairs(clks[start:stop], clks[start:], threshold, engine, range_codes, **engine_options)
+    keep = left < right
+    return left[keep] + start, right[keep] + start
+
+def find_self_matching_pairs(clks, threshold, engine = 'anonlink', codes = None, prune = False, **engine_options):
+    """
+    `find_matching_pairs()` of a CLK array with itself, returning only pairs (left, right) with left < right,
+    without comparing the rest. `codes`, if given, are the `block_codes()` of the array, and `prune` and
+    `engine_options` are the keyword arguments of `find_matching_pairs()` which configure the engine.
+    """
+    if engine == 'lsh':
+        lsh = BitSampleLSH(8 * clks.shape[1], engine_options.get('lsh_bands', LSH_BANDS), engine_options.get('lsh_rows', LSH_ROWS))
+        block_filter = block_pair_filter([codes, codes]) if codes is not None else None
+
+        def pair_filter(left, right):
+            keep = left < right
+            if block_filter is not None:
+                keep &= block_filter(left, right)
+            return keep
+
+        _, (left, right) = lsh.find_candidate_pairs(clks, clks, threshold, pair_filter = pair_filter)
+        return left, right
+
+    if prune:
+        order, _, windows = popcount_sort(clks, None, threshold)
+        sorted_codes = None if codes is None else [codes[order], codes[order]]
+        pairs = match_windows(clks[order], clks[order], windows, threshold, engine, sorted_codes,
+                              engine_options.get('blas_memory_mb', BLAS_MEMORY_MB), self_match = True)
+        return _unsorted_pairs(order, order, pairs, self_match = True)
+
+    results = [
+            _match_suffix(clks, codes, start, stop, threshold, engine, engine_options)
+            for start, stop in triangle_ranges(len(clks), SELF_MATCH_RANGES)
+            ]
+    return _concatenate_pairs(results)
+
+def self_matching_rows(clks, rows, threshold, codes = None):
+    """
+    Those of `rows` which `find_matching_pairs()` would match with themselves: CLKs with a Dice coefficient
+    of at least `threshold` with themselves (any bits set) and, if `codes` are given, at least one blocking key
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    keep = dice_pairs(clks, clks, rows, rows) >= threshold
+    if codes is not None:
+        keep &= (codes[rows] >= 0).any(axis=1)
+    return rows[keep]
+
+def _concatenate_pairs(results):
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate([left for left, _ in results]), np.concatenate([right for _, right in results])
+
+class SharedArrays:
+    """
+    Copies of NumPy arrays in shared memory, which worker processes attach to by name
+    rather than each receiving a pickled copy. Use it as a context manager so that the memory is freed afterwards.
+    """
+    def __init__(self, *arrays):
+        self._blocks = []
+        self.descriptors = []
+        try:
+            for array in arrays:
+                block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                self._blocks.append(block)
+                np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+                self.descriptors.append((block.name, array.shape, array.dtype.str))
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+# Shared memory blocks a worker process of a MatchPool is attached to, and their arrays
+_worker_blocks = []
+_worker_arrays = {}
+
+def _attach(descriptors):
+    """
+    Attach to the arrays of a SharedArrays in a worker process, once for each set of arrays
+    """
+    global _worker_blocks, _worker_arrays
+    key = tuple(name for name, _, _ in descriptors)
+    if key not in _worker_arrays:
+        for block in _worker_blocks:
+            block.close()
+        # Spawned workers share the resource tracker of the process which created the memory, and which unlinks it
+        _worker_blocks = [shared_memory.SharedMemory(name=name) for name, _, _ in descriptors]
+        _worker_arrays = {key: [
+                np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+                for block, (_, shape, dtype) in zip(_worker_blocks, descriptors)
+                ]}
+    return _worker_arrays[key]
+
+def _match_rows(descriptors, start, stop, threshold, engine, engine_options):
+    """
+    Match rows start:stop of the first shared CLK array against all of the second, inside a worker process
+    """
+    clks_1, clks_2, *codes = _attach(descriptors)
+    if codes:
+        codes = [codes[0][start:stop], codes[1]]
+    left, right = find_matching_pairs(clks_1[start:stop], clks_2, threshold, engine, codes or None, **engine_options)
+    return left + start, right
+
+def _self_match_rows(descriptors, start, stop, threshold, engine, engine_options):
+    """
+    Match rows start:stop of a shared CLK array against themselves and the rows after them, inside a worker process
+    """
+    clks, *codes = _attach(descriptors)
+    return _match_suffix(clks, codes[0] if codes else None, start, stop, threshold, engine, engine_options)
+
+def _match_window(descriptors, start_1, stop_1, start_2, stop_2, threshold, engine, blas_memory_mb):
+    """
+    Match one window of two shared CLK arrays sorted by `popcount_sort()`, inside a worker process
+    """
+    clks_1, clks_2, *codes = _attach(descriptors)
+    return match_windows(clks_1, clks_2, [(start_1, stop_1, start_2, stop_2)], threshold, engine, codes or None, blas_memory_mb)
+
+def _self_match_window(descriptors, start_1, stop_1, start_2, stop_2, threshold, engine, blas_memory_mb):
+    """
+    Match one window of a shared CLK array sorted by `popcount_sort()` with itself, inside a worker process
+    """
+    clks, *codes = _attach(descriptors)
+    codes = [codes[0], codes[0]] if codes else None
+    return match_windows(clks, clks, [(start_1, stop_1, start_2, stop_2)], threshold, engine, codes, blas_memory_mb, self_match = True)
+
+class MatchPool:
+    """
+    Run `find_matching_pairs()` and `find_self_matching_pairs()` across a pool of worker processes.
+
+    Both CLK arrays (and blocking codes) are copied into shared memory once per call, and each worker
+    matches ranges of rows of the first array against all of the second (or, matching an array with itself,
+    against themselves and the rows after them). The pairs found in each range
+    are returned in the order of the ranges, so sorting them gives the same pairs in the same order as one process.
+    A pruned match sorts the arrays by popcount before sharing them, and each worker matches windows of `popcount_sort()`.
+
+    Use it as a context manager so that the pool is shut down afterwards.
+    """
+    def __init__(self, workers):
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError(f'workers must be a positive integer, not {workers!r}')
+        self.workers = workers
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            logger.debug("Shutting down the pool of %s matching processes", self.workers)
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            logger.debug("Starting a pool of %s matching processes", self.workers)
+            self._pool = ProcessPoolExecutor(max_workers = self.workers, mp_context = multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def find_matching_pairs(self, clks_1, clks_2, threshold, engine = 'anonlink', codes = None, prune = False, **engine_options):
+        """
+        `find_matching_pairs()`, with the rows of `clks_1` split between the workers
+        """
+        if prune and engine != 'lsh':
+            order_1, order_2, windows = popcount_sort(clks_1, clks_2, threshold, self._window_rows(len(clks_1)))
+            arrays = [clks_1[order_1], clks_2[order_2]]
+            if codes is not None:
+                arrays += [codes[0][order_1], codes[1][order_2]]
+            pairs = self._run(_match_window, arrays, windows, threshold, engine,
+                              engine_options.get('blas_memory_mb', BLAS_MEMORY_MB))
+            return _unsorted_pairs(order_1, order_2, pairs)
+
+        bounds = np.linspace(0, len(clks_1), min(len(clks_1), self.workers * MATCH_TASKS_PER_WORKER) + 1).astype(int)
+        ranges = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        return self._run(_match_rows, [clks_1, clks_2, *(codes or [])], ranges, threshold, engine, engine_options)
+
+    def find_self_matching_pairs(self, clks, threshold, engine = 'anonlink', codes = None, prune = False, **engine_options):
+        """
+        `find_self_matching_pairs()`, with the rows of `clks` split between the workers
+        """
+        if prune and engine != 'lsh':
+            order, _, windows = popcount_sort(clks, None, threshold, self._window_rows(len(clks)))
+            arrays = [clks[order]] if codes is None else [clks[order], codes[order]]
+            pairs = self._run(_self_match_window, arrays, windows, threshold, engine,
+                              engine_options.get('blas_memory_mb', BLAS_MEMORY_MB))
+            return _unsorted_pairs(order, order, pairs, self_match = True)
+
+        ranges = triangle_ranges(len(clks), self.workers * MATCH_TASKS_PER_WORKER)
+        arrays = [clks] if codes is None else [clks, codes]
+        return self._run(_self_match_rows, arrays, ranges, threshold, engine, engine_options)
+
+    def _window_rows(self, n):
+        """
+        Rows of the first array in each popcount window, so that there are enough windows to keep the workers busy
+        """
+        return max(1, min(PRUNE_MIN_ROWS, -(-n // (self.workers * MATCH_TASKS_PER_WORKER))))
+
+    def _run(self, function, arrays, tasks, *args):
+        if not tasks:
+            return _concatenate_pairs([])
+        with SharedArrays(*arrays) as shared:
+            pool = self._get_pool()
+            futures = [pool.submit(function, shared.descriptors, *task, *args) for task in tasks]
+            return _concatenate_pairs([future.result() for future in futures])
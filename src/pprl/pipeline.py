@@ -0,0 +1,139 @@
+# pipeline.py
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Items each queue between two stages holds before the stage feeding it has to wait
+PIPELINE_QUEUE_SIZE = 2
+
+# Seconds a stage waits on a queue before checking whether another stage has failed
+_POLL_SECONDS = 0.1
+
+# Put on a queue after its last item
+_DONE = object()
+
+class StageStats:
+    """
+    What one stage of a pipeline did: how many items it handled, how long it spent working on them,
+    waiting for items (idle) and waiting for room in the next queue (blocked), and how full its input queue was.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        self._depth_sum = 0
+
+    def record_depth(self, depth):
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_sum += depth
+
+    @property
+    def mean_depth(self):
+        return self._depth_sum / self.items if self.items else 0.0
+
+    @property
+    def items_per_second(self):
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+    def log(self):
+        logger.info("PIPELINE %-8s %6s items, busy %8.2f s (%8.1f items/s), idle %8.2f s, blocked %8.2f s, queue depth mean %.1f max %s",
+                self.name, self.items, self.busy_seconds, self.items_per_second,
+                self.idle_seconds, self.blocked_seconds, self.mean_depth, self.max_depth)
+
+def run_pipeline(source, stages, queue_size = PIPELINE_QUEUE_SIZE, source_name = 'read'):
+    """
+    Pass every item of the iterable `source` through each of `stages`, a list of (name, function) pairs, in order.
+
+    Iterating over `source` and each stage run in their own threads, connected by queues of at most `queue_size` items,
+    so a stage works on one item while the stage after it works on the one before. A stage that gets ahead waits for
+    room in its queue, so no more than `queue_size` items are held between any two stages. Items reach each stage
+    in the order of `source`, and the results of the last stage are dropped.
+
+    If a stage raises, the others stop and the exception is raised again here.
+    Returns the `StageStats` of iterating over the source and of each stage.
+    """
+    failed = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize = queue_size) for _ in stages]
+    stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+
+    def put(q, item, stage_stats):
+        start = time.perf_counter()
+        while not failed.is_set():
+            try:
+                q.put(item, timeout = _POLL_SECONDS)
+                stage_stats.blocked_seconds += time.perf_counter() - start
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q, stage_stats):
+        start = time.perf_counter()
+        while not failed.is_set():
+            try:
+                item = q.get(timeout = _POLL_SECONDS)
+                stage_stats.idle_seconds += time.perf_counter() - start
+                return item
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def run_source():
+        stage_stats = stats[0]
+        try:
+            items = iter(source)
+            while True:
+                start = time.perf_counter()
+                item = next(items, _DONE)
+                if item is _DONE:
+                    break
+                stage_stats.busy_seconds += time.perf_counter() - start
+                stage_stats.items += 1
+                if not put(queues[0], item, stage_stats):
+                    return
+            put(queues[0], _DONE, stage_stats)
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+
+    def run_stage(n, function):
+        stage_stats = stats[n + 1]
+        output = queues[n + 1] if n + 1 < len(queues) else None
+        try:
+            while True:
+                depth = queues[n].qsize()
+                item = get(queues[n], stage_stats)
+                if item is _DONE:
+                    break
+                stage_stats.record_depth(depth)
+                start = time.perf_counter()
+                result = function(item)
+                stage_stats.busy_seconds += time.perf_counter() - start
+                stage_stats.items += 1
+                if output is not None and not put(output, result, stage_stats):
+                    return
+            if output is not None:
+                put(output, _DONE, stage_stats)
+        except BaseException as e:
+            errors.append(e)
+            failed.set()
+
+    threads = [threading.Thread(target = run_source, name = f"pipeline-{source_name}", daemon = True)]
+    threads += [threading.Thread(target = run_stage, args = (n, function), name = f"pipeline-{name}", daemon = True)
+                for n, (name, function) in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return stats
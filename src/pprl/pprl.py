@@ -9,22 +9,35 @@ import anonlink
 import bitarray
 import csv
 import io
+import itertools
 import json
 import logging
 import os
+import time
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from fnmatch import fnmatch
 
 import clkhash
 from clkhash import clk
 from clkhash.schema import from_json_dict
 from clkhash.serialization import deserialize_bitarray, serialize_bitarray
 
-from anyascii import anyascii
 from yaspin import yaspin, Spinner
 
 import colorama
 from colorama import Fore, Back, Style
 
+from .blocking import BlockingKeys, block_codes, shared_block_columns
+from .hashing import CLKCache, CLKHasher
+from .matching import (
+        BLAS_MEMORY_MB, LSH_BANDS, LSH_ROWS, MATCH_ENGINES, MatchPool,
+        clk_array, find_matching_pairs, find_self_matching_pairs, self_matching_rows,
+        )
+from .pipeline import run_pipeline
 from .util import *
 
 logger = logging.getLogger(__name__)
@@ -35,16 +48,19 @@ def custom_spinner():
             ["[" + Style.BRIGHT + Fore.GREEN + x + Style.RESET_ALL + "]" for x in terms],
             200)
 
+# Options of the create config file
+CREATE_CONFIG_NAMES = {
+        'patients', 'schema', 'secret', 'output', 'data_folder', 'output_folder', 'schema_folder',
+        'chunk_size', 'workers', 'clk_cache', 'engine', 'blocking', 'targets', 'reader', 'compact',
+        'exact_duplicates', 'validated_cache', 'pipeline'}
+
 def create_CLKs(args):
     """
     Parse a config file and call the underlying CLK generation
     """
     logger.debug("create_CLKs called with %s", args.config)
 
-    configuration = read_config_file(
-            args.config,
-            {'patients', 'schema', 'secret', 'output', 'data_folder', 'output_folder', 'schema_folder'}
-            )
+    configuration = read_config_file(args.config, CREATE_CONFIG_NAMES)
     configuration['verbose'] = args.verbose
     #TODO: check for file format, validity, etc.
 
@@ -64,6 +80,17 @@ def _create_CLKs(
         data_folder = os.path.join(os.getcwd(), "my_files"),
         output_folder = os.path.join(os.getcwd(), "my_files"),
         schema_folder = os.path.join(os.getcwd(), "my_files"),
+        chunk_size = None,
+        workers = None,
+        clk_cache = None,
+        engine = 'clkhash',
+        blocking = None,
+        targets = None,
+        reader = 'pandas',
+        compact = False,
+        exact_duplicates = False,
+        validated_cache = None,
+        pipeline = False,
         ):
     logger.debug("Beginning execution within _create_CLKs")
 
@@ -71,16 +98,53 @@ def _create_CLKs(
 
     # TODO: possibly break all of this out and put into a separate validate subroutine?
 
+    # Without targets, the one hash file is described by the top-level options.
+    # With targets, each one names its own output (and CLK cache), and may override the schema, secret,
+    # blocking keys and exact duplicates option.
+    if targets is None:
+        targets = [{'schema': schema, 'secret': secret, 'output': output, 'clk_cache': clk_cache, 'blocking': blocking,
+                    'exact_duplicates': exact_duplicates}]
+    else:
+        if clk_cache is not None:
+            raise ValueError('With targets, each target must name its own clk_cache')
+        targets = [_target_options(target, schema, secret, blocking, exact_duplicates) for target in targets]
+
+    outputs = [target['output'] for target in targets]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError(f'Each target must have its own output file: {", ".join(map(str, outputs))}')
+
     logger.debug("Validating input filepaths:") # I don't like determining cwd in the arguments.
     patient_file_path = validated_file_path('patient records', patients, data_folder)
-    secret_file_path = validated_file_path('secret', secret, data_folder)
-    schema_file_path = validated_file_path('schema', schema, schema_folder)
+    for target in targets:
+        target['secret_file_path'] = validated_file_path('secret', target['secret'], data_folder)
+        target['schema_file_path'] = validated_file_path('schema', target['schema'], schema_folder)
 
     logger.debug("Validating output filepaths:")
-    output_file_path = validated_out_path('hash', output, output_folder)
+    for target in targets:
+        target['output_file_path'] = validated_out_path('hash', target['output'], output_folder)
+
+        # In incremental mode, the new and changed records are also written to a delta file next to the hash file
+        target['delta_file_path'] = None
+        if target['clk_cache'] is not None:
+            output_stem, output_ext = os.path.splitext(target['output'])
+            target['delta_file_path'] = validated_out_path('delta', f"{output_stem}_delta{output_ext}", output_folder)
+
+        # Pairs of records with identical hashed values are written to a sidecar next to the hash file
+        target['exact_duplicates_file_path'] = None
+        if target['exact_duplicates']:
+            target['exact_duplicates_file_path'] = validated_out_path('exact duplicates', exact_duplicates_file_name(target['output']), output_folder)
 
     output_invalid_records_path = validated_out_path('invalid records', 'invalid_records.csv', output_folder)
 
+    if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size < 1):
+        raise ValueError(f'chunk_size must be a positive integer, not {chunk_size!r}')
+    if reader not in READERS:
+        raise ValueError(f'reader must be one of {", ".join(READERS)}, not {reader!r}')
+    if validated_cache is not None and chunk_size is not None:
+        raise ValueError('validated_cache holds the whole patient file, so it cannot be used with chunk_size')
+    if pipeline and chunk_size is None:
+        raise ValueError('pipeline passes chunks of records between its stages, so it needs a chunk_size')
+
     #TODO: Here and throughout, add a separate silent toggle to disable the spinner
     with yaspin(
             custom_spinner(),
@@ -88,55 +152,223 @@ def _create_CLKs(
             text=f"Reading from input files",
         ) as spinner:
 
-        logger.debug("Reading schema json into dict.")
-        with open(schema_file_path, 'r') as f:
-            schema_dict = json.load(f)
-            schema = from_json_dict(schema_dict)
-
-        # Secret
-        logger.debug("Reading secret from file.")
-        with open(secret_file_path, 'r') as secret_file:
-            secret = secret_file.read()
-        if secret == "":
-            raise ValueError(f'The secret file cannot be empty: {secret_file_path}')
+        for target in targets:
+            logger.debug("Reading schema json into dict.")
+            with open(target['schema_file_path'], 'r') as f:
+                target['schema_dict'] = json.load(f)
 
-        # Create DataFrame from the input csv
-        raw_patients_df = read_dataframe_from_CSV(patient_file_path)
-        num_records = len(raw_patients_df)
+            # Secret
+            logger.debug("Reading secret from file.")
+            with open(target['secret_file_path'], 'r') as secret_file:
+                target['secret'] = secret_file.read()
+            if target['secret'] == "":
+                raise ValueError(f'The secret file cannot be empty: {target["secret_file_path"]}')
 
         spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
-    logger.info("TOTAL RECORDS: %s", num_records)
 
-    with yaspin(
-            custom_spinner(),
-            timer = True,
-            text=f"Validating records from {patient_file_path}",
-        ) as spinner:
+    # Remembers normalized and sanitized values across chunks
+    cache = NormalizationCache()
 
-        # Pull row_ids and source then drop from dataframe prior to normalizing
-        row_ids = raw_patients_df['row_id'].copy()
-        source = raw_patients_df['source'].copy()
-        data_fields = raw_patients_df.drop(['row_id', 'source'], axis=1)
-
-        # TODO: deal with this separately to catch bad fields/corrupted formatting
-        logger.debug("Converting all values to ascii and capitalizing all strings.")
-        patients_df = (
-                data_fields
-                .map(anyascii)
-                .map(lambda x: x.upper())
-                )
-        # add em back
-        patients_df.insert(0, 'source', source)
-        patients_df.insert(0, 'row_id', row_ids)
+    # Targets are hashed side by side when hashing is spread over processes, so they share the workers
+    if workers is not None and len(targets) > 1:
+        workers = max(1, workers // len(targets))
 
-        ## Perhaps place this in a breakout subcommand that we can call before execution?
-        logger.debug("Validating fields and ensuring standard formatting.")
-        patients_df, invalid_records = validate_input_fields(patients_df)
+    hash_targets = []
+    try:
+        for target in targets:
+            hash_targets.append(HashTarget(
+                    target['secret'],
+                    target['schema_dict'],
+                    target['output_file_path'],
+                    target['delta_file_path'],
+                    None if target['clk_cache'] is None else os.path.join(output_folder, target['clk_cache']),
+                    target['blocking'],
+                    target['exact_duplicates_file_path'],
+                    workers,
+                    engine,
+                    ))
+
+        # Only the columns some target hashes are read from the patient file
+        columns = ['row_id', 'source']
+        for hash_target in hash_targets:
+            columns += [name for name in hash_target.unignored_feature_names if name not in columns]
+
+        # Validated records from an earlier run on the same patient file are reused
+        if validated_cache is not None:
+            validated_cache = ValidatedRecordsCache(os.path.join(output_folder, validated_cache), patient_file_path, columns)
+
+        if chunk_size is not None:
+            _create_CLKs_in_chunks(
+                    patient_file_path,
+                    columns,
+                    reader,
+                    compact,
+                    cache,
+                    hash_targets,
+                    output_invalid_records_path,
+                    chunk_size,
+                    verbose,
+                    pipeline,
+                    )
+        else:
+            _create_CLKs_at_once(
+                    patient_file_path,
+                    columns,
+                    reader,
+                    compact,
+                    cache,
+                    hash_targets,
+                    output_invalid_records_path,
+                    verbose,
+                    validated_cache,
+                    )
+
+        for hash_target in hash_targets:
+            hash_target.finish()
+    finally:
+        for hash_target in hash_targets:
+            hash_target.close()
 
-        num_valid_records = len(patients_df)
-        num_invalid_records = len(invalid_records)
+    colorama.init()
 
-        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
+    return 0
+
+def _target_options(target, schema, secret, blocking, exact_duplicates):
+    """
+    Check the options of one entry of `targets`, filling in the top-level schema, secret, blocking keys and exact duplicates option
+    """
+    allowed_options = {'schema', 'secret', 'output', 'clk_cache', 'blocking', 'exact_duplicates'}
+    if not isinstance(target, dict) or 'output' not in target or set(target) - allowed_options:
+        raise ValueError(f'Each target must be a mapping with an output, and optionally {", ".join(sorted(allowed_options - {"output"}))}, not {target!r}')
+    return {'schema': schema, 'secret': secret, 'clk_cache': None, 'blocking': blocking, 'exact_duplicates': exact_duplicates, **target}
+
+def exact_duplicates_file_name(hashes):
+    """
+    Return the name of the exact duplicates sidecar written by `create` next to the hash file `hashes`
+    """
+    stem, ext = os.path.splitext(hashes)
+    return f"{stem}_exact_duplicates{ext}"
+
+class HashTarget:
+    """
+    One hash file written by `create`: the schema and secret its CLKs are hashed with,
+    its blocking keys, its exact duplicates sidecar, and its CLK cache and delta file in incremental mode.
+    """
+    def __init__(self, secret, schema_dict, output_file_path, delta_file_path = None, clk_cache = None, blocking = None,
+                 exact_duplicates_file_path = None, workers = None, engine = 'clkhash'):
+        self.output_file_path = output_file_path
+        self.delta_file_path = delta_file_path
+        self.exact_duplicates_file_path = exact_duplicates_file_path
+        self.feature_names, self.unignored_feature_names = _schema_feature_names(schema_dict)
+
+        # Keyed blocking columns, written next to each CLK
+        self.blocking = None
+        if blocking is not None:
+            self.blocking = BlockingKeys(secret, blocking, self.unignored_feature_names)
+            logger.debug("Writing blocking keys: %s", ', '.join(self.blocking.column_names))
+
+        # Remembers the CLKs of unchanged records across runs
+        self.clk_cache = None
+        if clk_cache is not None:
+            self.clk_cache = CLKCache(clk_cache, secret, schema_dict)
+
+        self.hasher = CLKHasher(secret, schema_dict, workers, engine)
+
+    def hash(self, patients_df, verbose = False):
+        """
+        Hash validated records, returning what `write()` writes
+        """
+        # The records hold the columns of every target; only this target's are checked against its schema
+        hashed_columns = _schema_column_names(self.unignored_feature_names)
+        patients_df = patients_df[[name for name in patients_df.columns if name in hashed_columns]]
+        patients_df = _schema_ordered_patients(patients_df, self.feature_names, self.unignored_feature_names)
+
+        #TODO: add date type checking for dob
+        # Maybe add flags, summary statistics (what kind of summary stats?)
+
+        # Records with the same values of every hashed feature get the same CLK
+        first_rows = _exact_duplicate_first_rows(patients_df, self.unignored_feature_names)
+
+        logger.debug("Generating clk hashes from input data for %s", self.output_file_path)
+        clks, changed = _hash_patients(self.hasher, self.clk_cache, patients_df, verbose, first_rows)
+        blocks = _block_patients(self.blocking, patients_df)
+        return patients_df, clks, changed, blocks, first_rows
+
+    def write(self, hashed, append = False):
+        """
+        Write the hashes returned by `hash()` to the hash file, and the new and changed ones to the delta file
+        """
+        patients_df, clks, changed, blocks, first_rows = hashed
+        #TODO: optionally print this out for the user to see
+        logger.debug("Writing hashes to file: %s", self.output_file_path)
+        _write_hashes(patients_df, clks, blocks, self.output_file_path, append = append)
+        if self.delta_file_path is not None:
+            logger.debug("Writing new and changed hashes to file: %s", self.delta_file_path)
+            _write_hashes(patients_df[changed], clks[changed], blocks[changed], self.delta_file_path, append = append)
+        if self.exact_duplicates_file_path is not None:
+            logger.debug("Writing exact duplicates to file: %s", self.exact_duplicates_file_path)
+            _write_exact_duplicates(patients_df, first_rows, self.exact_duplicates_file_path, append = append)
+
+    def redirect(self, output_file_path, exact_duplicates_file_path = None):
+        """
+        Write the hashes of the next patient file to other files, keeping the hasher, its worker pool and its memos
+        """
+        self.output_file_path = output_file_path
+        self.exact_duplicates_file_path = exact_duplicates_file_path
+
+    def finish(self):
+        """
+        Log the hashing statistics and keep the updated CLK cache, once every record has been written
+        """
+        self.hasher.log_stats()
+        if self.clk_cache is not None:
+            self.clk_cache.commit()
+            self.clk_cache.log_stats()
+
+    def close(self):
+        self.hasher.close()
+
+def _hash_targets(hash_targets, patients_df, verbose):
+    """
+    Hash the same validated records for every target.
+
+    When the hashing is spread over worker processes, the targets are hashed side by side,
+    each one in its own pool; otherwise one after the other.
+    """
+    if len(hash_targets) > 1 and (hash_targets[0].hasher.workers or 1) > 1:
+        with ThreadPoolExecutor(max_workers = len(hash_targets)) as executor:
+            return list(executor.map(lambda t: t.hash(patients_df, verbose), hash_targets))
+    return [t.hash(patients_df, verbose) for t in hash_targets]
+
+def _create_CLKs_at_once(
+        patient_file_path,
+        columns,
+        reader,
+        compact,
+        cache,
+        hash_targets,
+        output_invalid_records_path,
+        verbose,
+        validated_cache = None,
+        ):
+    """
+    Validate, hash and write all records of the patient file in one go, returning the numbers of valid and invalid records.
+
+    With a `validated_cache` which already holds the patient file, the reading and validation are skipped.
+    """
+    validated = None if validated_cache is None else validated_cache.load()
+    if validated is None:
+        patients_df, invalid_records = _read_and_validate(patient_file_path, columns, reader, compact, cache)
+        if validated_cache is not None:
+            validated_cache.store(patients_df, invalid_records)
+            _print_validated_cache_note(validated_cache.folder)
+    else:
+        patients_df, invalid_records = validated
+        if compact:
+            patients_df = compact_frame(patients_df)
+
+    num_valid_records = len(patients_df)
+    num_invalid_records = len(invalid_records)
 
     logger.info("VALID RECORDS:   %s", num_valid_records)
     logger.info("INVALID RECORDS: %s", num_invalid_records)
@@ -151,8 +383,7 @@ def _create_CLKs(
             ) as spinner:
             invalid_records.to_csv(output_invalid_records_path, index=False)
         spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
-        print("[" + Style.BRIGHT + Fore.YELLOW + "NOTE" + Style.RESET_ALL + "] " + 
-                f"Be sure to delete this file when it is no longer needed: {output_invalid_records_path}")
+        _print_invalid_records_note(output_invalid_records_path)
 
     with yaspin(
             custom_spinner(),
@@ -160,90 +391,320 @@ def _create_CLKs(
             text="Generating hashes",
         ) as spinner:
 
+        hashed = _hash_targets(hash_targets, patients_df, verbose)
 
-        # Anonlink requires the records CSV and the schema to have the same columns.
-        # However, I'd like to test various schemas against the same CSV.
-        # So, I do my own error checking and then add empty columns as neededed match the schema.
-        # This should also be reordered if the req cols are present but out of order.
-        # This can all go into its own helper I think.
-
-        logger.debug("Pulling all present features from the schema.")
-        features = [{'identifier': x["identifier"], 'ignored': x.get("ignored", False)} for x in schema_dict["features"] if x["identifier"] != ""]
-        feature_names = [ x['identifier'] for x in features ]
-
-        logger.debug("All Features:")
-        for name in feature_names:
-            logger.debug("    - %s", name)
-
-        ignored_feature_names = [ x['identifier'] for x in features if x['ignored'] ]
-
-        logger.debug("Ignored Features:")
-        for name in ignored_feature_names:
-            logger.debug("    - %s", name)
+        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
-        unignored_feature_names = [ x['identifier'] for x in features if not x['ignored'] ]
+    for hash_target, target_hashed in zip(hash_targets, hashed):
+        with yaspin(
+                custom_spinner(),
+                timer = True,
+                text=f"Writing to {hash_target.output_file_path}",
+            ) as spinner:
+            hash_target.write(target_hashed)
 
-        logger.debug("UNignored Features:")
-        for name in unignored_feature_names:
-            logger.debug("    - %s", name)
+            spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
-        expected_column_names = ['row_id', 'source', *unignored_feature_names]
-        observed_column_names = patients_df.columns.tolist()
+    return num_valid_records, num_invalid_records
 
-        # in case of mismatch, log what we see and what we want, then exit 1.
-        if observed_column_names != expected_column_names:
-            logger.error("Names or Order of data columns do not match between schema and input data.")
-            expected_col_str = ','.join(str(i) for i in expected_column_names)
-            observed_col_str = ','.join(str(i) for i in observed_column_names)
-            logger.error("Expected: %s", expected_col_str)
-            logger.error("Observed: %s", observed_col_str)
-            logger.error("If you're absolutely sure the schema is correct, update your input file to match the schema columns.")
-            exit(1)
+def _read_and_validate(patient_file_path, columns, reader, compact, cache):
+    """
+    Read every record of the patient file, returning the valid records and the invalid ones
+    """
+    with yaspin(
+            custom_spinner(),
+            timer = True,
+            text=f"Reading records from {patient_file_path}",
+        ) as spinner:
+        # Create DataFrame from the input csv
+        raw_patients_df = read_dataframe_from_CSV(patient_file_path, columns = columns, reader = reader)
+        if compact:
+            raw_patients_df = compact_frame(raw_patients_df)
+        log_bytes_per_record(raw_patients_df, "Patient records as read")
+        num_records = len(raw_patients_df)
 
-        # Add and order missing columns
+        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
-        for f in feature_names:
-            if f not in patients_df.columns:
-                logger.warning("Adding column %s, and filling with None", f)
-                patients_df[f] = None
-        patients_df = patients_df[feature_names]
+    logger.info("TOTAL RECORDS: %s", num_records)
 
-        # Convert df to string (required format for clkhash)
-        patients_str = io.StringIO()
-        patients_df.to_csv(patients_str)
-        patients_str.seek(0)
+    with yaspin(
+            custom_spinner(),
+            timer = True,
+            text=f"Validating records from {patient_file_path}",
+        ) as spinner:
 
-        # Assert source is identical
-        len(set(patients_df['source'])) == 1
+        ## Perhaps place this in a breakout subcommand that we can call before execution?
+        patients_df, invalid_records = _normalize_and_validate(raw_patients_df, cache)
+        del raw_patients_df
+        log_bytes_per_record(patients_df, "Patient records as validated")
 
-        # Assert ID is unique
-        len(set(patients_df['row_id'])) == len(patients_df['row_id'])
+        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
-        #TODO: add date type checking for dob
-        # Maybe add flags, summary statistics (what kind of summary stats?)
+    cache.log_stats()
+    return patients_df, invalid_records
+
+def _create_CLKs_in_chunks(
+        patient_file_path,
+        columns,
+        reader,
+        compact,
+        cache,
+        hash_targets,
+        output_invalid_records_path,
+        chunk_size,
+        verbose,
+        pipeline = False,
+        ):
+    """
+    Read, validate, hash and write the patient file `chunk_size` records at a time,
+    returning the numbers of valid and invalid records.
 
-        logger.debug("Generating clk hashes from input data...")
-        hashed_data = clk.generate_clk_from_csv(patients_str, secret, schema, progress_bar = verbose)
+    Every chunk goes through the same steps as the one-shot path in `_create_CLKs`,
+    and its hashes and invalid records are appended to the output files,
+    so the files are identical while only one chunk is ever held in memory.
 
-        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
+    With `pipeline`, reading, validating, hashing and writing run side by side in their own threads,
+    each on a different chunk (see `run_pipeline()`), and a few chunks are held in memory at once.
+    """
+    logger.debug("Processing %s in chunks of %s records", patient_file_path, chunk_size)
+
+    num_records = 0
+    num_valid_records = 0
+    num_invalid_records = 0
+
+    # Each step takes the chunk number and what the previous step returned.
+    # A step only runs in one thread, and on one chunk after another.
+    def validate_chunk(chunk):
+        nonlocal num_records
+        chunk_n, raw_patients_df = chunk
+        logger.debug("Processing chunk %s (%s records)", chunk_n, len(raw_patients_df))
+        num_records += len(raw_patients_df)
+        if compact:
+            raw_patients_df = compact_frame(raw_patients_df)
+        log_bytes_per_record(raw_patients_df, f"Chunk {chunk_n} as read")
+
+        patients_df, invalid_records = _normalize_and_validate(raw_patients_df, cache)
+        del raw_patients_df
+        log_bytes_per_record(patients_df, f"Chunk {chunk_n} as validated")
+        return chunk_n, patients_df, invalid_records
+
+    def hash_chunk(chunk):
+        chunk_n, patients_df, invalid_records = chunk
+        return chunk_n, patients_df, invalid_records, _hash_targets(hash_targets, patients_df, verbose)
+
+    def write_chunk(chunk):
+        nonlocal num_valid_records, num_invalid_records
+        chunk_n, patients_df, invalid_records, hashed = chunk
+        if len(invalid_records) > 0:
+            invalid_records.to_csv(
+                    output_invalid_records_path,
+                    index = False,
+                    mode = 'w' if num_invalid_records == 0 else 'a',
+                    header = num_invalid_records == 0,
+                    )
+            num_invalid_records += len(invalid_records)
+        num_valid_records += len(patients_df)
+
+        for hash_target, target_hashed in zip(hash_targets, hashed):
+            hash_target.write(target_hashed, append = chunk_n > 0)
+
+        spinner.text = f"Hashing records from {patient_file_path} in chunks of {chunk_size} ({num_records} read)"
+
+    steps = [('validate', validate_chunk), ('hash', hash_chunk), ('write', write_chunk)]
 
     with yaspin(
             custom_spinner(),
             timer = True,
-            text=f"Writing to {output_file_path}",
+            text=f"Hashing records from {patient_file_path} in chunks of {chunk_size}",
         ) as spinner:
-        logger.debug("Serializing hashes.")
-        serialized_hashes = [serialize_bitarray(x) for x in hashed_data]
-        patients_df['clk'] = serialized_hashes
-        #TODO: optionally print this out for the user to see
-        logger.debug("Writing hashes to file: %s", output_file_path)
-        patients_df[['row_id', 'source', 'clk']].to_csv(output_file_path, index=False)
+        with read_dataframe_from_CSV(patient_file_path, chunk_size = chunk_size, columns = columns, reader = reader) as chunks:
+            if pipeline:
+                stage_stats = run_pipeline(enumerate(chunks), steps)
+            else:
+                for chunk in enumerate(chunks):
+                    for _, step in steps:
+                        chunk = step(chunk)
 
         spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
-    colorama.init()
+    logger.info("TOTAL RECORDS: %s", num_records)
+    logger.info("VALID RECORDS:   %s", num_valid_records)
+    logger.info("INVALID RECORDS: %s", num_invalid_records)
+    cache.log_stats()
+    if pipeline:
+        for stats in stage_stats:
+            stats.log()
 
-    return 0
+    if num_invalid_records > 0:
+        logger.warning("%s INVALID RECORDS DETECTED.", num_invalid_records)
+        logger.warning("Invalid records were written to file: %s", output_invalid_records_path)
+        _print_invalid_records_note(output_invalid_records_path)
+
+    return num_valid_records, num_invalid_records
+
+def _print_invalid_records_note(output_invalid_records_path):
+    print("[" + Style.BRIGHT + Fore.YELLOW + "NOTE" + Style.RESET_ALL + "] " +
+            f"Be sure to delete this file when it is no longer needed: {output_invalid_records_path}")
+
+def _print_validated_cache_note(validated_cache_folder):
+    print("[" + Style.BRIGHT + Fore.YELLOW + "NOTE" + Style.RESET_ALL + "] " +
+            f"Be sure to delete this folder when it is no longer needed: {validated_cache_folder}")
+
+def _normalize_and_validate(raw_patients_df, cache = None):
+    """
+    Transliterate and capitalize the data fields, then split valid from invalid records
+    """
+    # Pull row_ids and source then drop from dataframe prior to normalizing
+    row_ids = raw_patients_df['row_id']
+    source = raw_patients_df['source']
+    data_fields = raw_patients_df.drop(['row_id', 'source'], axis=1)
+
+    # TODO: deal with this separately to catch bad fields/corrupted formatting
+    logger.debug("Converting all values to ascii and capitalizing all strings.")
+    patients_df = normalize_fields(data_fields, cache)
+    del data_fields
+    # add em back
+    patients_df.insert(0, 'source', source)
+    patients_df.insert(0, 'row_id', row_ids)
+
+    logger.debug("Validating fields and ensuring standard formatting.")
+    return validate_input_fields(patients_df, cache)
+
+def _schema_feature_names(schema_dict):
+    """
+    Return the names of all features in the schema, and of those which aren't ignored
+    """
+    logger.debug("Pulling all present features from the schema.")
+    features = [{'identifier': x["identifier"], 'ignored': x.get("ignored", False)} for x in schema_dict["features"] if x["identifier"] != ""]
+    feature_names = [ x['identifier'] for x in features ]
+
+    logger.debug("All Features:")
+    for name in feature_names:
+        logger.debug("    - %s", name)
+
+    ignored_feature_names = [ x['identifier'] for x in features if x['ignored'] ]
+
+    logger.debug("Ignored Features:")
+    for name in ignored_feature_names:
+        logger.debug("    - %s", name)
+
+    unignored_feature_names = [ x['identifier'] for x in features if not x['ignored'] ]
+
+    logger.debug("UNignored Features:")
+    for name in unignored_feature_names:
+        logger.debug("    - %s", name)
+
+    return feature_names, unignored_feature_names
+
+def _schema_column_names(unignored_feature_names):
+    """
+    Return the columns of the patient file a schema hashes, in the order it expects them
+    """
+    return ['row_id', 'source', *unignored_feature_names]
+
+def _schema_ordered_patients(patients_df, feature_names, unignored_feature_names):
+    """
+    Check the validated records against the schema and return them with the schema's column order
+    """
+    # Anonlink requires the records CSV and the schema to have the same columns.
+    # However, I'd like to test various schemas against the same CSV.
+    # So, I do my own error checking and then add empty columns as neededed match the schema.
+    # This should also be reordered if the req cols are present but out of order.
+
+    expected_column_names = _schema_column_names(unignored_feature_names)
+    observed_column_names = patients_df.columns.tolist()
+
+    # in case of mismatch, log what we see and what we want, then exit 1.
+    if observed_column_names != expected_column_names:
+        logger.error("Names or Order of data columns do not match between schema and input data.")
+        expected_col_str = ','.join(str(i) for i in expected_column_names)
+        observed_col_str = ','.join(str(i) for i in observed_column_names)
+        logger.error("Expected: %s", expected_col_str)
+        logger.error("Observed: %s", observed_col_str)
+        logger.error("If you're absolutely sure the schema is correct, update your input file to match the schema columns.")
+        exit(1)
+
+    # Add and order missing columns
+
+    for f in feature_names:
+        if f not in patients_df.columns:
+            logger.warning("Adding column %s, and filling with None", f)
+            patients_df[f] = None
+    patients_df = patients_df[feature_names]
+
+    # Assert source is identical
+    len(set(patients_df['source'])) == 1
+
+    # Assert ID is unique
+    len(set(patients_df['row_id'])) == len(patients_df['row_id'])
+
+    return patients_df
+
+def _hash_patients(hasher, clk_cache, patients_df, verbose, first_rows = None):
+    """
+    Return the serialized CLK of each record, and a boolean array flagging the records that were hashed in this run.
+
+    Without a CLK cache every distinct record is hashed, and exact duplicates (as found by `_exact_duplicate_first_rows()`)
+    share the CLK of their first record. With a cache, only new and changed records are hashed.
+    """
+    if clk_cache is None:
+        if first_rows is None:
+            first_rows = np.arange(len(patients_df))
+        distinct_rows = np.flatnonzero(first_rows == np.arange(len(first_rows)))
+        if len(distinct_rows) < len(first_rows):
+            logger.debug("Hashing %s distinct records out of %s", len(distinct_rows), len(first_rows))
+        hashed_data = hasher.hash(patients_df.iloc[distinct_rows], progress_bar = verbose)
+        logger.debug("Serializing hashes.")
+        clks = np.array([serialize_bitarray(x) for x in hashed_data], dtype=object)[np.searchsorted(distinct_rows, first_rows)]
+        changed = np.ones(len(clks), dtype=bool)
+    else:
+        clks, changed = clk_cache.hash(hasher, patients_df, progress_bar = verbose)
+    return np.array(clks, dtype=object), np.array(changed, dtype=bool)
+
+def _exact_duplicate_first_rows(patients_df, feature_names):
+    """
+    Return, for each record, the position of the first record with the same values of every feature in `feature_names`
+    """
+    if len(patients_df) == 0:
+        return np.zeros(0, dtype=int)
+    # Groups are numbered in the order they first appear
+    group_ids = patients_df.groupby(feature_names, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    _, first_of_group = np.unique(group_ids, return_index=True)
+    return first_of_group[group_ids]
+
+def _write_exact_duplicates(patients_df, first_rows, output_file_path, append = False):
+    """
+    Write every pair of exact duplicates to the sidecar, as a linkages file of the source against itself
+    """
+    row_ids = patients_df['row_id'].to_numpy()
+    groups = {}
+    for n in np.flatnonzero(first_rows != np.arange(len(first_rows))):
+        groups.setdefault(first_rows[n], [first_rows[n]]).append(n)
+
+    with open(output_file_path, 'a' if append else 'w') as linkages_file:
+        csv_writer = csv.writer(linkages_file)
+        if not append:
+            source = patients_df['source'].iloc[0] if len(patients_df) > 0 else ''
+            csv_writer.writerow([source, source])
+        for group in groups.values():
+            csv_writer.writerows([row_ids[x], row_ids[y]] for x, y in itertools.combinations(group, 2))
+
+def _block_patients(blocking, patients_df):
+    """
+    Return the blocking key columns of each record (no columns without blocking keys)
+    """
+    if blocking is None:
+        return pd.DataFrame(index=patients_df.index)
+    return blocking.columns(patients_df)
+
+def _write_hashes(patients_df, clks, blocks, output_file_path, append = False):
+    """
+    Write the row_id, source, serialized CLK and blocking keys of each record to the hash file
+    """
+    hashes_df = patients_df[['row_id', 'source']].copy()
+    hashes_df['clk'] = clks
+    hashes_df = pd.concat([hashes_df, blocks], axis=1)
+    hashes_df.to_csv(output_file_path, index=False, mode='a' if append else 'w', header=not append)
 
 def match_CLKs(args):
     """
@@ -253,7 +714,8 @@ def match_CLKs(args):
 
     configuration = read_config_file(
             args.config,
-            {'hashes', 'threshold', 'output', 'data_folder', 'output_folder'}
+            {'hashes', 'threshold', 'output', 'data_folder', 'output_folder', 'blocking', 'reader', 'exact_duplicates',
+             'engine', 'lsh_bands', 'lsh_rows', 'blas_memory_mb', 'prune', 'tile_size', 'workers'}
             )
 
     configuration['verbose'] = args.verbose
@@ -273,6 +735,16 @@ def _match_CLKs(
         verbose = False,
         data_folder = 'my_files',
         output_folder = 'my_files',
+        blocking = True,
+        reader = 'pandas',
+        exact_duplicates = True,
+        engine = 'anonlink',
+        lsh_bands = LSH_BANDS,
+        lsh_rows = LSH_ROWS,
+        blas_memory_mb = BLAS_MEMORY_MB,
+        prune = False,
+        tile_size = None,
+        workers = None,
         ):
     logger.debug("Beginning execution within _match_CLKs")
     #TODO: check other lengths
@@ -281,6 +753,16 @@ def _match_CLKs(
     #TODO: verify it's a list
     if len(hashes) not in {1,2}:
         raise ValueError('A list of one or two hashes must be provided')
+    if engine not in MATCH_ENGINES:
+        raise ValueError(f'engine must be one of {", ".join(MATCH_ENGINES)}, not {engine!r}')
+    if tile_size is not None and tile_size < 1:
+        raise ValueError(f'tile_size must be a positive integer, not {tile_size!r}')
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        raise ValueError(f'workers must be a positive integer, not {workers!r}')
+    if not blas_memory_mb > 0:
+        raise ValueError(f'blas_memory_mb must be positive, not {blas_memory_mb!r}')
+    # Pruning by popcount is opt-in: it finds the same pairs, but only saves time when popcounts vary widely
+    engine_options = {'lsh_bands': lsh_bands, 'lsh_rows': lsh_rows, 'blas_memory_mb': blas_memory_mb, 'prune': prune}
 
     logger.debug("Validating combined output path:")
     linkages_file_path = validated_out_path('linkages', output, output_folder)
@@ -302,32 +784,28 @@ def _match_CLKs(
 
     #TODO: Add some error checks
 
+    if tile_size is not None:
+        return _match_CLKs_in_tiles(input_1, input_2, self_match, linkages_file_path, threshold, output_folder,
+                tile_size, blocking, reader, engine, engine_options, workers)
+
     logger.debug("Creating dataframes from input csv files.")
-    df_1 = read_dataframe_from_CSV(input_1)
-    df_2 = read_dataframe_from_CSV(input_2)
+    df_1 = read_dataframe_from_CSV(input_1, reader = reader)
+    df_2 = df_1 if self_match else read_dataframe_from_CSV(input_2, reader = reader)
+
+    # Exact duplicates recorded by create are compared once, through the first record of each group,
+    # and every match of that record is also a match of each of its duplicates.
+    groups_1 = groups_2 = None
+    if exact_duplicates:
+        groups_1 = _read_exact_duplicates(input_1, df_1)
+        groups_2 = groups_1 if self_match else _read_exact_duplicates(input_2, df_2)
+    compared_1 = df_1 if groups_1 is None else df_1.iloc[[group[0] for group in groups_1]].reset_index(drop=True)
+    compared_2 = compared_1 if self_match else df_2 if groups_2 is None else df_2.iloc[[group[0] for group in groups_2]].reset_index(drop=True)
 
-    logger.debug("Deserializing bitarrays for both inputs.")
-    hashed_data_1 = [deserialize_bitarray(x) for x in df_1['clk']]
-    hashed_data_2 = [deserialize_bitarray(x) for x in df_2['clk']]
+    block_columns = _match_block_columns(df_1, df_2, blocking)
 
     source_1 = df_1['source'][0]
     source_2 = df_2['source'][0]
-    #TODO: update logging info for case of self_match == True
-    logger.debug("Checking on data presence for source_1 output.")
-    #s1_output = f"{Path(output).stem}_{source_1}.txt"
-    s1_output = f"{source_1}_duplicates.csv"
-    s1_file_path = validated_out_path('duplicates', s1_output, output_folder)
-    if self_match:
-        logger.info("Source: %s", source_1)
-    else:
-        logger.info("Source 1: %s", source_1)
-        logger.info("Source 2: %s", source_2)
-        #if source_1 == source_2:
-            #TODO: Add a test for this and throw an error
-        logger.debug("Checking on data presence for source_2 output.")
-        #s2_output = f"{Path(output).stem}_{source_2}.txt"
-        s2_output = f"{source_2}_duplicates.csv"
-        s2_file_path = validated_out_path('duplicates', s2_output, output_folder)
+    s1_file_path, s2_file_path = _duplicates_out_paths(source_1, source_2, self_match, output_folder)
 
     ## TODO: group all of the IO checking into a separate module so we can
     ## pull it out of the args above and also expand this into timestamped
@@ -341,17 +819,15 @@ def _match_CLKs(
             text="Calculating linkage probabilities (Don't worry if timer fails to update!)",
         ) as spinner:
         logger.debug("Linking pairs between sources...")
-        results_candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
-                [hashed_data_1, hashed_data_2],
-                anonlink.similarities.dice_coefficient,
-                threshold
-                )
-
-        # Rather than finding a single best fit, pull out all potential matches
-        #logger.debug("Generating solution...")
-        #solution = anonlink.solving.greedy_solve(results_candidate_pairs)
-        _, _, (left, right) = results_candidate_pairs
-        matching_rows = sorted([(x,y) for x,y in zip(left, right)])
+        with _match_pool(workers) as pool:
+            if self_match:
+                # Only pairs of distinct records are compared, each once. The records of a group of exact duplicates
+                # still match each other, as the first record of the group would have matched itself.
+                duplicated = [] if groups_1 is None else [n for n, group in enumerate(groups_1) if len(group) > 1]
+                left, right = _find_matching_pairs(compared_1, None, threshold, block_columns, engine, engine_options, pool, duplicated)
+            else:
+                left, right = _find_matching_pairs(compared_1, compared_2, threshold, block_columns, engine, engine_options, pool)
+        matching_rows = sorted(_expand_exact_duplicates(zip(left, right), groups_1, groups_2))
 
         spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
@@ -364,7 +840,9 @@ def _match_CLKs(
         # We exclude rows matched to themselves, and we report only unique mappings
         # No (4,4) or both (2,5) and (5,2)
         logger.info("Since we matched a dataset against itself, we should ignore matches with the same row number")
-        relevant_matches = [x for x in matching_rows if x[0] < x[1]]
+        # A record of one group can come after a record of another group it matched, so each pair is put in order,
+        # and the records of a group matched with themselves give each pair of them both ways round
+        relevant_matches = sorted({(x, y) if x < y else (y, x) for x, y in matching_rows if x != y})
         logger.info("There are %s matches between distinct records", len(relevant_matches))
     else:
         relevant_matches = matching_rows
@@ -378,50 +856,232 @@ def _match_CLKs(
 
     # Okay, so we're gonna add two additional output files.
     # and keep the single unified file for debugging.
-    # write the first file.
+    #TODO: Add CI test that ensures these two lists haven't been swapped
     with yaspin(
             custom_spinner(),
             timer = True,
             text=f"Writing linkage pairs from both sources to {linkages_file_path}",
         ) as spinner:
-        logger.debug("Writing combined linkages from both sources to file %s", linkages_file_path)
-        with open(linkages_file_path, "w") as linkages_file:
-            csv_writer = csv.writer(linkages_file)
-            csv_writer.writerow([source_1,source_2])
-            csv_writer.writerows(row_IDs_of_matches)
-        logger.debug("Output successfully written: %s", linkages_file_path)
+        with LinkagesWriter(linkages_file_path, source_1, source_2, s1_file_path, s2_file_path) as writer:
+            writer.write(row_IDs_of_matches)
 
         spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
 
-    #TODO: Add CI test that ensures these two lists haven't been swapped
-    if not self_match:
-        with yaspin(
-                custom_spinner(),
-                timer = True,
-                text=f"Writing {source_1} duplicates to {s1_file_path}",
-            ) as spinner:
-            logger.debug("Writing linkages for %s to file %s", source_1, s1_file_path)
-            with open(s1_file_path, "w") as linkages_file:
-                csv_writer = csv.writer(linkages_file)
-                csv_writer.writerow([source_1])
-                csv_writer.writerows([[i] for i,_ in row_IDs_of_matches])
-            logger.debug("Output successfully written: %s", s1_file_path)
-            spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
-        with yaspin(
-                custom_spinner(),
-                timer = True,
-                text=f"Writing {source_2} duplicates to {s2_file_path}",
-            ) as spinner:
-            logger.debug("Writing linkages for %s to file %s", source_2, s2_file_path)
-            with open(s2_file_path, "w") as linkages_file:
-                csv_writer = csv.writer(linkages_file)
-                csv_writer.writerow([source_2])
-                csv_writer.writerows([[j] for _,j in row_IDs_of_matches])
-            logger.debug("Output successfully written: %s", s2_file_path)
-            spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
+    return 0
+
+def _match_block_columns(df_1, df_2, blocking):
+    """
+    Return the blocking key columns to compare records on, or an empty list if all pairs are compared
+    """
+    # If both hash files carry blocking keys, only records sharing one of them are compared
+    block_columns = shared_block_columns(df_1, df_2) if blocking else []
+    if block_columns:
+        logger.info("Comparing only records which share one of the blocking keys: %s", ', '.join(block_columns))
+    elif blocking:
+        logger.info("No blocking keys were found. Comparing all pairs of records")
+    return block_columns
+
+def _duplicates_out_paths(source_1, source_2, self_match, output_folder):
+    """
+    Validate the paths of the per-source duplicates files, which aren't written for a self match
+    """
+    #TODO: update logging info for case of self_match == True
+    if self_match:
+        logger.info("Source: %s", source_1)
+        return None, None
+    logger.info("Source 1: %s", source_1)
+    logger.info("Source 2: %s", source_2)
+    #if source_1 == source_2:
+        #TODO: Add a test for this and throw an error
+    logger.debug("Checking on data presence for source outputs.")
+    s1_file_path = validated_out_path('duplicates', f"{source_1}_duplicates.csv", output_folder)
+    s2_file_path = validated_out_path('duplicates', f"{source_2}_duplicates.csv", output_folder)
+    return s1_file_path, s2_file_path
+
+def _find_matching_pairs(compared_1, compared_2, threshold, block_columns, engine, engine_options, pool = None, self_rows = ()):
+    """
+    Return the positions (left, right) of the pairs of records of two hash DataFrames whose CLKs
+    have a Dice coefficient of at least `threshold`, comparing only records sharing one of `block_columns` if any,
+    with `engine` configured by the keyword arguments `engine_options`. If a MatchPool is given,
+    the comparisons are split between its workers.
+
+    If `compared_2` is None, the records of `compared_1` are matched with each other, and only pairs with left < right
+    are compared and returned, along with the pairs of each of `self_rows` with itself if it would match itself.
+    """
+    logger.debug("Deserializing CLKs for both inputs.")
+    clks_1 = clk_array(compared_1['clk'].tolist())
+    if compared_2 is None:
+        codes = block_codes([compared_1], block_columns)[0] if block_columns else None
+        if pool is None:
+            left, right = find_self_matching_pairs(clks_1, threshold, engine, codes, **engine_options)
+        else:
+            left, right = pool.find_self_matching_pairs(clks_1, threshold, engine, codes, **engine_options)
+        diagonal = self_matching_rows(clks_1, self_rows, threshold, codes).tolist()
+        return left.tolist() + diagonal, right.tolist() + diagonal
+
+    clks_2 = clk_array(compared_2['clk'].tolist())
+    codes = block_codes([compared_1, compared_2], block_columns) if block_columns else None
+    if pool is None:
+        left, right = find_matching_pairs(clks_1, clks_2, threshold, engine, codes, **engine_options)
+    else:
+        left, right = pool.find_matching_pairs(clks_1, clks_2, threshold, engine, codes, **engine_options)
+    return left.tolist(), right.tolist()
+
+def _match_pool(workers):
+    """
+    A MatchPool of `workers` processes, or a context doing nothing if matching stays in this process
+    """
+    if workers is not None and workers > 1:
+        logger.info("Matching across %s worker processes", workers)
+        return MatchPool(workers)
+    return nullcontext()
+
+def _match_CLKs_in_tiles(input_1, input_2, self_match, linkages_file_path, threshold, output_folder,
+                         tile_size, blocking, reader, engine, engine_options, workers):
+    """
+    Match two hash files a tile of `tile_size` records of each at a time, writing the matches
+    of each tile of the first file before reading the next one.
+
+    The second file is read again for every tile of the first, so memory is bounded by the tile size
+    rather than by the size of either file or the number of matches. The output is the same as matching
+    all at once, except that exact duplicates are compared like any other records.
+    """
+    header_1 = pd.DataFrame(columns = _delimiter_and_header(input_1)[1])
+    header_2 = pd.DataFrame(columns = _delimiter_and_header(input_2)[1])
+    block_columns = _match_block_columns(header_1, header_2, blocking)
+    columns = ['row_id', 'source', 'clk'] + block_columns
+
+    def tiles(file_path):
+        return read_dataframe_from_CSV(file_path, chunk_size = tile_size, columns = columns, reader = reader)
+
+    source_1 = _first_source(input_1, reader)
+    source_2 = _first_source(input_2, reader)
+    s1_file_path, s2_file_path = _duplicates_out_paths(source_1, source_2, self_match, output_folder)
 
+    logger.info("Matching in tiles of %s records", tile_size)
+    comparisons = 0
+    matches = 0
+    with yaspin(
+            custom_spinner(),
+            timer = True,
+            text=f"Calculating linkage probabilities tile by tile, writing linkage pairs to {linkages_file_path}",
+        ) as spinner, \
+            LinkagesWriter(linkages_file_path, source_1, source_2, s1_file_path, s2_file_path) as writer, \
+            _match_pool(workers) as pool:
+        with tiles(input_1) as tiles_1:
+            for tile_1 in tiles_1:
+                start_1 = tile_1.index[0]
+                tile_1 = tile_1.reset_index(drop = True)
+                tile_matches = []
+                with tiles(input_2) as tiles_2:
+                    for tile_2 in tiles_2:
+                        start_2 = tile_2.index[0]
+                        tile_2 = tile_2.reset_index(drop = True)
+                        # A record is only matched to the records after it, within its own tile and in later ones
+                        if self_match and start_2 < start_1:
+                            continue
+                        if self_match and start_2 == start_1:
+                            comparisons += len(tile_1) * (len(tile_1) - 1) // 2
+                            left, right = _find_matching_pairs(tile_1, None, threshold, block_columns, engine, engine_options, pool)
+                        else:
+                            comparisons += len(tile_1) * len(tile_2)
+                            left, right = _find_matching_pairs(tile_1, tile_2, threshold, block_columns, engine, engine_options, pool)
+                        tile_matches += [
+                                (start_1 + x, start_2 + y, tile_1['row_id'][x], tile_2['row_id'][y])
+                                for x, y in zip(left, right)
+                                if not self_match or start_1 + x < start_2 + y
+                                ]
+                tile_matches.sort()
+                matches += len(tile_matches)
+                writer.write([row_id_1, row_id_2] for _, _, row_id_1, row_id_2 in tile_matches)
+                logger.debug("Matched records %s to %s: %s matches so far", start_1, start_1 + len(tile_1) - 1, matches)
+
+        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
+
+    logger.info("Compared %s pairs of records in tiles, and found %s matches", comparisons, matches)
     return 0
 
+def _first_source(hashes_file_path, reader):
+    with read_dataframe_from_CSV(hashes_file_path, chunk_size = 1, columns = ['source'], reader = reader) as chunks:
+        return next(iter(chunks))['source'][0]
+
+class LinkagesWriter:
+    """
+    Write matched pairs of row_ids to the linkages file and, unless only one source was matched,
+    the row_ids of each source to its own duplicates file
+    """
+    def __init__(self, linkages_file_path, source_1, source_2, s1_file_path = None, s2_file_path = None):
+        self.file_paths = [linkages_file_path] + [x for x in (s1_file_path, s2_file_path) if x is not None]
+        self.files = []
+        logger.debug("Writing combined linkages from both sources to file %s", linkages_file_path)
+        for file_path, header in zip(self.file_paths, [[source_1, source_2], [source_1], [source_2]]):
+            self.files.append(open(file_path, "w"))
+            csv.writer(self.files[-1]).writerow(header)
+        self.writers = [csv.writer(f) for f in self.files]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for f in self.files:
+            f.close()
+        for file_path in self.file_paths:
+            logger.debug("Output successfully written: %s", file_path)
+
+    def write(self, row_id_pairs):
+        row_id_pairs = list(row_id_pairs)
+        self.writers[0].writerows(row_id_pairs)
+        if len(self.writers) > 1:
+            self.writers[1].writerows([[i] for i, _ in row_id_pairs])
+            self.writers[2].writerows([[j] for _, j in row_id_pairs])
+
+def _read_exact_duplicates(hashes_file_path, hashes_df):
+    """
+    Read the exact duplicates sidecar written by `create` next to a hash file.
+
+    Returns the positions of the records in each group of exact duplicates (a group of one for every other record),
+    in the order of each group's first record, or None if there is no sidecar or it doesn't fit the hash file.
+    """
+    file_path = os.path.join(os.path.dirname(hashes_file_path), exact_duplicates_file_name(os.path.basename(hashes_file_path)))
+    if not os.path.isfile(file_path):
+        return None
+
+    logger.debug("Reading exact duplicates from %s", file_path)
+    pairs = pd.read_csv(file_path, header=None, names=[0, 1], skiprows=1, dtype=hashes_df['row_id'].dtype)
+    positions = pd.Series(np.arange(len(hashes_df)), index=hashes_df['row_id'])
+    if len(pairs) > 0 and not (pairs[0].isin(positions.index).all() and pairs[1].isin(positions.index).all()):
+        logger.warning("Ignoring %s, which names records that aren't in %s", file_path, hashes_file_path)
+        return None
+
+    # The first record of a group is paired with every other one, and comes before them
+    first_rows = np.arange(len(hashes_df))
+    if len(pairs) > 0:
+        np.minimum.at(first_rows, positions.loc[pairs[1]].to_numpy(), positions.loc[pairs[0]].to_numpy())
+
+    compared_columns = [c for c in hashes_df.columns if c not in ('row_id', 'source')]
+    values = hashes_df[compared_columns].to_numpy()
+    if not (values == values[first_rows]).all():
+        logger.warning("Ignoring %s, whose duplicates don't have identical hashes in %s", file_path, hashes_file_path)
+        return None
+
+    order = np.argsort(first_rows, kind='stable')
+    _, starts = np.unique(first_rows[order], return_index=True)
+    groups = [group.tolist() for group in np.split(order, starts[1:])]
+    logger.info("%s exact duplicates of other records in %s are matched through them", len(hashes_df) - len(groups), hashes_file_path)
+    return groups
+
+def _expand_exact_duplicates(pairs, groups_1, groups_2):
+    """
+    Turn matches between the first records of groups of exact duplicates into matches between every record of the groups
+    """
+    for x, y in pairs:
+        for row_n_in_1 in ([x] if groups_1 is None else groups_1[x]):
+            for row_n_in_2 in ([y] if groups_2 is None else groups_2[y]):
+                yield row_n_in_1, row_n_in_2
+
 #TODO: Add tests for this
 def deduplicate(args):
     """
@@ -431,7 +1091,7 @@ def deduplicate(args):
 
     configuration = read_config_file(
             args.config,
-            {'patients', 'linkages', 'output', 'data_folder', 'output_folder'}
+            {'patients', 'linkages', 'output', 'data_folder', 'output_folder', 'compact'}
             )
 
     configuration['verbose'] = args.verbose
@@ -450,21 +1110,31 @@ def _deduplicate(
         verbose = False,
         data_folder = os.path.join(os.getcwd(), "my_files"),
         output_folder = os.path.join(os.getcwd(), "my_files"),
+        compact = False,
         ):
     logger.debug("Beginning execution within _deduplicate")
 
     logger.debug("Validating input filepaths:")
     patient_file_path = validated_file_path('patient records', patients, data_folder)
-    linkage_file_path = validated_file_path('linkages', linkages, data_folder)
+    # Several linkages files can be given, such as the linkages from match and the exact duplicates sidecar from create
+    if not isinstance(linkages, list):
+        linkages = [linkages]
+    linkage_file_paths = [validated_file_path('linkages', x, data_folder) for x in linkages]
 
     logger.debug("Validating output filepaths:")
     output_file_path = validated_out_path('output_folder', output, output_folder)
 
     patients_df = read_dataframe_from_CSV(patient_file_path)
-    linkages_df = pd.read_csv(linkage_file_path,
+    if compact:
+        patients_df = compact_frame(patients_df)
+    log_bytes_per_record(patients_df, "Patient records as read")
+    linkages_df = pd.concat([
+        pd.read_csv(linkage_file_path,
                 sep = ',',
                 keep_default_na=False,
                 )
+        for linkage_file_path in linkage_file_paths
+        ])
 
     source = patients_df['source'].iloc[0]
     duplicate_rows = linkages_df[source].unique()
@@ -476,24 +1146,498 @@ def _deduplicate(
     return 0
 
 
-def read_dataframe_from_CSV(file_path):
+def validate_patients(args):
+    """
+    Parse a create config file and check its patient file, without hashing
+    """
+    logger.debug("validate_patients called with %s", args.config)
+
+    # The create config file can be used as it is, so sites check an extract with the settings it will be hashed with
+    configuration = read_config_file(args.config, CREATE_CONFIG_NAMES | {'invalid_records', 'samples'})
+    configuration['verbose'] = args.verbose
+
+    logger.debug("Calling  _validate_patients  with configuration:")
+    for key, value in configuration.items():
+        logger.debug("    kwarg: %s = %r", key, value)
+
+    rc = _validate_patients(**configuration)
+    return rc
+
+# Records validate reads at a time, unless the config gives a chunk_size
+VALIDATE_CHUNK_SIZE = 250_000
+
+# row_ids validate lists for each column with invalid values
+VALIDATE_SAMPLE_SIZE = 5
+
+# Options of the create config file that only matter for hashing, which validate doesn't do
+_HASHING_CONFIG_NAMES = {'secret', 'output', 'workers', 'clk_cache', 'engine', 'blocking', 'exact_duplicates', 'validated_cache'}
+
+def _validate_patients(
+        patients = None,
+        schema = 'schema.json',
+        verbose = False,
+        data_folder = os.path.join(os.getcwd(), "my_files"),
+        output_folder = os.path.join(os.getcwd(), "my_files"),
+        schema_folder = os.path.join(os.getcwd(), "my_files"),
+        chunk_size = None,
+        reader = 'pandas',
+        compact = False,
+        pipeline = False,
+        targets = None,
+        invalid_records = False,
+        samples = VALIDATE_SAMPLE_SIZE,
+        **hashing_options,
+        ):
+    """
+    Check that the patient file has every column the schema hashes, in its order, then stream it through the sanitizers used by create.
+
+    Reports the number of invalid values in each column with a few of their row_ids, and with `invalid_records`,
+    writes the invalid records file create would write. Only one chunk is held in memory at a time, and nothing is hashed.
+    Returns 1 if columns are missing or out of the schema's order, or no record is valid, otherwise 0.
+    """
+    logger.debug("Beginning execution within _validate_patients")
+
+    unexpected_options = set(hashing_options) - _HASHING_CONFIG_NAMES
+    if unexpected_options:
+        raise TypeError(f'Unexpected options: {", ".join(sorted(unexpected_options))}')
+    logger.debug("Ignoring options which only matter for hashing: %s", ', '.join(sorted(hashing_options)))
+
+    colorama.init()
+
+    logger.debug("Validating input filepaths:")
+    patient_file_path = validated_file_path('patient records', patients, data_folder)
+    schemas = [schema] if targets is None else [target.get('schema', schema) for target in targets]
+    schema_file_paths = [validated_file_path('schema', x, schema_folder) for x in dict.fromkeys(schemas)]
+
+    output_invalid_records_path = None
+    if invalid_records:
+        output_invalid_records_path = validated_out_path('invalid records', 'invalid_records.csv', output_folder)
+
+    if chunk_size is None:
+        chunk_size = VALIDATE_CHUNK_SIZE
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError(f'chunk_size must be a positive integer, not {chunk_size!r}')
+    if reader not in READERS:
+        raise ValueError(f'reader must be one of {", ".join(READERS)}, not {reader!r}')
+
+    # Columns: every hashed feature of every schema must be in the patient file
+    columns = ['row_id', 'source']
+    schema_columns = {}
+    for schema_file_path in schema_file_paths:
+        with open(schema_file_path, 'r') as f:
+            _, unignored_feature_names = _schema_feature_names(json.load(f))
+        schema_columns[schema_file_path] = _schema_column_names(unignored_feature_names)
+        columns += [name for name in unignored_feature_names if name not in columns]
+
+    delimiter, header = _delimiter_and_header(patient_file_path)
+    if delimiter is None:
+        logger.error("The data file is empty: %s", patient_file_path)
+        return 1
+    missing_columns = [name for name in columns if name not in header]
+    if missing_columns:
+        for name in missing_columns:
+            logger.error("The patient file has no %s column, which the schema hashes", name)
+        _print_validation_result(False, f"{patient_file_path} is missing columns: {', '.join(missing_columns)}")
+        return 1
+
+    # ...and in the order of the schema, which create checks before hashing
+    misordered = False
+    for schema_file_path, expected_column_names in schema_columns.items():
+        observed_column_names = [name for name in header if name in expected_column_names]
+        if observed_column_names != expected_column_names:
+            logger.error("The columns of the patient file are not in the order of the schema %s", schema_file_path)
+            logger.error("Expected: %s", ','.join(expected_column_names))
+            logger.error("Observed: %s", ','.join(observed_column_names))
+            misordered = True
+    if misordered:
+        _print_validation_result(False, f"{patient_file_path} has columns in a different order than the schema")
+        return 1
+
+    cache = NormalizationCache()
+    num_records = 0
+    num_valid_records = 0
+    num_invalid_records = 0
+    invalid_counts = {}
+    invalid_samples = {}
+
+    def validate_chunk(chunk):
+        nonlocal num_records
+        chunk_n, raw_patients_df = chunk
+        logger.debug("Validating chunk %s (%s records)", chunk_n, len(raw_patients_df))
+        num_records += len(raw_patients_df)
+        if compact:
+            raw_patients_df = compact_frame(raw_patients_df)
+        patients_df, chunk_invalid_records = _normalize_and_validate(raw_patients_df, cache)
+        return len(patients_df), chunk_invalid_records
+
+    def tally_chunk(chunk):
+        nonlocal num_valid_records, num_invalid_records
+        chunk_num_valid_records, chunk_invalid_records = chunk
+        num_valid_records += chunk_num_valid_records
+        if len(chunk_invalid_records) > 0:
+            for row_id, invalid_cols in zip(chunk_invalid_records['row_id'], chunk_invalid_records['invalid_cols']):
+                for col in invalid_cols:
+                    invalid_counts[col] = invalid_counts.get(col, 0) + 1
+                    if len(invalid_samples.setdefault(col, [])) < samples:
+                        invalid_samples[col].append(row_id)
+            if output_invalid_records_path is not None:
+                chunk_invalid_records.to_csv(
+                        output_invalid_records_path,
+                        index = False,
+                        mode = 'w' if num_invalid_records == 0 else 'a',
+                        header = num_invalid_records == 0,
+                        )
+            num_invalid_records += len(chunk_invalid_records)
+        spinner.text = f"Validating records from {patient_file_path} ({num_records} read)"
+
+    steps = [('validate', validate_chunk), ('tally', tally_chunk)]
+
+    with yaspin(
+            custom_spinner(),
+            timer = True,
+            text=f"Validating records from {patient_file_path}",
+        ) as spinner:
+        with read_dataframe_from_CSV(patient_file_path, chunk_size = chunk_size, columns = columns, reader = reader) as chunks:
+            if pipeline:
+                stage_stats = run_pipeline(enumerate(chunks), steps)
+            else:
+                for chunk in enumerate(chunks):
+                    for _, step in steps:
+                        chunk = step(chunk)
+
+        spinner.ok("[" + Fore.GREEN + "Done" + Style.RESET_ALL + "]")
+
+    cache.log_stats()
+    if pipeline:
+        for stats in stage_stats:
+            stats.log()
+
+    logger.info("TOTAL RECORDS: %s", num_records)
+    logger.info("VALID RECORDS:   %s", num_valid_records)
+    logger.info("INVALID RECORDS: %s", num_invalid_records)
+    for col in columns:
+        if col in invalid_counts:
+            logger.warning("    %-8s %s invalid values, in rows: %s%s", col, invalid_counts[col],
+                    ', '.join(map(str, invalid_samples[col])), ', ...' if invalid_counts[col] > len(invalid_samples[col]) else '')
+
+    if num_invalid_records > 0 and output_invalid_records_path is not None:
+        logger.warning("Invalid records were written to file: %s", output_invalid_records_path)
+        _print_invalid_records_note(output_invalid_records_path)
+
+    if num_valid_records == 0:
+        _print_validation_result(False, f"{patient_file_path} has no valid records")
+        return 1
+    _print_validation_result(True, f"{num_valid_records} of {num_records} records in {patient_file_path} are valid and will be hashed")
+    return 0
+
+def _print_validation_result(passed, message):
+    status = Fore.GREEN + "PASS" if passed else Fore.RED + "FAIL"
+    print("[" + Style.BRIGHT + status + Style.RESET_ALL + "] " + message)
+
+def watch_folder(args):
+    """
+    Parse a config file and hash each patient file that lands in the watched folder
+    """
+    logger.debug("watch_folder called with %s", args.config)
+
+    configuration = read_config_file(args.config, WATCH_CONFIG_NAMES)
+    configuration['verbose'] = args.verbose
+
+    logger.debug("Calling  _watch_folder  with configuration:")
+    for key, value in configuration.items():
+        logger.debug("    kwarg: %s = %r", key, value)
+
+    rc = _watch_folder(**configuration)
+    return rc
+
+# Options of the watch config file
+WATCH_CONFIG_NAMES = {
+        'schema', 'secret', 'output', 'data_folder', 'output_folder', 'schema_folder',
+        'chunk_size', 'workers', 'engine', 'blocking', 'reader', 'compact', 'exact_duplicates', 'pipeline',
+        'pattern', 'poll_seconds', 'settle_seconds'}
+
+# Per-file metrics written by watch to its output folder
+WATCH_METRICS_FILE_NAME = 'watch_metrics.csv'
+WATCH_METRICS_COLUMNS = ['file', 'detected', 'finished', 'records', 'valid', 'invalid', 'settle_seconds', 'hash_seconds', 'latency_seconds', 'error']
+
+# Outputs of a patient file are written here, inside the output folder, then moved into place
+_WATCH_TEMP_FOLDER_NAME = '.pprl_watch'
+
+# Default outputs of create, match and deduplicate, which share my_files with the patient files watch hashes
+_WATCH_IGNORED_FILE_NAMES = ('out.csv', exact_duplicates_file_name('out.csv'), 'invalid_records.csv', 'deduplicate.csv', 'linkages.csv')
+
+def _watch_folder(
+        schema = 'schema.json',
+        secret = None,
+        output = '{stem}_CLKs.csv',
+        verbose = False,
+        data_folder = os.path.join(os.getcwd(), "my_files"),
+        output_folder = os.path.join(os.getcwd(), "my_files"),
+        schema_folder = os.path.join(os.getcwd(), "my_files"),
+        chunk_size = None,
+        workers = None,
+        engine = 'clkhash',
+        blocking = None,
+        reader = 'pandas',
+        compact = False,
+        exact_duplicates = False,
+        pipeline = False,
+        pattern = '*.csv',
+        poll_seconds = 1.0,
+        settle_seconds = 1.0,
+        max_files = None,
+        ):
+    """
+    Hash every patient file matching `pattern` that lands in `data_folder`, until interrupted (or `max_files` are done).
+
+    The schema and secret are read, and the hasher started, once, so every file is hashed with warm imports,
+    worker processes, memos and normalization cache. A file is hashed once its size and modification time have stayed
+    the same for `settle_seconds`, so files still being copied in are left alone. The outputs of each file are named
+    by `output` (with `{stem}` the file's name without extension), written to a temporary folder, and moved into the
+    output folder only once complete. Files whose hash file already exists are skipped, so restarting is safe.
+    A file that changes after it was hashed (or skipped), such as a corrected file dropped under the same name,
+    is hashed again, replacing its outputs. Files without the columns the schema hashes, such as linkages written
+    by match, aren't patient files and are skipped.
+
+    One row per hashed file is appended to `WATCH_METRICS_FILE_NAME` in the output folder.
+    """
+    logger.debug("Beginning execution within _watch_folder")
+
+    colorama.init()
+
+    if '{stem}' not in output:
+        raise ValueError(f'output must contain {{stem}}, so that each patient file gets its own hash file, not {output!r}')
+    if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size < 1):
+        raise ValueError(f'chunk_size must be a positive integer, not {chunk_size!r}')
+    if pipeline and chunk_size is None:
+        raise ValueError('pipeline passes chunks of records between its stages, so it needs a chunk_size')
+    if reader not in READERS:
+        raise ValueError(f'reader must be one of {", ".join(READERS)}, not {reader!r}')
+    if not os.path.isdir(data_folder):
+        raise FileNotFoundError(f'Cannot find the folder to watch: {data_folder}')
+
+    secret_file_path = validated_file_path('secret', secret, data_folder)
+    schema_file_path = validated_file_path('schema', schema, schema_folder)
+    with open(schema_file_path, 'r') as f:
+        schema_dict = json.load(f)
+    with open(secret_file_path, 'r') as secret_file:
+        secret = secret_file.read()
+    if secret == "":
+        raise ValueError(f'The secret file cannot be empty: {secret_file_path}')
+
+    temp_folder = os.path.join(output_folder, _WATCH_TEMP_FOLDER_NAME)
+    os.makedirs(temp_folder, exist_ok = True)
+    metrics_file_path = os.path.join(output_folder, WATCH_METRICS_FILE_NAME)
+
+    # Nothing watch or the other commands write by default, nor the secret and schema, is taken for a patient file
+    def output_names(stem):
+        return [output.format(stem=stem), exact_duplicates_file_name(output.format(stem=stem)), f"{stem}_invalid_records.csv"]
+    ignored_patterns = output_names('*') + [WATCH_METRICS_FILE_NAME, *_WATCH_IGNORED_FILE_NAMES]
+    ignored_file_paths = {os.path.abspath(secret_file_path), os.path.abspath(schema_file_path)}
+
+    cache = NormalizationCache()
+    hash_target = HashTarget(secret, schema_dict, None, blocking = blocking, workers = workers, engine = engine)
+    columns = ['row_id', 'source'] + hash_target.unignored_feature_names
+
+    logger.info("Watching %s for patient files matching %s", data_folder, pattern)
+    print("[" + Style.BRIGHT + Fore.GREEN + "WATCH" + Style.RESET_ALL + "] " +
+            f"Hashing patient files as they land in {data_folder} (press Ctrl+C to stop)")
+
+    # name -> (size, modification time, when first seen, when last changed), for files not hashed yet
+    pending = {}
+    # name -> (size, modification time) of each file when it was hashed or skipped
+    done = {}
+    num_files = 0
+    try:
+        while max_files is None or num_files < max_files:
+            now = time.time()
+            landed = []
+            seen = set()
+            with os.scandir(data_folder) as entries:
+                for entry in entries:
+                    if (not entry.is_file() or not fnmatch(entry.name, pattern)
+                            or any(fnmatch(entry.name, x) for x in ignored_patterns)
+                            or os.path.abspath(entry.path) in ignored_file_paths):
+                        continue
+                    seen.add(entry.name)
+                    stat = entry.stat()
+                    if done.get(entry.name) == (stat.st_size, stat.st_mtime_ns):
+                        continue
+                    size, first_seen, last_changed = stat.st_size, now, now
+                    if entry.name in pending:
+                        _, _, first_seen, last_changed = pending[entry.name]
+                        if pending[entry.name][:2] != (stat.st_size, stat.st_mtime_ns):
+                            last_changed = now
+                    pending[entry.name] = (stat.st_size, stat.st_mtime_ns, first_seen, last_changed)
+                    if size > 0 and now - last_changed >= settle_seconds:
+                        landed.append(entry.name)
+            # Files that went away before they settled are forgotten, so one dropped again later starts afresh
+            for name in pending.keys() - seen:
+                del pending[name]
+
+            for name in sorted(landed):
+                size, mtime, first_seen, _ = pending.pop(name)
+                changed = name in done
+                done[name] = (size, mtime)
+                stem = os.path.splitext(name)[0]
+                if changed:
+                    logger.info("%s changed since it was last seen, so it is hashed again", name)
+                elif os.path.exists(os.path.join(output_folder, output.format(stem=stem))):
+                    logger.info("Skipping %s, which was already hashed to %s", name, output.format(stem=stem))
+                    continue
+                metrics = _watch_hash_file(
+                        os.path.join(data_folder, name),
+                        output_names(stem),
+                        temp_folder,
+                        output_folder,
+                        columns,
+                        reader,
+                        compact,
+                        cache,
+                        hash_target,
+                        chunk_size,
+                        pipeline,
+                        verbose,
+                        exact_duplicates,
+                        )
+                if metrics is None:
+                    continue
+                metrics['settle_seconds'] = metrics['started'] - first_seen
+                metrics['latency_seconds'] = metrics['finished'] - first_seen
+                _write_watch_metrics(metrics_file_path, name, first_seen, metrics)
+                num_files += 1
+                if max_files is not None and num_files >= max_files:
+                    break
+            else:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s", data_folder)
+    finally:
+        hash_target.close()
+        cache.log_stats()
+
+    logger.info("Hashed %s patient files", num_files)
+    return 0
+
+def _watch_hash_file(patient_file_path, output_names, temp_folder, output_folder, columns, reader, compact, cache,
+                     hash_target, chunk_size, pipeline, verbose, exact_duplicates):
+    """
+    Hash one patient file for `_watch_folder()`, moving its hash file and exact duplicates sidecar into the output folder
+    once they're both written. Invalid records, which nothing reads automatically, are written in place.
+
+    Returns the file's metrics, or None if it lacks the columns the schema hashes and so isn't a patient file.
+    A failure is logged and recorded in the metrics, and leaves no output behind.
+    """
+    # A file that can't be read fails below, where that's recorded
+    try:
+        _, header = _delimiter_and_header(patient_file_path)
+    except (OSError, UnicodeDecodeError, csv.Error):
+        header = None
+    if header is not None:
+        missing_columns = [name for name in columns if name not in header]
+        if missing_columns:
+            logger.info("Skipping %s, which has no %s column, so isn't a patient file", patient_file_path, ", ".join(missing_columns))
+            return None
+
+    output_name, exact_duplicates_name, invalid_records_name = output_names
+    temp_paths = [os.path.join(temp_folder, x) for x in (output_name, exact_duplicates_name)]
+    invalid_records_path = os.path.join(output_folder, invalid_records_name)
+    for path in temp_paths + [invalid_records_path]:
+        if os.path.exists(path):
+            os.remove(path)
+    hash_target.redirect(temp_paths[0], temp_paths[1] if exact_duplicates else None)
+
+    metrics = {'started': time.time(), 'valid': 0, 'invalid': 0, 'error': ''}
+    logger.info("Hashing %s", patient_file_path)
+    try:
+        if chunk_size is not None:
+            num_valid_records, num_invalid_records = _create_CLKs_in_chunks(
+                    patient_file_path, columns, reader, compact, cache, [hash_target], invalid_records_path, chunk_size, verbose, pipeline)
+        else:
+            num_valid_records, num_invalid_records = _create_CLKs_at_once(
+                    patient_file_path, columns, reader, compact, cache, [hash_target], invalid_records_path, verbose)
+        hash_target.finish()
+        metrics['valid'], metrics['invalid'] = num_valid_records, num_invalid_records
+        # The sidecar goes first, so it's in place whenever the hash file is
+        for temp_path, name in reversed(list(zip(temp_paths, (output_name, exact_duplicates_name)))):
+            if os.path.exists(temp_path):
+                os.replace(temp_path, os.path.join(output_folder, name))
+        logger.info("Wrote %s to %s", output_name, output_folder)
+    # create exits on some bad inputs, which shouldn't stop the watch
+    except (Exception, SystemExit) as e:
+        logger.exception("Could not hash %s", patient_file_path)
+        metrics['error'] = f"{type(e).__name__}: {e}"
+        for path in temp_paths + [invalid_records_path]:
+            if os.path.exists(path):
+                os.remove(path)
+    metrics['finished'] = time.time()
+    return metrics
+
+def _write_watch_metrics(metrics_file_path, name, first_seen, metrics):
+    new_file = not os.path.exists(metrics_file_path)
+    with open(metrics_file_path, 'a') as metrics_file:
+        csv_writer = csv.writer(metrics_file)
+        if new_file:
+            csv_writer.writerow(WATCH_METRICS_COLUMNS)
+        csv_writer.writerow([
+                name,
+                datetime.fromtimestamp(first_seen).isoformat(timespec='seconds'),
+                datetime.fromtimestamp(metrics['finished']).isoformat(timespec='seconds'),
+                metrics['valid'] + metrics['invalid'],
+                metrics['valid'],
+                metrics['invalid'],
+                f"{metrics['settle_seconds']:.3f}",
+                f"{metrics['finished'] - metrics['started']:.3f}",
+                f"{metrics['latency_seconds']:.3f}",
+                metrics['error'],
+                ])
+    logger.info("%s: %s records in %.2f s, %.2f s after it landed",
+            name, metrics['valid'] + metrics['invalid'], metrics['finished'] - metrics['started'], metrics['latency_seconds'])
+
+# Ways to read a delimited file into a DataFrame. Both give the same records.
+#   pandas: pd.read_csv, in one thread, with every value a Python str
+#   arrow:  pyarrow's multithreaded CSV parser, with strings kept in Arrow memory (needs pyarrow)
+READERS = ('pandas', 'arrow')
+
+# Bytes of the file the arrow reader parses at a time (split between its threads)
+ARROW_BLOCK_SIZE = 1 << 24
+
+def read_dataframe_from_CSV(file_path, chunk_size = None, columns = None, reader = 'pandas'):
+    """
+    Read a delimited file into a DataFrame of strings (with integer row_ids).
+
+    If `chunk_size` is given, an iterator over DataFrames of that many rows is returned instead.
+    If `columns` is given, the file's other columns are skipped; those present are read in the file's order.
+    `reader` is one of `READERS`.
+    """
     logger.debug("Creating DataFrame from: %s", file_path)
 
-    def get_delimiter(file_path, bytes = 4096):
-        # Source - https://stackoverflow.com/a/69796836
-        # Posted by pietz
-        # Retrieved 2025-11-21, License - CC BY-SA 4.0
-        sniffer = csv.Sniffer()
-        data = open(file_path, "r").read(bytes)
-        delimiter = sniffer.sniff(data).delimiter
-        return delimiter
+    if reader not in READERS:
+        raise ValueError(f'reader must be one of {", ".join(READERS)}, not {reader!r}')
+
+    delimiter, header = _delimiter_and_header(file_path)
+    if delimiter is None:
+        logger.error("The data file is empty: %s", file_path)
+        exit(1)
+
+    usecols = None
+    if columns is not None:
+        usecols = [name for name in header if name in columns]
+        skipped = [name for name in header if name not in columns]
+        if skipped:
+            logger.info("Skipping columns which aren't needed: %s", ', '.join(skipped))
+
+    if reader == 'arrow':
+        return _read_dataframe_with_arrow(file_path, delimiter, header, usecols, chunk_size)
 
     try:
         from collections import defaultdict
         return pd.read_csv(file_path,
-                sep = get_delimiter(file_path),
+                sep = delimiter,
                 dtype = defaultdict(lambda: str, row_id="int",),
                 keep_default_na=False,
+                usecols = usecols,
+                chunksize = chunk_size,
                 )
     except pd.errors.EmptyDataError:
         logger.error("The data file is empty: %s", file_path)
@@ -501,6 +1645,89 @@ def read_dataframe_from_CSV(file_path):
     #except pd.errors.ParserError:
         #print(f"\nERROR:\n    The data file couldn't be read: {patient_file_path}\n")
 
+def _delimiter_and_header(file_path, bytes = 4096):
+    """
+    Return the delimiter and the column names of a delimited file, or None and no names if the file is empty
+    """
+    # Source - https://stackoverflow.com/a/69796836
+    # Posted by pietz
+    # Retrieved 2025-11-21, License - CC BY-SA 4.0
+    sniffer = csv.Sniffer()
+    # utf-8-sig drops a leading byte order mark, as pandas and pyarrow do, so that the first name matches their columns
+    with open(file_path, "r", encoding = "utf-8-sig") as f:
+        data = f.read(bytes)
+        if data == "":
+            return None, []
+        delimiter = sniffer.sniff(data).delimiter
+        f.seek(0)
+        header = next(csv.reader(f, delimiter = delimiter), [])
+    return delimiter, header
+
+def _read_dataframe_with_arrow(file_path, delimiter, header, usecols, chunk_size):
+    """
+    `read_dataframe_from_CSV()` with pyarrow: strings stay in Arrow memory, as `string[pyarrow]` columns
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        logger.error("The arrow reader needs pyarrow, which isn't installed. Install it (pip install pprl[arrow]) or use reader: pandas")
+        raise
+
+    read_options = pa_csv.ReadOptions(use_threads = True, block_size = ARROW_BLOCK_SIZE)
+    parse_options = pa_csv.ParseOptions(delimiter = delimiter)
+    # Like keep_default_na=False: every value is read as written, and nothing is missing
+    convert_options = pa_csv.ConvertOptions(
+            include_columns = usecols or [],
+            column_types = {name: pa.int64() if name == "row_id" else pa.string() for name in header},
+            null_values = [],
+            strings_can_be_null = False,
+            quoted_strings_can_be_null = False,
+            )
+
+    def to_pandas(table, start = 0):
+        df = table.to_pandas(types_mapper = {pa.string(): pd.StringDtype("pyarrow")}.get)
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+    if chunk_size is None:
+        return to_pandas(pa_csv.read_csv(file_path, read_options, parse_options, convert_options))
+    return _ArrowChunkReader(pa_csv.open_csv(file_path, read_options, parse_options, convert_options), chunk_size, to_pandas)
+
+class _ArrowChunkReader:
+    """
+    Iterate over a pyarrow CSV stream as DataFrames of `chunk_size` records, like the iterator of `pd.read_csv()`
+    """
+    def __init__(self, stream, chunk_size, to_pandas):
+        self._stream = stream
+        self.chunk_size = chunk_size
+        self._to_pandas = to_pandas
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._stream.close()
+
+    def __iter__(self):
+        import pyarrow as pa
+
+        # Arrow parses the file a block of bytes at a time; batches are regrouped into chunks of exactly chunk_size records
+        start = 0
+        pending = None
+        for batch in self._stream:
+            table = pa.Table.from_batches([batch])
+            pending = table if pending is None else pa.concat_tables([pending, table])
+            while pending.num_rows >= self.chunk_size:
+                yield self._to_pandas(pending.slice(0, self.chunk_size), start)
+                start += self.chunk_size
+                pending = pending.slice(self.chunk_size)
+        if pending is not None and pending.num_rows > 0:
+            yield self._to_pandas(pending, start)
+
 def synthesize_identifiers(args):
     """
     Generate a synthetic patient identifier file
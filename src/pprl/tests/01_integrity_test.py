@@ -8,8 +8,12 @@ import filecmp
 import json
 import pytest
 import os
+import shutil
 
-from pprl.tests.templates import basic_test_pattern, compare_hashes
+import pandas as pd
+
+from pprl import hashing, pprl
+from pprl.tests.templates import basic_test_pattern, compare_hashes, compare_create_outputs
 
 class TestIntegrity:
     """Test that all outputs match our expectations"""
@@ -104,3 +108,404 @@ class TestIntegrity:
                     secret = secret,
                     expected_linkages = ('100', '1-100', '100', '1-100'),
                     )
+
+    def test_chunked_hashing(capsys):
+        """Hashing in chunks should write exactly the same files as hashing all records at once."""
+        for patients in ["100-patients-original.csv", "100-patients-missing-data.csv"]:
+            for chunk_size in [1, 7, 100, 1000]:
+                compare_create_outputs(capsys,
+                        schema = "100-patient-schema.json",
+                        patients = patients,
+                        options = {'chunk_size': chunk_size},
+                        )
+
+    def test_pipelined_hashing(capsys, monkeypatch):
+        """Hashing chunks in a pipeline should write exactly the same files as hashing all records at once."""
+        monkeypatch.setattr(hashing, "MIN_SHARD_SIZE", 10)
+        for options in [{'chunk_size': 1}, {'chunk_size': 7}, {'chunk_size': 1000}, {'chunk_size': 20, 'workers': 2}]:
+            compare_create_outputs(capsys,
+                    schema = "100-patient-schema.json",
+                    patients = "100-patients-missing-data.csv",
+                    options = {'pipeline': True, **options},
+                    )
+
+    def test_multiprocess_hashing(capsys, monkeypatch):
+        """Hashing across several processes should write exactly the same files as hashing in one."""
+        # Split even these small files into several shards
+        monkeypatch.setattr(hashing, "MIN_SHARD_SIZE", 10)
+        for options in [{'workers': 1}, {'workers': 3}, {'workers': 2, 'chunk_size': 40}, {'workers': 2, 'engine': 'numpy'}]:
+            compare_create_outputs(capsys,
+                    schema = "100-patient-schema.json",
+                    patients = "100-patients-missing-data.csv",
+                    options = options,
+                    )
+
+    def test_numpy_engine(capsys):
+        """Hashing with the numpy engine should write exactly the same files as hashing with clkhash."""
+        for schema, patients in [
+                ("schema.json", "3_test_patients.csv"),
+                ("20_ordering.json", "20_test_matches_a.csv"),
+                ("100-patient-schema.json", "100-patients-missing-data.csv"),
+                ]:
+            compare_create_outputs(capsys,
+                    schema = schema,
+                    patients = patients,
+                    options = {'engine': 'numpy'},
+                    )
+
+    def test_incremental_hashing(capsys, tmp_path):
+        """Re-hashing with a CLK cache should only hash changed records, and write the same hashes as a full run."""
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        schema_dir = os.path.join(os.path.dirname(__file__), "schemas")
+        shutil.copy(os.path.join(data_dir, "secret.txt"), tmp_path)
+
+        # Next month's extract: one record changed, one removed and one added
+        month_1 = pd.read_csv(os.path.join(data_dir, "100-patients-original.csv"), dtype=str)
+        month_2 = month_1.drop(index=10).copy()
+        month_2.loc[3, 'first'] = 'Tamara'
+        month_2 = pd.concat([month_2, month_1.iloc[[0]].assign(row_id='101', first='Nobody')])
+        month_1.to_csv(tmp_path / "month_1.csv", index=False)
+        month_2.to_csv(tmp_path / "month_2.csv", index=False)
+
+        def create(patients, output, output_folder, **kwargs):
+            os.makedirs(output_folder, exist_ok=True)
+            pprl._create_CLKs(
+                    patients = patients,
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = output,
+                    data_folder = str(tmp_path),
+                    schema_folder = schema_dir,
+                    output_folder = str(output_folder),
+                    **kwargs
+                    )
+            return pd.read_csv(os.path.join(output_folder, output), dtype=str)
+
+        for options in [{}, {'chunk_size': 30}]:
+            incremental = tmp_path / f"incremental_{len(options)}"
+            full = tmp_path / f"full_{len(options)}"
+
+            hashes_1 = create("month_1.csv", "hashes_1.csv", incremental, clk_cache = "clk_cache.csv", **options)
+            hashes_2 = create("month_2.csv", "hashes_2.csv", incremental, clk_cache = "clk_cache.csv", **options)
+            create("month_1.csv", "hashes_1.csv", full)
+            create("month_2.csv", "hashes_2.csv", full)
+
+            # Identical to full runs, and the delta holds exactly the new and changed records
+            assert filecmp.cmp(incremental / "hashes_1.csv", full / "hashes_1.csv", shallow=False)
+            assert filecmp.cmp(incremental / "hashes_2.csv", full / "hashes_2.csv", shallow=False)
+            assert filecmp.cmp(incremental / "hashes_1_delta.csv", full / "hashes_1.csv", shallow=False)
+            delta_2 = pd.read_csv(incremental / "hashes_2_delta.csv", dtype=str)
+            assert delta_2['row_id'].tolist() == ['4', '101']
+            assert delta_2.merge(hashes_1).empty
+            assert len(pd.read_csv(incremental / "clk_cache.csv")) == len(hashes_2)
+
+            # A different secret invalidates the whole cache
+            shutil.copy(os.path.join(data_dir, "basic_secret.txt"), tmp_path / "secret.txt")
+            create("month_2.csv", "hashes_3.csv", incremental, clk_cache = "clk_cache.csv", **options)
+            assert filecmp.cmp(incremental / "hashes_3.csv", incremental / "hashes_3_delta.csv", shallow=False)
+            shutil.copy(os.path.join(data_dir, "secret.txt"), tmp_path / "secret.txt")
+
+    def test_multiple_targets(capsys, tmp_path, monkeypatch):
+        """Hashing one input for several schemas and secrets at once should write the same files as one run per target."""
+        monkeypatch.setattr(hashing, "MIN_SHARD_SIZE", 10)
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        schema_dir = os.path.join(os.path.dirname(__file__), "schemas")
+
+        # The same features, hashed into longer Bloom filters
+        shutil.copy(os.path.join(schema_dir, "100-patient-schema.json"), tmp_path)
+        with open(os.path.join(schema_dir, "100-patient-schema.json")) as f:
+            schema_dict = json.load(f)
+        schema_dict['clkConfig']['l'] = 1024
+        with open(tmp_path / "1024-schema.json", "w") as f:
+            json.dump(schema_dict, f)
+
+        targets = [
+                {'output': "hashes_a.csv"},
+                {'output': "hashes_b.csv", 'secret': "basic_secret.txt"},
+                {'output': "hashes_c.csv", 'schema': "1024-schema.json"},
+                ]
+
+        def create(output_folder, **kwargs):
+            os.makedirs(output_folder)
+            pprl._create_CLKs(**{
+                    'patients': "100-patients-missing-data.csv",
+                    'secret': "secret.txt",
+                    'schema': "100-patient-schema.json",
+                    'data_folder': data_dir,
+                    'schema_folder': str(tmp_path),
+                    'output_folder': str(output_folder),
+                    **kwargs
+                    })
+
+        for target in targets:
+            create(tmp_path / "single" / target['output'], output = "hashes.csv", **{k: v for k, v in target.items() if k != 'output'})
+
+        for n, options in enumerate([{}, {'chunk_size': 30, 'workers': 6}]):
+            create(tmp_path / f"targets_{n}", targets = targets, **options)
+            for target in targets:
+                assert filecmp.cmp(tmp_path / f"targets_{n}" / target['output'], tmp_path / "single" / target['output'] / "hashes.csv", shallow=False)
+            assert filecmp.cmp(tmp_path / f"targets_{n}" / "invalid_records.csv", tmp_path / "single" / "hashes_a.csv" / "invalid_records.csv", shallow=False)
+
+        with pytest.raises(ValueError):
+            create(tmp_path / "duplicate_outputs", targets = [{'output': "hashes.csv"}, {'output': "hashes.csv", 'secret': "basic_secret.txt"}])
+
+    def test_targets_with_different_features(capsys, tmp_path):
+        """Targets whose schemas hash different features should each write the same file as hashing with that schema alone."""
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        schema_dir = os.path.join(os.path.dirname(__file__), "schemas")
+
+        # The same schema, without hashing the city
+        shutil.copy(os.path.join(schema_dir, "100-patient-schema.json"), tmp_path)
+        with open(os.path.join(schema_dir, "100-patient-schema.json")) as f:
+            schema_dict = json.load(f)
+        for feature in schema_dict['features']:
+            if feature['identifier'] == 'city':
+                feature['ignored'] = True
+        with open(tmp_path / "no-city-schema.json", "w") as f:
+            json.dump(schema_dict, f)
+
+        targets = [
+                {'output': "hashes_all.csv"},
+                {'output': "hashes_no_city.csv", 'schema': "no-city-schema.json"},
+                ]
+
+        def create(output_folder, **kwargs):
+            os.makedirs(output_folder)
+            pprl._create_CLKs(**{
+                    'patients': "100-patients-missing-data.csv",
+                    'secret': "secret.txt",
+                    'schema': "100-patient-schema.json",
+                    'data_folder': data_dir,
+                    'schema_folder': str(tmp_path),
+                    'output_folder': str(output_folder),
+                    **kwargs
+                    })
+
+        for target in targets:
+            create(tmp_path / "single" / target['output'], output = "hashes.csv", **{k: v for k, v in target.items() if k != 'output'})
+        for n, options in enumerate([{}, {'chunk_size': 30}]):
+            create(tmp_path / f"targets_{n}", targets = targets, **options)
+            for target in targets:
+                assert filecmp.cmp(tmp_path / f"targets_{n}" / target['output'], tmp_path / "single" / target['output'] / "hashes.csv", shallow=False)
+        assert not filecmp.cmp(tmp_path / "targets_0" / "hashes_all.csv", tmp_path / "targets_0" / "hashes_no_city.csv", shallow=False)
+
+    def test_arrow_reader(capsys):
+        """Reading patient and hash files with pyarrow should write exactly the same files as reading them with pandas."""
+        pytest.importorskip("pyarrow")
+        for schema, patients in [
+                ("schema.json", "3_test_patients.csv"),
+                ("20_ordering.json", "20_test_matches_a.csv"),
+                ("100-patient-schema.json", "100-patients-missing-data.csv"),
+                ]:
+            for options in [{'reader': 'arrow'}, {'reader': 'arrow', 'chunk_size': 7}]:
+                compare_create_outputs(capsys,
+                        schema = schema,
+                        patients = patients,
+                        options = options,
+                        )
+
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        patients_file = os.path.join(data_dir, "100-patients-missing-data.csv")
+        expected = pprl.read_dataframe_from_CSV(patients_file)
+        observed = pprl.read_dataframe_from_CSV(patients_file, reader = 'arrow')
+        assert (observed.dtypes[1:] == pd.StringDtype("pyarrow")).all()
+        pd.testing.assert_frame_equal(observed.astype(object), expected.astype(object))
+        with pprl.read_dataframe_from_CSV(patients_file, chunk_size = 30, reader = 'arrow') as chunks:
+            chunks = list(chunks)
+        assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+        pd.testing.assert_frame_equal(pd.concat(chunks).astype(object), expected.astype(object))
+
+    def test_compact_frames(capsys, monkeypatch):
+        """Hashing from compact frames, a slice of records at a time, should write exactly the same files."""
+        monkeypatch.setattr(hashing, "RECORDS_SLICE_SIZE", 16)
+        options = [{'compact': True}, {'compact': True, 'chunk_size': 40, 'engine': 'numpy'}]
+        try:
+            import pyarrow
+            options.append({'compact': True, 'reader': 'arrow'})
+        except ImportError:
+            pass
+        for schema, patients in [
+                ("20_ordering.json", "20_test_matches_a.csv"),
+                ("100-patient-schema.json", "100-patients-missing-data.csv"),
+                ]:
+            for option in options:
+                compare_create_outputs(capsys,
+                        schema = schema,
+                        patients = patients,
+                        options = option,
+                        )
+
+    def test_unused_columns(capsys, tmp_path):
+        """Columns of the patient file which no schema feature uses should be skipped, with either reader."""
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        shutil.copy(os.path.join(data_dir, "secret.txt"), tmp_path)
+        patients = pd.read_csv(os.path.join(data_dir, "100-patients-original.csv"), dtype=str)
+        patients.insert(3, 'notes', 'free text')
+        patients.to_csv(tmp_path / "with_notes.csv", index=False)
+        shutil.copy(os.path.join(data_dir, "100-patients-original.csv"), tmp_path)
+
+        for reader in ['pandas', 'arrow']:
+            if reader == 'arrow':
+                pytest.importorskip("pyarrow")
+            for patients_file in ["with_notes.csv", "100-patients-original.csv"]:
+                output_folder = tmp_path / reader / patients_file
+                os.makedirs(output_folder)
+                pprl._create_CLKs(
+                        patients = patients_file,
+                        secret = "secret.txt",
+                        schema = "100-patient-schema.json",
+                        output = "hashes.csv",
+                        data_folder = str(tmp_path),
+                        schema_folder = os.path.join(os.path.dirname(__file__), "schemas"),
+                        output_folder = str(output_folder),
+                        reader = reader,
+                        )
+            assert filecmp.cmp(
+                    tmp_path / reader / "with_notes.csv" / "hashes.csv",
+                    tmp_path / reader / "100-patients-original.csv" / "hashes.csv",
+                    shallow=False)
+
+    def test_byte_order_mark(capsys, tmp_path):
+        """A patient file starting with a UTF-8 byte order mark should hash the same as without it, with either reader."""
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        shutil.copy(os.path.join(data_dir, "secret.txt"), tmp_path)
+        shutil.copy(os.path.join(data_dir, "100-patients-original.csv"), tmp_path)
+        with open(os.path.join(data_dir, "100-patients-original.csv"), "rb") as f:
+            data = f.read()
+        with open(tmp_path / "with_bom.csv", "wb") as f:
+            f.write(b"\xef\xbb\xbf" + data)
+
+        for reader in ['pandas', 'arrow']:
+            if reader == 'arrow':
+                pytest.importorskip("pyarrow")
+            for patients_file in ["with_bom.csv", "100-patients-original.csv"]:
+                output_folder = tmp_path / reader / patients_file
+                os.makedirs(output_folder)
+                pprl._create_CLKs(
+                        patients = patients_file,
+                        secret = "secret.txt",
+                        schema = "100-patient-schema.json",
+                        output = "hashes.csv",
+                        data_folder = str(tmp_path),
+                        schema_folder = os.path.join(os.path.dirname(__file__), "schemas"),
+                        output_folder = str(output_folder),
+                        reader = reader,
+                        chunk_size = 30,
+                        )
+            assert filecmp.cmp(
+                    tmp_path / reader / "with_bom.csv" / "hashes.csv",
+                    tmp_path / reader / "100-patients-original.csv" / "hashes.csv",
+                    shallow=False)
+
+    def test_exact_duplicate_sidecar(capsys, tmp_path):
+        """Exact duplicates should be hashed once, recorded in a sidecar, and matched exactly as if each were compared."""
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        schema_dir = os.path.join(os.path.dirname(__file__), "schemas")
+        shutil.copy(os.path.join(data_dir, "secret.txt"), tmp_path)
+
+        # Records 1-5 again under new row_ids, and record 1 a third time with different capitalization
+        patients = pd.read_csv(os.path.join(data_dir, "100-patients-original.csv"), dtype=str)
+        copies = patients.iloc[0:5].assign(row_id=[str(n) for n in range(201, 206)])
+        variant = patients.iloc[[0]].assign(row_id='301', first=patients['first'][0].lower())
+        pd.concat([patients.iloc[:50], copies, patients.iloc[50:], variant]).to_csv(tmp_path / "duplicated.csv", index=False)
+
+        def create(output_folder, **kwargs):
+            os.makedirs(output_folder, exist_ok=True)
+            pprl._create_CLKs(
+                    patients = "duplicated.csv",
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = "hashes.csv",
+                    data_folder = str(tmp_path),
+                    schema_folder = schema_dir,
+                    output_folder = str(output_folder),
+                    **kwargs
+                    )
+
+        create(tmp_path / "plain")
+        create(tmp_path / "sidecar", exact_duplicates = True)
+        create(tmp_path / "sidecar_chunks", exact_duplicates = True, chunk_size = 30)
+        assert filecmp.cmp(tmp_path / "plain" / "hashes.csv", tmp_path / "sidecar" / "hashes.csv", shallow=False)
+        assert filecmp.cmp(tmp_path / "plain" / "hashes.csv", tmp_path / "sidecar_chunks" / "hashes.csv", shallow=False)
+
+        sidecar = pd.read_csv(tmp_path / "sidecar" / "hashes_exact_duplicates.csv", header=None, skiprows=1)
+        assert sorted(map(tuple, sidecar.to_numpy().tolist())) == [(1, 201), (1, 301), (2, 202), (3, 203), (4, 204), (5, 205), (201, 301)]
+
+        # Matching through the first record of each group finds exactly the pairs comparing every record finds
+        for folder in ["plain", "sidecar", "sidecar_chunks"]:
+            for hashes, output in [(["hashes.csv"], "self_linkages.csv"), (["hashes.csv", "hashes.csv"], "linkages.csv")]:
+                os.makedirs(tmp_path / folder / output.removesuffix(".csv"))
+                pprl._match_CLKs(
+                        hashes = hashes,
+                        threshold = 0.975,
+                        output = output,
+                        data_folder = str(tmp_path / folder),
+                        output_folder = str(tmp_path / folder / output.removesuffix(".csv")),
+                        )
+                assert filecmp.cmp(
+                        tmp_path / "plain" / output.removesuffix(".csv") / output,
+                        tmp_path / folder / output.removesuffix(".csv") / output,
+                        shallow=False)
+
+        # The sidecar can be used directly to deduplicate the patient file, keeping one record of each group
+        shutil.copy(tmp_path / "sidecar" / "hashes_exact_duplicates.csv", tmp_path)
+        pprl._deduplicate(
+                patients = "duplicated.csv",
+                linkages = ["hashes_exact_duplicates.csv"],
+                output = "deduplicated.csv",
+                data_folder = str(tmp_path),
+                output_folder = str(tmp_path),
+                )
+        deduplicated = pd.read_csv(tmp_path / "deduplicated.csv")
+        assert len(deduplicated) == len(patients)
+        assert set(pd.read_csv(tmp_path / "duplicated.csv")['row_id']) - set(deduplicated['row_id']) == {1, 2, 3, 4, 5, 201}
+
+    def test_validated_cache(capsys, tmp_path, monkeypatch):
+        """Hashes should be identical whether the validated records are read from the cache or not."""
+        pytest.importorskip("pyarrow")
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        schema_dir = os.path.join(os.path.dirname(__file__), "schemas")
+        shutil.copy(os.path.join(data_dir, "secret.txt"), tmp_path)
+        # Some invalid records, so the cached invalid records are checked too
+        patients = pd.read_csv(os.path.join(data_dir, "100-patients-original.csv"), dtype=str)
+        patients.loc[[3, 7], 'dob'] = 'NOT A DATE'
+        patients.loc[7, 'zip'] = '@#$'
+        patients.to_csv(tmp_path / "patients.csv", index=False)
+
+        def create(output_folder, **kwargs):
+            os.makedirs(tmp_path / output_folder)
+            pprl._create_CLKs(
+                    patients = "patients.csv",
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = "hashes.csv",
+                    data_folder = str(tmp_path),
+                    schema_folder = schema_dir,
+                    output_folder = str(tmp_path / output_folder),
+                    **kwargs
+                    )
+            return tmp_path / output_folder
+
+        plain = create("plain")
+        stored = create("stored", validated_cache = "../validated")
+        assert len(os.listdir(tmp_path / "validated")) == 2
+
+        def fail(*args, **kwargs):
+            raise AssertionError("the cache should have been used")
+        with monkeypatch.context() as m:
+            m.setattr(pprl, "_normalize_and_validate", fail)
+            loaded = create("loaded", validated_cache = "../validated")
+            loaded_compact = create("loaded_compact", validated_cache = "../validated", compact = True)
+
+        for output_folder in [stored, loaded, loaded_compact]:
+            assert filecmp.cmp(plain / "hashes.csv", output_folder / "hashes.csv", shallow=False)
+            assert filecmp.cmp(plain / "invalid_records.csv", output_folder / "invalid_records.csv", shallow=False)
+
+        # Changing the patient file misses the cache
+        patients.loc[0, 'first'] = 'SOMEONE'
+        patients.to_csv(tmp_path / "patients.csv", index=False)
+        create("changed", validated_cache = "../validated")
+        assert len(os.listdir(tmp_path / "validated")) == 4
+
+        with pytest.raises(ValueError):
+            create("chunked", validated_cache = "../validated", chunk_size = 10)
@@ -138,3 +138,47 @@ def compare_hashes(
 
         assert lower_bound <= similarity <= upper_bound
 
+
+def compare_create_outputs(
+        capsys,
+        patients = None,
+        schema = "schema.json",
+        secret = "secret.txt",
+        data_folder = None,
+        schema_folder = None,
+        options = None,
+        ):
+    """Hash the same input with the default settings and with `options`; every output file must be identical."""
+
+    test_dir = Path(__file__).parent
+
+    if data_folder is None:
+        data_folder = test_dir / "data"
+    if schema_folder is None:
+        schema_folder = test_dir / "schemas"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_folders = []
+        for name, kwargs in (("default", {}), ("options", options or {})):
+            output_folder = os.path.join(temp_dir, name)
+            os.mkdir(output_folder)
+            pprl._create_CLKs(
+                    data_folder = str(data_folder),
+                    patients = patients,
+                    schema = schema,
+                    schema_folder = str(schema_folder),
+                    secret = secret,
+                    output = "hashes.csv",
+                    output_folder = output_folder,
+                    verbose=True,
+                    **kwargs
+                    )
+            output_folders.append(output_folder)
+
+        default_folder, options_folder = output_folders
+        assert sorted(os.listdir(default_folder)) == sorted(os.listdir(options_folder))
+        for file_name in os.listdir(default_folder):
+            assert_file_comparison(
+                    os.path.join(default_folder, file_name),
+                    os.path.join(options_folder, file_name),
+                    )
@@ -0,0 +1,103 @@
+import os
+
+import pandas as pd
+import pytest
+
+from pprl import pprl
+from pprl.blocking import BlockingKeys, soundex
+
+FIELDS = ['first', 'last', 'city', 'state', 'zip', 'dob']
+
+DEFINITIONS = {
+        'name_year': [{'field': 'last', 'transform': 'soundex'}, {'field': 'dob', 'transform': 'year'}],
+        'zip3_month': [{'field': 'zip', 'transform': 'prefix', 'length': 3}, {'field': 'dob', 'transform': 'month'}],
+        }
+
+def make_patients():
+    return pd.DataFrame({
+        'first': ['ROBERT', 'RUPERT', 'ANNA', 'ANNA'],
+        'last': ['SMITH', 'SMYTH', 'LEE', ''],
+        'city': ['BOSTON', 'BOSTON', 'SALEM', 'SALEM'],
+        'state': ['MA', 'MA', 'MA', 'MA'],
+        'zip': ['02134', '02139', '01970', '01970'],
+        'dob': ['1980-05-01', '1980-05-17', '1975-12-31', '1975-12-31'],
+        })
+
+class TestBlockingKeys:
+    """Unit tests for the keyed blocking columns written by `create`."""
+
+    @pytest.mark.parametrize("name, code", [
+        ("ROBERT", "R163"), ("RUPERT", "R163"), ("ASHCRAFT", "A261"), ("TYMCZAK", "T522"),
+        ("PFISTER", "P236"), ("HONEYMAN", "H555"), ("LEE", "L000"), ("O CONNOR", "O256"), ("", ""),
+        ])
+    def test_soundex(self, name, code):
+        """Test American Soundex codes against the standard examples."""
+        assert soundex(name) == code
+
+    def test_columns(self):
+        """Test that records sharing the components share a key, and that a blank component leaves the key blank."""
+        blocks = BlockingKeys("secret", DEFINITIONS, FIELDS).columns(make_patients())
+
+        assert blocks.columns.tolist() == ['block_name_year', 'block_zip3_month']
+        assert blocks['block_name_year'][0] == blocks['block_name_year'][1] != blocks['block_name_year'][2]
+        assert blocks['block_zip3_month'][0] == blocks['block_zip3_month'][1] != blocks['block_zip3_month'][2]
+        assert blocks['block_name_year'][3] == ''
+        assert blocks['block_zip3_month'][2] == blocks['block_zip3_month'][3]
+        assert all(len(x) == 16 for x in blocks['block_zip3_month'])
+
+    def test_keyed(self):
+        """Test that keys depend on the secret and on the definition, not just on the values."""
+        patients = make_patients()
+        blocks = BlockingKeys("secret", DEFINITIONS, FIELDS).columns(patients)
+
+        assert blocks.equals(BlockingKeys("secret", DEFINITIONS, FIELDS).columns(patients))
+        assert not ((blocks == BlockingKeys("other secret", DEFINITIONS, FIELDS).columns(patients)) & (blocks != '')).any().any()
+        renamed = BlockingKeys("secret", {'zip3_month_2': DEFINITIONS['zip3_month']}, FIELDS).columns(patients)
+        assert not (renamed['block_zip3_month_2'] == blocks['block_zip3_month']).any()
+
+    @pytest.mark.parametrize("definitions", [
+        [],
+        {'a': []},
+        {'a': ['nickname']},
+        {'a': [{'field': 'last', 'transform': 'metaphone'}]},
+        {'a': [{'field': 'zip', 'transform': 'prefix'}]},
+        {'a': [{'field': 'zip', 'transform': 'prefix', 'length': 3, 'extra': 1}]},
+        ])
+    def test_invalid_definitions(self, definitions):
+        """Test that malformed blocking definitions are rejected."""
+        with pytest.raises(ValueError):
+            BlockingKeys("secret", definitions, FIELDS)
+
+    def test_blocked_matching(self, tmp_path):
+        """Test that matching on blocking keys finds the same links as comparing all pairs."""
+        data_dir = os.path.join(os.path.dirname(__file__), "data")
+        schema_dir = os.path.join(os.path.dirname(__file__), "schemas")
+
+        for blocking, folder in [(DEFINITIONS, tmp_path / "blocked"), (None, tmp_path / "all_pairs")]:
+            os.makedirs(folder)
+            for patients, output in [("100-patients-original.csv", "hashes_1.csv"), ("100-patients-missing-data.csv", "hashes_2.csv")]:
+                pprl._create_CLKs(
+                        patients = patients,
+                        secret = "secret.txt",
+                        schema = "100-patient-schema.json",
+                        output = output,
+                        data_folder = data_dir,
+                        schema_folder = schema_dir,
+                        output_folder = str(folder),
+                        blocking = blocking,
+                        )
+            pprl._match_CLKs(
+                    hashes = ["hashes_1.csv", "hashes_2.csv"],
+                    threshold = 0.975,
+                    output = "linkages.csv",
+                    data_folder = str(folder),
+                    output_folder = str(folder),
+                    )
+
+        hashes = pd.read_csv(tmp_path / "blocked" / "hashes_1.csv", dtype=str)
+        assert hashes.columns.tolist() == ['row_id', 'source', 'clk', 'block_name_year', 'block_zip3_month']
+        assert (hashes['clk'] == pd.read_csv(tmp_path / "all_pairs" / "hashes_1.csv", dtype=str)['clk']).all()
+
+        linkages = pd.read_csv(tmp_path / "blocked" / "linkages.csv")
+        assert linkages.equals(pd.read_csv(tmp_path / "all_pairs" / "linkages.csv"))
+        assert linkages.iloc[:, 0].tolist() == list(range(41, 101))
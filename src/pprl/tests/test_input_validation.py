@@ -1,6 +1,9 @@
 import pandas as pd
 import pytest
-from pprl.util import validate_input_fields
+from pandas.testing import assert_frame_equal
+from anyascii import anyascii
+from pprl.util import validate_input_fields, _validate_input_fields_by_row, normalize_fields, compact_frame, NormalizationCache
+from pprl.util import _sanitize_date, _sanitize_date_column
 
 class TestValidInput:
     """Direct unit tests for the validate_input_fields function."""
@@ -375,3 +378,107 @@ class TestValidInput:
         assert invalid.iloc[0]['first'] == '  john@#$  '
         assert invalid.iloc[0]['last'] == '  doe!!!  '
         assert invalid.iloc[0]['zip'] == 'INVALID'
+
+    def test_matches_row_by_row_validation(self):
+        """Test that column-wise validation returns exactly what the row-by-row version does."""
+        df = pd.DataFrame({
+            'row_id': [1, 2, 3, 4, 5, 6, 7, 8, 2],
+            'source': ['a'] * 9,
+            'first': ['  mary jane ', 'NaN', '@#$', 'Zoë', 'j.r.', '999', 'Ann_Marie', 'x\t', 'Bob'],
+            'last': ["o'brien", 'Smith', 'Jones', 'Brown', 'Lee', 'Kim', 'Wu', 'Li', 'Ng'],
+            'city': ['Boston', 'Boston', 'Boston', 'Boston', 'Boston', 'Boston', 'Boston', 'Boston', 'Boston'],
+            'zip': [' 02101 ', '02101-1234', '0210', '02101-123', '١٢٣٤٥', 'ABCDE', '02101-1234-5', '02101', '02101'],
+            'dob': ['1990/01/02', '1-2-1990', '01/02/99', '02/30/1990', 'NaT', ' 3/ 4/2020', '2020-1-1', '', '1990-01-01'],
+            'name': ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i'],
+        })
+
+        valid, invalid = validate_input_fields(df)
+        expected_valid, expected_invalid = _validate_input_fields_by_row(df)
+
+        assert_frame_equal(valid, expected_valid)
+        assert_frame_equal(invalid, expected_invalid)
+
+    def test_compact_frame(self):
+        """Test that a compact frame stays compact through normalization and validation, with the same values."""
+        pytest.importorskip("pyarrow")
+        df = pd.DataFrame({
+            'row_id': [1, 2, 3, 4, 5, 6],
+            'first': ['Mary', 'Zoë', 'John', 'Ann', 'Bob', 'Eve'],
+            'city': ['Boston', 'boston', 'Boston', 'Salem', 'Salem', 'Salem'],
+            'zip': ['02101', '02101-1234', '02101', '01970', '0197', '01970'],
+            'dob': ['1990-01-02', '1/2/1990', '1990-01-02', '1985-07-04', '1985-07-04', '1985-07-04'],
+        })
+        compact = compact_frame(df)
+
+        assert compact['row_id'].dtype == df['row_id'].dtype
+        assert compact['first'].dtype == pd.StringDtype("pyarrow")
+        assert isinstance(compact['city'].dtype, pd.CategoricalDtype)
+
+        normalized = normalize_fields(compact.drop(columns='row_id'))
+        assert normalized['first'].dtype == pd.StringDtype("pyarrow")
+        assert isinstance(normalized['city'].dtype, pd.CategoricalDtype)
+        assert normalized['city'].cat.categories.tolist() == ['BOSTON', 'SALEM']
+
+        valid, invalid = validate_input_fields(compact)
+        expected_valid, expected_invalid = validate_input_fields(df)
+        assert len(valid) == 5
+        assert isinstance(valid['dob'].dtype, pd.CategoricalDtype)
+        assert_frame_equal(valid.astype(object), expected_valid.astype(object))
+        assert_frame_equal(invalid.astype(object), expected_invalid.astype(object))
+
+
+class TestNormalization:
+    """Direct unit tests for normalize_fields and the NormalizationCache."""
+
+    def test_matches_transliteration_of_every_value(self):
+        """Test that normalizing distinct values gives the same frame as transliterating every cell."""
+        df = pd.DataFrame({
+            'first': ['Zoë', 'zoë', 'Zoë', 'ﬁona', 'Mary Jane', 'Zoë'],
+            'city': ['Zürich', 'Boston', 'Boston', '東京', 'Zürich', 'São Paulo'],
+            'zip': ['02101', '02101', '١٢٣٤٥', '02101-1234', '', '02101'],
+        }, index=[10, 11, 12, 13, 14, 15])
+
+        expected = df.map(anyascii).map(lambda x: x.upper())
+
+        assert_frame_equal(normalize_fields(df), expected)
+        assert_frame_equal(normalize_fields(df, NormalizationCache()), expected)
+
+    def test_cache_hits_across_calls(self):
+        """Test that values seen in an earlier chunk are served from the cache."""
+        cache = NormalizationCache()
+        chunk = pd.DataFrame({'state': ['MA', 'MA', 'CT'], 'city': ['Boston', 'Hartford', 'Hartford']})
+
+        normalize_fields(chunk, cache)
+        assert (cache.hits, cache.misses) == (0, 4)
+
+        normalize_fields(chunk, cache)
+        assert (cache.hits, cache.misses) == (4, 4)
+        assert cache.hit_rate == 0.5
+
+    def test_cache_is_bounded(self):
+        """Test that the least recently used values are evicted once the cache is full."""
+        cache = NormalizationCache(max_size=2)
+
+        normalize_fields(pd.DataFrame({'city': ['Boston', 'Hartford', 'Concord']}), cache)
+        normalize_fields(pd.DataFrame({'city': ['Boston']}), cache)
+
+        assert cache.hits == 0
+        assert len(cache._entries) == 2
+
+
+class TestDateColumn:
+    """Direct unit tests for the column-wise date parser."""
+
+    @pytest.mark.parametrize("dates", [
+        ['1990-01-15', '2001-12-31', '1985-7-4', '2020-02-29', '2021-02-29', 'nan', '0999-12-31', '1/15/1990'],
+        ['01/15/1990', '1/5/2001', '12/31/1899', '02/29/2000', '02/30/2000', '2020-01-01', '', '13/01/2000'],
+        ['01/15/90', '1/5/01', '12/31/99', '02/29/00', '02/29/68', '10/10/10', '01/15/1990', 'NaT'],
+        ['2000/01/ 5', '٢٠٢٠-01-01', '2020-01-123', ' 1990-01-15 ', None, '999', 'not a date'],
+    ])
+    def test_matches_scalar_sanitizer(self, dates):
+        """Test that parsing the dominant format in one pass gives the same values and flags as _sanitize_date."""
+        cleaned, invalid = _sanitize_date_column(pd.Series(dates, dtype=object))
+        expected = [_sanitize_date(value) for value in dates]
+
+        assert list(cleaned) == [clean for clean, _ in expected]
+        assert list(invalid) == [not is_valid for _, is_valid in expected]
@@ -0,0 +1,464 @@
+import filecmp
+import os
+
+import anonlink
+import numpy as np
+import pandas as pd
+import pytest
+from bitarray import bitarray
+
+from pprl import matching, pprl
+from pprl.matching import (
+        BitSampleLSH, MatchPool,
+        clk_array, dice_pairs, find_matching_pairs, find_self_matching_pairs,
+        popcount_bound, popcount_sort, popcount_windows, triangle_ranges,
+        )
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+
+def random_clks(n, bits = 256, seed = 0):
+    rng = np.random.default_rng(seed)
+    return [bitarray(x.tolist()) for x in rng.random((n, bits)) < 0.4]
+
+def near_copies(clks, flips, seed = 1):
+    rng = np.random.default_rng(seed)
+    copies = []
+    for clk in clks:
+        copy = clk.copy()
+        for position in rng.choice(len(clk), size = flips, replace = False):
+            copy[position] = not copy[position]
+        copies.append(copy)
+    return copies
+
+def brute_force(clks_1, clks_2, threshold):
+    _, _, (left, right) = anonlink.candidate_generation.find_candidate_pairs(
+            [clks_1, clks_2], anonlink.similarities.dice_coefficient, threshold)
+    return set(zip(left, right))
+
+class TestLSH:
+    """Unit tests for the LSH match engine."""
+
+    def test_dice_pairs(self):
+        """Test that Dice coefficients agree with anonlink, including for empty CLKs."""
+        clks_1 = random_clks(20) + [bitarray(256 * '0')]
+        clks_2 = near_copies(clks_1[:20], 10) + [bitarray(256 * '0')]
+        left, right = np.meshgrid(np.arange(21), np.arange(21), indexing = 'ij')
+        similarities = dice_pairs(clk_array(clks_1), clk_array(clks_2), left.ravel(), right.ravel())
+
+        sims, _, (expected_left, expected_right) = anonlink.candidate_generation.find_candidate_pairs(
+                [clks_1, clks_2], anonlink.similarities.dice_coefficient, 0.0)
+        expected = np.zeros((21, 21))
+        expected[expected_left, expected_right] = sims
+        assert np.allclose(similarities, expected.ravel())
+
+    def test_recall(self):
+        """Test that LSH finds only pairs brute force finds, and with enough bands finds all of them."""
+        clks_1 = random_clks(300)
+        clks_2 = near_copies(clks_1[:200], 12) + random_clks(100, seed = 2)
+        expected = brute_force(clks_1, clks_2, 0.9)
+        assert len(expected) == 200
+
+        arrays = clk_array(clks_1), clk_array(clks_2)
+        _, (left, right) = BitSampleLSH(256, bands = 2, rows = 24).find_candidate_pairs(*arrays, 0.9)
+        found = set(zip(left.tolist(), right.tolist()))
+        assert found < expected
+
+        similarities, (left, right) = BitSampleLSH(256, bands = 64, rows = 16).find_candidate_pairs(*arrays, 0.9)
+        assert set(zip(left.tolist(), right.tolist())) == expected
+        assert (similarities >= 0.9).all()
+
+    @pytest.mark.parametrize("bands, rows", [(0, 16), (16, 0), (16, 65)])
+    def test_invalid_parameters(self, bands, rows):
+        """Test that bands without any bits, or with more than fit in a bucket key, are rejected."""
+        with pytest.raises(ValueError):
+            BitSampleLSH(256, bands, rows)
+
+    @pytest.mark.parametrize("hashes, blocking", [
+        (["hashes_1.csv", "hashes_2.csv"], None),
+        (["hashes_1.csv", "hashes_2.csv"], {'zip_year': [{'field': 'zip', 'transform': 'exact'}, {'field': 'dob', 'transform': 'year'}]}),
+        (["hashes_1.csv"], None),
+        ])
+    def test_engines_match(self, tmp_path, hashes, blocking):
+        """Test that matching with the LSH, numpy and BLAS engines writes the same linkages as anonlink."""
+        for engine in ['anonlink', 'lsh', 'numpy', 'blas']:
+            folder = tmp_path / engine
+            os.makedirs(folder)
+            for patients, output in [("100-patients-original.csv", "hashes_1.csv"), ("100-patients-off-by-1.csv", "hashes_2.csv")]:
+                pprl._create_CLKs(
+                        patients = patients,
+                        secret = "secret.txt",
+                        schema = "100-patient-schema.json",
+                        output = output,
+                        data_folder = DATA_DIR,
+                        schema_folder = SCHEMA_DIR,
+                        output_folder = str(folder),
+                        blocking = blocking,
+                        )
+            pprl._match_CLKs(
+                    hashes = hashes,
+                    threshold = 0.9,
+                    output = "linkages.csv",
+                    data_folder = str(folder),
+                    output_folder = str(folder),
+                    engine = engine,
+                    )
+
+        linkages = pd.read_csv(tmp_path / "anonlink" / "linkages.csv")
+        assert linkages.equals(pd.read_csv(tmp_path / "lsh" / "linkages.csv"))
+        assert linkages.equals(pd.read_csv(tmp_path / "numpy" / "linkages.csv"))
+        assert linkages.equals(pd.read_csv(tmp_path / "blas" / "linkages.csv"))
+        assert len(linkages) > 0 or len(hashes) == 1
+
+    def test_unknown_engine(self):
+        """Test that an unknown match engine is rejected."""
+        with pytest.raises(ValueError):
+            pprl._match_CLKs(hashes = ["hashes_1.csv"], engine = 'minhash')
+
+class TestNumpyEngine:
+    """Tests for the packed uint64 popcount engine."""
+
+    @pytest.mark.parametrize("bits, threshold", [(256, 0.9), (256, 0.5), (104, 0.75), (8, 0.5)])
+    def test_same_pairs_as_anonlink(self, bits, threshold):
+        """Test that the engine finds exactly anonlink's pairs, for any CLK length and at exact thresholds."""
+        clks_1 = random_clks(150, bits) + [bitarray(bits * '0')]
+        clks_2 = near_copies(clks_1[:100], max(1, bits // 20)) + random_clks(50, bits, seed = 2) + [bitarray(bits * '0')]
+        expected = brute_force(clks_1, clks_2, threshold)
+
+        left, right = find_matching_pairs(clk_array(clks_1), clk_array(clks_2), threshold, 'numpy')
+        assert sorted(zip(left.tolist(), right.tolist())) == sorted(expected)
+        assert len(expected) > 0
+
+    def test_long_clks(self):
+        """Test that CLKs sharing more than 32767 bits, whose doubled counts overflow 16 bits, are still matched."""
+        clks_1 = random_clks(4, 100_000)
+        clks_2 = near_copies(clks_1[:2], 500) + random_clks(2, 100_000, seed = 2)
+        expected = brute_force(clks_1, clks_2, 0.9)
+
+        left, right = find_matching_pairs(clk_array(clks_1), clk_array(clks_2), 0.9, 'numpy')
+        assert sorted(zip(left.tolist(), right.tolist())) == sorted(expected) == [(0, 0), (1, 1)]
+
+    def test_blocks(self, monkeypatch):
+        """Test that splitting the comparison into blocks of rows doesn't change the pairs, with or without blocking codes."""
+        clks_1 = clk_array(random_clks(150))
+        clks_2 = clk_array(near_copies(random_clks(150)[:100], 12) + random_clks(50, seed = 2))
+        rng = np.random.default_rng(3)
+        codes = [rng.integers(-1, 3, size = (150, 2)), rng.integers(-1, 3, size = (150, 2))]
+        expected = [sorted(zip(*find_matching_pairs(clks_1, clks_2, 0.9, 'anonlink', x))) for x in (None, codes)]
+
+        monkeypatch.setattr(matching, "NUMPY_BLOCK_ROWS", 7)
+        monkeypatch.setattr(matching, "NUMPY_BLOCK_COLUMNS", 30)
+        found = [sorted(zip(*find_matching_pairs(clks_1, clks_2, 0.9, 'numpy', x))) for x in (None, codes)]
+        assert found == expected
+        assert len(expected[1]) < len(expected[0])
+
+class TestBlasEngine:
+    """Tests for the matrix multiplication engine."""
+
+    @pytest.mark.parametrize("bits, threshold", [(256, 0.9), (256, 0.5), (104, 0.75), (8, 0.5)])
+    def test_same_pairs_as_anonlink(self, bits, threshold):
+        """Test that the engine finds exactly anonlink's pairs, for any CLK length and at exact thresholds."""
+        clks_1 = random_clks(150, bits) + [bitarray(bits * '0')]
+        clks_2 = near_copies(clks_1[:100], max(1, bits // 20)) + random_clks(50, bits, seed = 2) + [bitarray(bits * '0')]
+        expected = brute_force(clks_1, clks_2, threshold)
+
+        left, right = find_matching_pairs(clk_array(clks_1), clk_array(clks_2), threshold, 'blas')
+        assert sorted(zip(left.tolist(), right.tolist())) == sorted(expected)
+        assert len(expected) > 0
+
+    def test_tiles(self):
+        """Test that a memory budget small enough to split the comparison into many tiles doesn't change the pairs."""
+        clks_1 = clk_array(random_clks(150))
+        clks_2 = clk_array(near_copies(random_clks(150)[:100], 12) + random_clks(50, seed = 2))
+        rng = np.random.default_rng(3)
+        codes = [rng.integers(-1, 3, size = (150, 2)), rng.integers(-1, 3, size = (150, 2))]
+        expected = [sorted(zip(*find_matching_pairs(clks_1, clks_2, 0.9, 'anonlink', x))) for x in (None, codes)]
+
+        assert matching.blas_tile_rows(256, 0.05) < 30
+        found = [sorted(zip(*find_matching_pairs(clks_1, clks_2, 0.9, 'blas', x, blas_memory_mb = 0.05))) for x in (None, codes)]
+        assert found == expected
+
+    @pytest.mark.parametrize("memory_mb", [0, -1])
+    def test_invalid_memory(self, memory_mb):
+        """Test that a memory budget which isn't positive is rejected."""
+        with pytest.raises(ValueError):
+            pprl._match_CLKs(hashes = ["hashes_1.csv"], engine = 'blas', blas_memory_mb = memory_mb)
+
+class TestPopcountPruning:
+    """Tests for pruning the pairs whose popcounts can't clear the threshold."""
+
+    def test_popcount_bound(self):
+        """Test that the bound holds exactly for the pairs whose best Dice coefficient clears the threshold."""
+        counts = np.arange(0, 120)
+        for threshold in [0.5, 0.9, 0.975, 1.0]:
+            bound = popcount_bound(counts[:, None], counts[None, :], threshold)
+            for a, b in [(0, 0), (0, 5), (78, 80), (79, 81), (40, 41), (100, 119)]:
+                best = 2 * min(a, b) / (a + b) if a + b else 0.0
+                assert bound[a, b] == (best >= threshold)
+
+    @pytest.mark.parametrize("min_rows", [1, 5, 1000])
+    def test_windows_cover_bound(self, min_rows):
+        """Test that the windows split the first input and hold every pair clearing the bound, and few others."""
+        rng = np.random.default_rng(0)
+        counts_1 = np.sort(rng.integers(0, 60, size = 300))
+        counts_2 = np.sort(rng.integers(0, 60, size = 200))
+        windows = popcount_windows(counts_1, counts_2, 0.9, min_rows)
+
+        covered = np.zeros((300, 200), dtype = bool)
+        for start_1, stop_1, start_2, stop_2 in windows:
+            assert stop_1 - start_1 >= min(min_rows, 300 - start_1)
+            covered[start_1:stop_1, start_2:stop_2] = True
+        bound = popcount_bound(counts_1[:, None], counts_2[None, :], 0.9)
+        assert not (bound & ~covered).any()
+        if min_rows == 1:
+            assert covered.sum() == bound.sum()
+
+    def test_pruning_counts(self, caplog):
+        """Test the number of pairs logged as ruled out, between two inputs and in a self match."""
+        clks_1 = clk_array(random_clks(80) + [bitarray(256 * '0')])
+        clks_2 = clk_array(random_clks(60, seed = 2))
+        counts_1, counts_2 = matching.popcounts(clks_1), matching.popcounts(clks_2)
+
+        with caplog.at_level("INFO", logger = "pprl.matching"):
+            popcount_sort(clks_1, clks_2, 0.975, min_rows = 1)
+            popcount_sort(clks_1, None, 0.975, min_rows = 1)
+        bound = popcount_bound(counts_1[:, None], counts_2[None, :], 0.975)
+        self_bound = popcount_bound(counts_1[:, None], counts_1[None, :], 0.975)[np.triu_indices(81, 1)]
+        assert [r.getMessage().split(" comparisons")[0] for r in caplog.records] == [
+                f"Popcounts ruled out {(~bound).sum()} of {81 * 60}",
+                f"Popcounts ruled out {(~self_bound).sum()} of {81 * 80 // 2}",
+                ]
+
+    @pytest.mark.parametrize("engine", ['anonlink', 'numpy', 'blas'])
+    @pytest.mark.parametrize("threshold", [0.975, 0.9])
+    def test_same_pairs(self, monkeypatch, engine, threshold):
+        """Test that pruning doesn't change the pairs found, with or without blocking codes."""
+        clks = random_clks(400)
+        clks_1 = clk_array(clks)
+        clks_2 = clk_array(near_copies(clks[:200], 2) + near_copies(clks[200:300], 6) + random_clks(100, seed = 2))
+        rng = np.random.default_rng(3)
+        codes = [rng.integers(-1, 2, size = (400, 1)), rng.integers(-1, 2, size = (400, 1))]
+        expected = [sorted(zip(*find_matching_pairs(clks_1, clks_2, threshold, engine, x, prune = False))) for x in (None, codes)]
+
+        monkeypatch.setattr(matching, "PRUNE_MIN_ROWS", 16)
+        found = [sorted(zip(*find_matching_pairs(clks_1, clks_2, threshold, engine, x, prune = True))) for x in (None, codes)]
+        assert found == expected
+        assert len(expected[0]) > len(expected[1]) > 0
+
+    @pytest.mark.parametrize("engine", ['anonlink', 'numpy', 'blas'])
+    def test_same_self_matching_pairs(self, monkeypatch, engine):
+        """Test that pruning a self match doesn't change the pairs found, with or without blocking codes."""
+        clks = random_clks(300)
+        clks = clk_array(clks + near_copies(clks[:100], 2) + near_copies(clks[100:200], 6))
+        codes = np.random.default_rng(3).integers(-1, 2, size = (500, 1))
+        expected = [sorted(zip(*find_self_matching_pairs(clks, 0.975, engine, x))) for x in (None, codes)]
+
+        monkeypatch.setattr(matching, "PRUNE_MIN_ROWS", 16)
+        found = [sorted(zip(*find_self_matching_pairs(clks, 0.975, engine, x, prune = True))) for x in (None, codes)]
+        assert found == expected
+        assert len(expected[0]) > len(expected[1]) > 0
+
+    @pytest.mark.parametrize("engine", ['anonlink', 'blas'])
+    def test_match_pool(self, engine):
+        """Test that the workers of a pruned match find the same pairs as one process."""
+        clks = random_clks(300)
+        clks_1 = clk_array(clks)
+        clks_2 = clk_array(near_copies(clks[:200], 2) + random_clks(100, seed = 2))
+        codes = [np.random.default_rng(3).integers(-1, 2, size = (300, 1)) for _ in range(2)]
+        expected = sorted(zip(*find_matching_pairs(clks_1, clks_2, 0.975, engine, codes)))
+        expected_self = sorted(zip(*find_self_matching_pairs(clks_1, 0.975, engine, codes[0])))
+
+        with MatchPool(2) as pool:
+            assert pool._window_rows(300) < 300
+            assert sorted(zip(*pool.find_matching_pairs(clks_1, clks_2, 0.975, engine, codes, prune = True))) == expected
+            assert sorted(zip(*pool.find_self_matching_pairs(clks_1, 0.975, engine, codes[0], prune = True))) == expected_self
+        assert len(expected) > 0
+
+    def test_pruning_logged(self, tmp_path, caplog):
+        """Test that a pruned match reports the share of comparisons the popcounts ruled out, and writes the same linkages."""
+        for patients, output in [("100-patients-original.csv", "hashes_1.csv"), ("100-patients-off-by-1.csv", "hashes_2.csv")]:
+            pprl._create_CLKs(
+                    patients = patients,
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = output,
+                    data_folder = DATA_DIR,
+                    schema_folder = SCHEMA_DIR,
+                    output_folder = str(tmp_path),
+                    )
+        for prune in [False, True]:
+            caplog.clear()
+            os.makedirs(tmp_path / str(prune))
+            with caplog.at_level("INFO", logger = "pprl.matching"):
+                pprl._match_CLKs(
+                        hashes = ["hashes_1.csv", "hashes_2.csv"],
+                        threshold = 0.975,
+                        output = "linkages.csv",
+                        data_folder = str(tmp_path),
+                        output_folder = str(tmp_path / str(prune)),
+                        prune = prune,
+                        )
+            assert any(r.getMessage().startswith("Popcounts ruled out") for r in caplog.records) == prune
+        assert filecmp.cmp(tmp_path / "False" / "linkages.csv", tmp_path / "True" / "linkages.csv", shallow=False)
+
+class TestParallelMatch:
+    """Tests for matching across a pool of worker processes."""
+
+    @pytest.mark.parametrize("engine, blocked", [('anonlink', False), ('anonlink', True), ('lsh', True)])
+    def test_match_pool(self, engine, blocked):
+        """Test that the workers find the same pairs as one process, with or without blocking codes."""
+        clks_1 = clk_array(random_clks(150))
+        clks_2 = clk_array(near_copies(random_clks(150)[:100], 12) + random_clks(50, seed = 2))
+        codes = None
+        if blocked:
+            rng = np.random.default_rng(3)
+            codes = [rng.integers(-1, 3, size = (150, 2)), rng.integers(-1, 3, size = (150, 2))]
+
+        expected = sorted(zip(*find_matching_pairs(clks_1, clks_2, 0.9, engine, codes)))
+        with MatchPool(2) as pool:
+            found = sorted(zip(*pool.find_matching_pairs(clks_1, clks_2, 0.9, engine, codes)))
+            # The pool is reused for other arrays, such as the next tile
+            again = sorted(zip(*pool.find_matching_pairs(clks_1[:40], clks_2, 0.9, engine, codes and [codes[0][:40], codes[1]])))
+        assert found == expected
+        assert len(expected) > 0
+        assert again == [x for x in expected if x[0] < 40]
+
+    @pytest.mark.parametrize("tile_size", [None, 30])
+    def test_parallel_match(self, tmp_path, tile_size):
+        """Test that matching with workers writes the same linkages as matching in one process."""
+        for patients, output in [("100-patients-original.csv", "hashes_1.csv"), ("100-patients-off-by-1.csv", "hashes_2.csv")]:
+            pprl._create_CLKs(
+                    patients = patients,
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = output,
+                    data_folder = DATA_DIR,
+                    schema_folder = SCHEMA_DIR,
+                    output_folder = str(tmp_path),
+                    )
+        for workers in [1, 2]:
+            folder = tmp_path / str(workers)
+            os.makedirs(folder)
+            pprl._match_CLKs(
+                    hashes = ["hashes_1.csv", "hashes_2.csv"],
+                    threshold = 0.9,
+                    output = "linkages.csv",
+                    data_folder = str(tmp_path),
+                    output_folder = str(folder),
+                    tile_size = tile_size,
+                    workers = workers,
+                    )
+
+        linkages = pd.read_csv(tmp_path / "2" / "linkages.csv")
+        assert linkages.equals(pd.read_csv(tmp_path / "1" / "linkages.csv"))
+        assert len(linkages) > 0
+
+    @pytest.mark.parametrize("workers", [0, 1.5])
+    def test_invalid_workers(self, workers):
+        """Test that a number of workers which isn't a positive integer is rejected."""
+        with pytest.raises(ValueError):
+            pprl._match_CLKs(hashes = ["hashes_1.csv"], workers = workers)
+
+class TestSelfMatch:
+    """Tests for matching one hash file with itself through the upper triangle of pairs."""
+
+    @pytest.mark.parametrize("n, count", [(0, 4), (1, 4), (10, 16), (1000, 16)])
+    def test_triangle_ranges(self, n, count):
+        """Test that the ranges cover every row once, in order, with about as many pairs each."""
+        ranges = triangle_ranges(n, count)
+        assert [x for start, stop in ranges for x in range(start, stop)] == list(range(n))
+        if n >= count:
+            pairs = [(stop - start) * (2 * n - start - stop + 1) / 2 for start, stop in ranges]
+            assert len(ranges) == count
+            assert max(pairs) < 1.1 * min(pairs)
+
+    @pytest.mark.parametrize("engine, blocked, workers", [
+        ('anonlink', False, None), ('anonlink', True, None), ('lsh', True, None), ('numpy', True, None),
+        ('blas', False, None), ('anonlink', True, 2), ('lsh', False, 2), ('numpy', False, 2), ('blas', True, 2),
+        ])
+    def test_self_matching_pairs(self, engine, blocked, workers):
+        """Test that a self match finds each pair of distinct rows a full match finds, once."""
+        clks = random_clks(200)
+        clks = clk_array(clks + near_copies(clks[:100], 12))
+        codes = np.random.default_rng(3).integers(-1, 3, size = (300, 2)) if blocked else None
+
+        left, right = find_matching_pairs(clks, clks, 0.9, engine, codes if codes is None else [codes, codes])
+        expected = sorted((x, y) for x, y in zip(left.tolist(), right.tolist()) if x < y)
+        if workers is None:
+            left, right = find_self_matching_pairs(clks, 0.9, engine, codes)
+        else:
+            with MatchPool(workers) as pool:
+                left, right = pool.find_self_matching_pairs(clks, 0.9, engine, codes)
+        found = list(zip(left.tolist(), right.tolist()))
+        assert sorted(found) == expected
+        assert len(found) > 0
+
+    def test_self_match_reads_once(self, tmp_path, monkeypatch):
+        """Test that a self match reads its hash file once."""
+        pprl._create_CLKs(
+                patients = "100-patients-original.csv",
+                secret = "secret.txt",
+                schema = "100-patient-schema.json",
+                output = "hashes.csv",
+                data_folder = DATA_DIR,
+                schema_folder = SCHEMA_DIR,
+                output_folder = str(tmp_path),
+                )
+        reads = []
+        read_dataframe_from_CSV = pprl.read_dataframe_from_CSV
+        monkeypatch.setattr(pprl, "read_dataframe_from_CSV", lambda *args, **kwargs: reads.append(args) or read_dataframe_from_CSV(*args, **kwargs))
+        pprl._match_CLKs(
+                hashes = ["hashes.csv"],
+                output = "linkages.csv",
+                data_folder = str(tmp_path),
+                output_folder = str(tmp_path),
+                )
+        assert len(reads) == 1
+
+class TestTiledMatch:
+    """Tests for matching a tile of each hash file at a time."""
+
+    @pytest.mark.parametrize("hashes, blocking, engine, reader", [
+        (["hashes_1.csv", "hashes_2.csv"], None, 'anonlink', 'pandas'),
+        (["hashes_1.csv", "hashes_2.csv"], {'year': [{'field': 'dob', 'transform': 'year'}]}, 'anonlink', 'arrow'),
+        (["hashes_1.csv", "hashes_2.csv"], None, 'lsh', 'pandas'),
+        (["hashes_1.csv"], None, 'anonlink', 'pandas'),
+        ])
+    def test_tiled_match(self, tmp_path, hashes, blocking, engine, reader):
+        """Test that matching in tiles writes the same linkages and duplicates files as matching all at once."""
+        if reader == 'arrow':
+            pytest.importorskip("pyarrow")
+        for patients, output in [("100-patients-original.csv", "hashes_1.csv"), ("100-patients-off-by-1.csv", "hashes_2.csv")]:
+            pprl._create_CLKs(
+                    patients = patients,
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = output,
+                    data_folder = DATA_DIR,
+                    schema_folder = SCHEMA_DIR,
+                    output_folder = str(tmp_path),
+                    blocking = blocking,
+                    )
+        # Copy the second file's patients into the first, so a self match finds links
+        hashes_1 = pd.read_csv(tmp_path / "hashes_1.csv", dtype = str)
+        pd.concat([hashes_1, pd.read_csv(tmp_path / "hashes_2.csv", dtype = str).assign(row_id = lambda df: df['row_id'] + '0')]) \
+                .to_csv(tmp_path / "hashes_1.csv", index = False)
+
+        for tile_size, folder in [(None, tmp_path / "at_once"), (17, tmp_path / "tiled")]:
+            os.makedirs(folder)
+            pprl._match_CLKs(
+                    hashes = hashes,
+                    threshold = 0.9,
+                    output = "linkages.csv",
+                    data_folder = str(tmp_path),
+                    output_folder = str(folder),
+                    engine = engine,
+                    reader = reader,
+                    tile_size = tile_size,
+                    )
+
+        assert sorted(os.listdir(tmp_path / "tiled")) == sorted(os.listdir(tmp_path / "at_once"))
+        for name in os.listdir(tmp_path / "at_once"):
+            with open(tmp_path / "tiled" / name) as tiled, open(tmp_path / "at_once" / name) as at_once:
+                assert tiled.read() == at_once.read()
+        assert len(pd.read_csv(tmp_path / "tiled" / "linkages.csv")) > 0
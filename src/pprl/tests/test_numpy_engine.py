@@ -0,0 +1,130 @@
+import random
+
+import pytest
+from clkhash import clk
+from clkhash.schema import from_json_dict
+from clkhash.validate_data import EntryError
+
+from pprl import hashing
+from pprl.hashing import CLKHasher, NumpyCLKEncoder
+
+def make_schema(hashing_config, l = 1024, xor_folds = 0, kdf = None):
+    """A schema with an ignored index, and a name, a ZIP code, a number, a date and a sex to hash"""
+    def feature(identifier, format, comparison, **overrides):
+        return {
+            "identifier": identifier,
+            "format": format,
+            "hashing": {"comparison": comparison, **hashing_config, **overrides},
+        }
+
+    return {
+        "version": 3,
+        "clkConfig": {
+            "l": l,
+            "xor_folds": xor_folds,
+            "kdf": kdf or {"type": "HKDF", "hash": "SHA256", "info": "", "keySize": 64},
+        },
+        "features": [
+            {"identifier": "", "ignored": True},
+            feature("name", {"type": "string", "encoding": "utf-8", "case": "upper"}, {"type": "ngram", "n": 2},
+                    missingValue = {"sentinel": "", "replaceWith": "UNKNOWN"}),
+            feature("zip", {"type": "string", "encoding": "ascii", "pattern": "[0-9]*"},
+                    {"type": "ngram", "n": 1, "positional": True}),
+            feature("age", {"type": "integer", "minimum": 0, "maximum": 200},
+                    {"type": "numeric", "thresholdDistance": 5, "resolution": 2}),
+            feature("dob", {"type": "date", "format": "%Y-%m-%d"}, {"type": "exact"}),
+            feature("sex", {"type": "enum", "values": ["F", "M", ""]}, {"type": "ngram", "n": 3}),
+        ],
+    }
+
+def make_records(n, seed = 0):
+    rng = random.Random(seed)
+    names = [''.join(rng.choice('ABCDEFG ') for _ in range(rng.randrange(0, 9))).strip() for _ in range(n // 3 + 1)]
+    return [(
+        str(i),
+        rng.choice(names),
+        ''.join(rng.choice('0123456789') for _ in range(rng.choice([0, 5, 5, 9]))),
+        str(rng.randrange(0, 200)),
+        f"{rng.randrange(1900, 2030)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+        rng.choice(["F", "M", ""]),
+        ) for i in range(n)]
+
+HASHING_CONFIGS = [
+    {"strategy": {"bitsPerFeature": 200}, "hash": {"type": "doubleHash"}},
+    {"strategy": {"bitsPerFeature": 3}, "hash": {"type": "doubleHash"}},
+    {"strategy": {"bitsPerToken": 20}, "hash": {"type": "doubleHash", "prevent_singularity": True}},
+    {"strategy": {"bitsPerFeature": 200}, "hash": {"type": "blakeHash"}},
+    {"strategy": {"bitsPerToken": 70}, "hash": {"type": "blakeHash"}},
+]
+
+class TestNumpyEngine:
+    """Golden-equivalence tests for the NumPy CLK encoder against clkhash."""
+
+    @pytest.mark.parametrize("hashing_config", HASHING_CONFIGS)
+    @pytest.mark.parametrize("l, xor_folds", [(1024, 0), (512, 1), (64, 2)])
+    def test_bit_identical_to_clkhash(self, monkeypatch, hashing_config, l, xor_folds):
+        """Test that every CLK matches clkhash's, across comparisons, strategies, hash types and folds."""
+        monkeypatch.setattr(hashing, "NUMPY_BATCH_SIZE", 128)
+        schema = from_json_dict(make_schema(hashing_config, l = l, xor_folds = xor_folds))
+        records = make_records(300)
+
+        expected = clk.generate_clks(records, schema, "secret", max_workers = 1)
+        clks = NumpyCLKEncoder(schema, "secret").generate_clks(records)
+
+        assert [x.tobytes() for x in clks] == [x.tobytes() for x in expected]
+
+    def test_key_derivation_settings(self):
+        """Test that the HKDF salt, info, hash and key size are applied as clkhash applies them."""
+        kdf = {"type": "HKDF", "hash": "SHA512", "salt": "c2FsdHk=", "info": "aW5mbw==", "keySize": 32}
+        schema = from_json_dict(make_schema(HASHING_CONFIGS[0], kdf = kdf))
+        records = make_records(50)
+
+        assert NumpyCLKEncoder(schema, "secret").generate_clks(records) == clk.generate_clks(records, schema, "secret", max_workers = 1)
+
+    def test_hasher_engine_option(self):
+        """Test that CLKHasher gives the same CLKs with either engine, in one process or several."""
+        schema_dict = make_schema(HASHING_CONFIGS[0])
+        records = make_records(50)
+
+        with CLKHasher("secret", schema_dict, workers = 1) as hasher:
+            expected = hasher.hash_records(records)
+        with CLKHasher("secret", schema_dict, workers = 1, engine = 'numpy') as hasher:
+            assert hasher.hash_records(records, progress_bar = True) == expected
+
+    def test_memo_across_batches(self, monkeypatch):
+        """Test that values seen in earlier batches come from the memo, and that a tiny memo still gives the same CLKs."""
+        monkeypatch.setattr(hashing, "NUMPY_BATCH_SIZE", 50)
+        schema = from_json_dict(make_schema(HASHING_CONFIGS[3]))
+        records = make_records(200)
+        expected = clk.generate_clks(records, schema, "secret", max_workers = 1)
+
+        encoder = NumpyCLKEncoder(schema, "secret")
+        assert encoder.generate_clks(records) == expected
+        misses = {name: misses for name, (_, misses) in encoder.memo_stats().items()}
+        assert encoder.generate_clks(records) == expected
+        assert {name: misses for name, (_, misses) in encoder.memo_stats().items()} == misses
+        # Only 3 sexes, so only 3 misses, however many batches
+        assert encoder.memo_stats()['sex'][1] == 3
+
+        monkeypatch.setattr(hashing, "BIT_POSITION_MEMO_SIZE", 2)
+        assert NumpyCLKEncoder(schema, "secret").generate_clks(records) == expected
+
+    def test_invalid_entry(self):
+        """Test that the first invalid entry is reported like clkhash reports it."""
+        schema = from_json_dict(make_schema(HASHING_CONFIGS[0]))
+        records = make_records(20)
+        records[7] = (*records[7][:2], "1234X", *records[7][3:])
+        records[12] = (*records[12][:1], "lower", *records[12][2:])
+
+        with pytest.raises(EntryError) as expected:
+            clk.generate_clks(records, schema, "secret", max_workers = 1)
+        with pytest.raises(EntryError) as raised:
+            NumpyCLKEncoder(schema, "secret").generate_clks(records)
+
+        assert str(raised.value) == str(expected.value)
+        assert raised.value.row_index == 7
+
+    def test_unsupported_length(self):
+        """Test that a Bloom filter length which isn't a multiple of 64 is rejected up front."""
+        with pytest.raises(ValueError):
+            CLKHasher("secret", make_schema(HASHING_CONFIGS[0], l = 1000), engine = 'numpy')
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from pprl.pipeline import run_pipeline
+
+def test_items_pass_through_stages_in_order():
+    seen = []
+    stats = run_pipeline(range(50), [
+            ('double', lambda x: 2 * x),
+            ('increment', lambda x: x + 1),
+            ('collect', seen.append),
+            ], queue_size = 1)
+    assert seen == [2 * x + 1 for x in range(50)]
+    assert [s.name for s in stats] == ['read', 'double', 'increment', 'collect']
+    assert all(s.items == 50 for s in stats)
+    assert all(s.max_depth <= 1 for s in stats)
+
+def test_stages_run_in_their_own_threads():
+    threads = {}
+    def stage(name):
+        def record(x):
+            threads.setdefault(name, set()).add(threading.current_thread().name)
+            return x
+        return name, record
+    run_pipeline(range(10), [stage('a'), stage('b')])
+    assert threads['a'] == {'pipeline-a'}
+    assert threads['b'] == {'pipeline-b'}
+
+def test_failure_stops_every_stage():
+    def fail(x):
+        if x == 3:
+            raise ValueError("bad item")
+        return x
+
+    def endless():
+        n = 0
+        while True:
+            yield n
+            n += 1
+
+    # The source would never end, so this only returns if the failure stops it
+    with pytest.raises(ValueError, match="bad item"):
+        run_pipeline(endless(), [('fail', fail), ('drop', lambda x: None)], queue_size = 2)
+
+def test_source_failure_is_raised():
+    def broken():
+        yield 1
+        raise OSError("unreadable")
+
+    with pytest.raises(OSError, match="unreadable"):
+        run_pipeline(broken(), [('drop', lambda x: None)])
@@ -0,0 +1,111 @@
+import filecmp
+import os
+import shutil
+
+import pandas as pd
+import pytest
+import yaml
+
+from pprl import cli, pprl
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+
+def validate(tmp_path, **options):
+    return pprl._validate_patients(**{
+            'patients': "100-patients-missing-data.csv",
+            'schema': "100-patient-schema.json",
+            'data_folder': DATA_DIR,
+            'schema_folder': SCHEMA_DIR,
+            'output_folder': str(tmp_path),
+            **options,
+            })
+
+class TestValidate:
+    """Tests for the `validate` preflight command."""
+
+    def test_invalid_records_match_create(self, tmp_path):
+        """Test that validate writes exactly the invalid records create writes, in chunks of any size and in a pipeline."""
+        os.makedirs(tmp_path / "create")
+        pprl._create_CLKs(
+                patients = "100-patients-missing-data.csv",
+                secret = "secret.txt",
+                schema = "100-patient-schema.json",
+                output = "hashes.csv",
+                data_folder = DATA_DIR,
+                schema_folder = SCHEMA_DIR,
+                output_folder = str(tmp_path / "create"),
+                )
+        for n, options in enumerate([{}, {'chunk_size': 7}, {'chunk_size': 7, 'pipeline': True}]):
+            output_folder = tmp_path / f"validate_{n}"
+            os.makedirs(output_folder)
+            assert validate(output_folder, invalid_records = True, **options) == 0
+            assert filecmp.cmp(tmp_path / "create" / "invalid_records.csv", output_folder / "invalid_records.csv", shallow=False)
+            assert not os.path.exists(output_folder / "hashes.csv")
+
+    def test_report(self, tmp_path, capsys, caplog):
+        """Test that each column's invalid values are counted, with a sample of their row_ids."""
+        # Three copies of a file where the first names of rows 1-20 and last names of rows 21-40 are missing
+        patients = pd.read_csv(os.path.join(DATA_DIR, "100-patients-missing-data.csv"), dtype=str, keep_default_na=False)
+        patients = pd.concat([patients] * 3, ignore_index=True)
+        patients['row_id'] = range(1, len(patients) + 1)
+        patients.loc[[0, 150], 'dob'] = 'NOT A DATE'
+        patients.to_csv(tmp_path / "patients.csv", index=False)
+
+        assert validate(tmp_path, patients = "patients.csv", data_folder = str(tmp_path), samples = 2, chunk_size = 50) == 0
+        report = {r.getMessage().split()[0]: r.getMessage().strip() for r in caplog.records if r.getMessage().startswith("    ")}
+        assert report == {
+                'first': "first    60 invalid values, in rows: 1, 2, ...",
+                'last': "last     60 invalid values, in rows: 21, 22, ...",
+                'dob': "dob      2 invalid values, in rows: 1, 151",
+                }
+        assert "[PASS] 179 of 300 records" in capsys.readouterr().out
+        assert not os.path.exists(tmp_path / "invalid_records.csv")
+
+    def test_missing_columns(self, tmp_path, capsys):
+        """Test that a patient file without a column the schema hashes fails before anything is validated."""
+        patients = pd.read_csv(os.path.join(DATA_DIR, "100-patients-original.csv"), dtype=str)
+        patients.drop(columns=['zip']).to_csv(tmp_path / "patients.csv", index=False)
+        assert validate(tmp_path, patients = "patients.csv", data_folder = str(tmp_path), invalid_records = True) == 1
+        assert "[FAIL]" in capsys.readouterr().out
+        assert not os.path.exists(tmp_path / "invalid_records.csv")
+
+    def test_misordered_columns(self, tmp_path, capsys):
+        """Test that a patient file create would reject for the order of its columns fails validation too."""
+        patients = pd.read_csv(os.path.join(DATA_DIR, "100-patients-original.csv"), dtype=str)
+        patients[['row_id', 'source', 'first', 'last', 'zip', 'state', 'city', 'dob']].to_csv(tmp_path / "patients.csv", index=False)
+
+        assert validate(tmp_path, patients = "patients.csv", data_folder = str(tmp_path)) == 1
+        assert "[FAIL]" in capsys.readouterr().out
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), tmp_path)
+        with pytest.raises(SystemExit):
+            pprl._create_CLKs(
+                    patients = "patients.csv",
+                    secret = "secret.txt",
+                    schema = "100-patient-schema.json",
+                    output = "hashes.csv",
+                    data_folder = str(tmp_path),
+                    schema_folder = SCHEMA_DIR,
+                    output_folder = str(tmp_path),
+                    )
+
+    def test_hashing_options_are_ignored(self, tmp_path):
+        """Test that validate accepts the options of a create config, but nothing else."""
+        assert validate(tmp_path, secret = "secret.txt", output = "hashes.csv", engine = "numpy") == 0
+        with pytest.raises(TypeError):
+            validate(tmp_path, threshold = 0.9)
+
+    def test_cli(self, tmp_path, monkeypatch, capsys):
+        """Test that `pprl validate` runs on a create config file, without a secret file."""
+        monkeypatch.chdir(tmp_path)
+        with open(tmp_path / "create_CLKs.yml", "w") as f:
+            yaml.safe_dump({
+                    'patients': "100-patients-original.csv",
+                    'secret': "no_such_secret.txt",
+                    'schema': "100-patient-schema.json",
+                    'data_folder': DATA_DIR,
+                    'schema_folder': SCHEMA_DIR,
+                    'output_folder': str(tmp_path),
+                    }, f)
+        assert cli.main(["validate", str(tmp_path / "create_CLKs.yml")]) == 0
+        assert "[PASS] 100 of 100 records" in capsys.readouterr().out
@@ -0,0 +1,189 @@
+import filecmp
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from pprl import pprl
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "schemas")
+
+def watch_in_background(drop_folder, output_folder, max_files, **options):
+    """Start watching `drop_folder` in a thread, returning the thread and a list that will hold its return code."""
+    result = []
+    def watch():
+        result.append(pprl._watch_folder(**{
+                'schema': "100-patient-schema.json",
+                'secret': "secret.txt",
+                'data_folder': str(drop_folder),
+                'schema_folder': SCHEMA_DIR,
+                'output_folder': str(output_folder),
+                'poll_seconds': 0.05,
+                'settle_seconds': 0.1,
+                'max_files': max_files,
+                **options,
+                }))
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    return thread, result
+
+def create(patients, output_folder, **options):
+    os.makedirs(output_folder)
+    pprl._create_CLKs(
+            patients = patients,
+            secret = "secret.txt",
+            schema = "100-patient-schema.json",
+            output = "hashes.csv",
+            data_folder = DATA_DIR,
+            schema_folder = SCHEMA_DIR,
+            output_folder = str(output_folder),
+            **options
+            )
+
+class TestWatch:
+    """Tests for the `watch` drop folder mode."""
+
+    @pytest.mark.parametrize("options", [{}, {'chunk_size': 30, 'exact_duplicates': True}])
+    def test_files_are_hashed_as_they_land(self, tmp_path, options):
+        """Test that each file dropped in the folder gets the same outputs create writes, and a row of metrics."""
+        drop_folder = tmp_path / "drop"
+        os.makedirs(drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), drop_folder)
+
+        # Outputs go to the drop folder itself, and mustn't be taken for patient files
+        thread, result = watch_in_background(drop_folder, drop_folder, max_files = 2, **options)
+        for name in ["100-patients-original.csv", "100-patients-missing-data.csv"]:
+            shutil.copy(os.path.join(DATA_DIR, name), drop_folder / f"{name}.part")
+            os.replace(drop_folder / f"{name}.part", drop_folder / name)
+            time.sleep(0.2)
+        thread.join(timeout = 60)
+        assert not thread.is_alive()
+        assert result == [0]
+
+        for name in ["100-patients-original", "100-patients-missing-data"]:
+            create(f"{name}.csv", tmp_path / name, **options)
+            assert filecmp.cmp(tmp_path / name / "hashes.csv", drop_folder / f"{name}_CLKs.csv", shallow=False)
+            if 'exact_duplicates' in options:
+                assert filecmp.cmp(tmp_path / name / "hashes_exact_duplicates.csv", drop_folder / f"{name}_CLKs_exact_duplicates.csv", shallow=False)
+        assert filecmp.cmp(tmp_path / "100-patients-missing-data" / "invalid_records.csv",
+                drop_folder / "100-patients-missing-data_invalid_records.csv", shallow=False)
+        assert os.listdir(drop_folder / ".pprl_watch") == []
+
+        metrics = pd.read_csv(drop_folder / pprl.WATCH_METRICS_FILE_NAME, keep_default_na=False)
+        assert metrics.columns.tolist() == pprl.WATCH_METRICS_COLUMNS
+        assert sorted(metrics['file']) == ["100-patients-missing-data.csv", "100-patients-original.csv"]
+        assert (metrics['records'] == 100).all()
+        assert (metrics['error'] == '').all()
+        assert (metrics['latency_seconds'] >= metrics['hash_seconds']).all()
+
+    def test_files_still_being_written_wait(self, tmp_path):
+        """Test that a file is only hashed once it has stopped changing."""
+        drop_folder = tmp_path / "drop"
+        os.makedirs(drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), drop_folder)
+        lines = open(os.path.join(DATA_DIR, "100-patients-original.csv")).readlines()
+
+        thread, result = watch_in_background(drop_folder, tmp_path, max_files = 1, settle_seconds = 0.5)
+        with open(drop_folder / "patients.csv", "w") as f:
+            for line in lines:
+                f.write(line)
+                f.flush()
+                time.sleep(0.01)
+        thread.join(timeout = 60)
+        assert result == [0]
+        assert len(pd.read_csv(tmp_path / "patients_CLKs.csv")) == 100
+
+    def test_removed_files_are_forgotten(self, tmp_path):
+        """Test that a file removed before it settled is timed afresh when it's dropped again."""
+        drop_folder = tmp_path / "drop"
+        os.makedirs(drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), drop_folder)
+
+        thread, result = watch_in_background(drop_folder, tmp_path, max_files = 1, settle_seconds = 0.5)
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-original.csv"), drop_folder / "patients.csv")
+        time.sleep(0.2)
+        os.remove(drop_folder / "patients.csv")
+        time.sleep(1)
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-original.csv"), drop_folder / "patients.csv")
+        thread.join(timeout = 60)
+        assert result == [0]
+        metrics = pd.read_csv(tmp_path / pprl.WATCH_METRICS_FILE_NAME, keep_default_na=False)
+        assert metrics['settle_seconds'].tolist()[0] < 1
+
+    def test_failures_leave_no_hash_file(self, tmp_path):
+        """Test that a file which can't be hashed is recorded in the metrics, without stopping the watch or leaving output."""
+        drop_folder = tmp_path / "drop"
+        os.makedirs(drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), drop_folder)
+        # A patient file with a row of too many fields, which can't be read
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-original.csv"), drop_folder / "a_bad.csv")
+        with open(drop_folder / "a_bad.csv", "a") as f:
+            f.write("," * 50 + "\n")
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-original.csv"), drop_folder / "b_good.csv")
+
+        thread, result = watch_in_background(drop_folder, tmp_path, max_files = 2)
+        thread.join(timeout = 60)
+        assert result == [0]
+        assert not os.path.exists(tmp_path / "a_bad_CLKs.csv")
+        assert os.path.exists(tmp_path / "b_good_CLKs.csv")
+        metrics = pd.read_csv(tmp_path / pprl.WATCH_METRICS_FILE_NAME, keep_default_na=False).set_index('file')
+        assert metrics.loc["a_bad.csv", 'error'] != ''
+        assert metrics.loc["b_good.csv", 'error'] == ''
+
+    def test_other_outputs_are_not_patient_files(self, tmp_path, caplog):
+        """Test that the outputs of create, and other files without the schema's columns, are skipped quietly."""
+        drop_folder = tmp_path / "drop"
+        os.makedirs(drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), drop_folder)
+        pprl._create_CLKs(
+                patients = "100-patients-missing-data.csv",
+                secret = "secret.txt",
+                schema = "100-patient-schema.json",
+                data_folder = DATA_DIR,
+                schema_folder = SCHEMA_DIR,
+                output_folder = str(drop_folder),
+                exact_duplicates = True,
+                )
+        assert {"out.csv", "invalid_records.csv"} <= set(os.listdir(drop_folder))
+        pd.DataFrame({'note': ["not patients"]}).to_csv(drop_folder / "notes.csv", index=False)
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-original.csv"), drop_folder / "patients.csv")
+
+        thread, result = watch_in_background(drop_folder, tmp_path, max_files = 1)
+        thread.join(timeout = 60)
+        assert result == [0]
+        assert sorted(x for x in os.listdir(tmp_path) if x.endswith("_CLKs.csv")) == ["patients_CLKs.csv"]
+        metrics = pd.read_csv(tmp_path / pprl.WATCH_METRICS_FILE_NAME, keep_default_na=False)
+        assert metrics['file'].tolist() == ["patients.csv"]
+        assert not [x for x in caplog.records if x.levelname == "ERROR"]
+
+    def test_changed_files_are_hashed_again(self, tmp_path):
+        """Test that a corrected file dropped under the name of one already hashed replaces its outputs."""
+        drop_folder = tmp_path / "drop"
+        os.makedirs(drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "secret.txt"), drop_folder)
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-missing-data.csv"), drop_folder / "patients.csv")
+
+        thread, result = watch_in_background(drop_folder, tmp_path, max_files = 2)
+        while not os.path.exists(tmp_path / "patients_CLKs.csv"):
+            time.sleep(0.05)
+        time.sleep(0.2)
+        shutil.copy(os.path.join(DATA_DIR, "100-patients-original.csv"), drop_folder / "patients.csv.part")
+        os.replace(drop_folder / "patients.csv.part", drop_folder / "patients.csv")
+        thread.join(timeout = 60)
+        assert not thread.is_alive()
+        assert result == [0]
+
+        create("100-patients-original.csv", tmp_path / "original")
+        assert filecmp.cmp(tmp_path / "original" / "hashes.csv", tmp_path / "patients_CLKs.csv", shallow=False)
+        assert not os.path.exists(tmp_path / "patients_invalid_records.csv")
+        metrics = pd.read_csv(tmp_path / pprl.WATCH_METRICS_FILE_NAME, keep_default_na=False)
+        assert metrics['file'].tolist() == ["patients.csv", "patients.csv"]
+        assert metrics['invalid'].tolist()[1] == 0
+
+    def test_output_must_name_each_file(self, tmp_path):
+        with pytest.raises(ValueError):
+            pprl._watch_folder(output = "hashes.csv", data_folder = str(tmp_path), max_files = 0)
@@ -1,5 +1,7 @@
+import filecmp
+
 def assert_file_comparison(file_path_1, file_path_2):
-    assert filecmp.cmp(file_path_1, file_path_2)
+    assert filecmp.cmp(file_path_1, file_path_2, shallow=False)
 
 def assert_file_contents(file_path, expected):
     with open(file_path,'r') as file:
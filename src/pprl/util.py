@@ -1,6 +1,13 @@
+import hashlib
+import importlib.util
+import json
 import logging
+import numpy as np
 import os
+import pandas as pd
 import yaml
+from anyascii import anyascii
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
 
@@ -86,17 +93,223 @@ def validated_out_path(descriptor, file_name, file_directory):
     logger.debug("Valid: %s", file_path)
     return file_path
 
-def validate_input_fields(df):
+# Upper limit on the number of values remembered by a NormalizationCache
+NORMALIZATION_CACHE_SIZE = 1_000_000
+
+class LRUCache:
+    """
+    Bounded, least-recently-used memory of results computed for (namespace, value) keys.
+
+    Hits and misses are counted per distinct value looked up.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get_many(self, namespace, values, compute):
+        """
+        Return the cached result for each of `values`, calling `compute()` on the list of values that are missing
+        """
+        results = [None] * len(values)
+        missing = []
+        for n, value in enumerate(values):
+            key = (namespace, value)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                results[n] = self._entries[key]
+            else:
+                missing.append(n)
+
+        self.hits += len(values) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            for n, result in zip(missing, compute([values[n] for n in missing])):
+                results[n] = result
+                self._entries[(namespace, values[n])] = result
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return results
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class NormalizationCache(LRUCache):
+    """
+    Bounded, least-recently-used memory of normalized and sanitized values.
+
+    First names, cities, states, ZIPs and dates repeat heavily, so the results for each distinct value
+    are kept and reused by later chunks of the same run. Hits and misses are counted per distinct value.
+    """
+    def __init__(self, max_size = NORMALIZATION_CACHE_SIZE):
+        super().__init__(max_size)
+
+    def log_stats(self):
+        logger.info("Normalization cache: %s hits, %s misses (%.1f%% hit rate), %s values held",
+                self.hits, self.misses, 100 * self.hit_rate, len(self._entries))
+
+# Bump whenever normalize_fields() or validate_input_fields() change what they produce,
+# so that records validated by an earlier version are never reused from a ValidatedRecordsCache
+SANITIZER_VERSION = 1
+
+class ValidatedRecordsCache:
+    """
+    The valid and invalid records of a patient file, as validated by an earlier run, kept on disk for later runs.
+
+    Each entry is a pair of uncompressed Feather files in the cache folder, named by a digest of the patient file's
+    contents, the columns read from it and `SANITIZER_VERSION`, so editing the file, hashing other fields or changing
+    the sanitizers misses the cache. Entries are memory mapped when loaded, with their strings left in Arrow memory.
+
+    The files hold normalized identifiers in the clear, like the invalid records file.
+    """
+    def __init__(self, folder, patient_file_path, columns):
+        try:
+            import pyarrow
+        except ImportError:
+            logger.error("The validated records cache needs pyarrow, which isn't installed. Install it (pip install pprl[arrow]) or remove validated_cache")
+            raise
+
+        self.folder = folder
+        digest = hashlib.sha256()
+        with open(patient_file_path, 'rb') as f:
+            digest.update(hashlib.file_digest(f, 'sha256').digest())
+        digest.update(json.dumps([SANITIZER_VERSION, list(columns)]).encode())
+        key = digest.hexdigest()
+        self.valid_path = os.path.join(folder, f"{key}.valid.feather")
+        self.invalid_path = os.path.join(folder, f"{key}.invalid.feather")
+
+    def load(self):
+        """
+        Return the cached valid and invalid records, or None if this patient file hasn't been validated yet
+        """
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        if not (os.path.isfile(self.valid_path) and os.path.isfile(self.invalid_path)):
+            logger.info("No validated records cached in %s for this patient file yet", self.folder)
+            return None
+
+        def read(path):
+            table = feather.read_table(path, memory_map = True)
+            return table.to_pandas(types_mapper = {pa.string(): pd.StringDtype("pyarrow")}.get)
+
+        logger.debug("Reading validated records from %s", self.valid_path)
+        df_valid = read(self.valid_path)
+        df_invalid = read(self.invalid_path)
+        # Arrow gives lists back as arrays
+        df_invalid['invalid_cols'] = pd.Series([list(cols) for cols in df_invalid['invalid_cols']], index=df_invalid.index, dtype=object)
+        logger.info("Read %s valid and %s invalid records from the cache in %s", len(df_valid), len(df_invalid), self.folder)
+        return df_valid, df_invalid
+
+    def store(self, df_valid, df_invalid):
+        """
+        Keep the valid and invalid records of this patient file for later runs
+        """
+        import pyarrow as pa
+        import pyarrow.feather as feather
+
+        os.makedirs(self.folder, exist_ok=True)
+        for df, path in [(df_valid, self.valid_path), (df_invalid, self.invalid_path)]:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            if 'invalid_cols' in df.columns and len(df) == 0:
+                table = table.set_column(table.schema.get_field_index('invalid_cols'), 'invalid_cols', pa.array([], pa.list_(pa.string())))
+            # Written next to the entry and moved into place, so a failed run never leaves half an entry
+            feather.write_feather(table, f"{path}.new", compression = 'uncompressed')
+            os.replace(f"{path}.new", path)
+        logger.debug("Wrote %s valid and %s invalid records to the cache in %s", len(df_valid), len(df_invalid), self.folder)
+
+def _normalize_value(value):
+    """
+    Transliterate a value to ASCII and capitalize it
+    """
+    # Pure ASCII needs no transliteration
+    return (value if value.isascii() else anyascii(value)).upper()
+
+def _normalize_values(values):
+    return [_normalize_value(value) for value in values]
+
+def normalize_fields(df, cache = None):
+    """
+    Convert all values to ASCII and capitalize them.
+
+    Each column is factorized, so that every distinct value is only transliterated once
+    (and, given a `NormalizationCache`, only once per run).
+    """
+    normalized = {}
+    for col in df.columns:
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+        uniques = uniques.tolist()
+        if cache is None:
+            normalized_uniques = _normalize_values(uniques)
+        else:
+            normalized_uniques = cache.get_many("normalize", uniques, _normalize_values)
+        normalized[col] = _expand_distinct(np.array(normalized_uniques, dtype=object), codes, df[col])
+    return pd.DataFrame(normalized, index=df.index, columns=df.columns)
+
+# In compact mode, string columns with at most this many distinct values per record are held as categoricals
+COMPACT_CATEGORY_RATIO = 0.5
+
+def compact_frame(df):
+    """
+    Return `df` with its string columns held compactly.
+
+    Columns whose values repeat become categoricals, which store each distinct value once.
+    The others become Arrow strings, or stay Python strings if pyarrow isn't installed.
+    Normalization and validation keep each column in the representation they're given.
+    """
+    has_pyarrow = importlib.util.find_spec("pyarrow") is not None
+    compact = {}
+    for col in df.columns:
+        column = df[col]
+        if isinstance(column.dtype, pd.CategoricalDtype) or not (pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column)):
+            compact[col] = column
+        elif column.nunique(dropna=False) <= COMPACT_CATEGORY_RATIO * len(column):
+            compact[col] = column.astype('category')
+        elif has_pyarrow:
+            compact[col] = column.astype(pd.StringDtype("pyarrow"))
+        else:
+            compact[col] = column
+    return pd.DataFrame(compact, index=df.index, columns=df.columns)
+
+def log_bytes_per_record(df, description):
+    """
+    Log how much memory each record of `df` takes up (only when debugging, since it has to measure every string)
+    """
+    if logger.isEnabledFor(logging.DEBUG) and len(df) > 0:
+        logger.debug("%s: %.0f bytes per record in memory", description, df.memory_usage(deep=True).sum() / len(df))
+
+def _expand_distinct(results, codes, like):
+    """
+    Map the results computed for each distinct value of `like` back onto its rows, in the same representation as `like`
+    """
+    if isinstance(like.dtype, pd.CategoricalDtype):
+        # Different values may give the same result, and categories must be unique
+        result_codes, categories = pd.factorize(results)
+        return pd.Categorical.from_codes(result_codes[codes], categories)
+    if isinstance(like.dtype, pd.StringDtype) and like.dtype.storage == "pyarrow":
+        return pd.array(results[codes], dtype=like.dtype)
+    return results[codes]
+
+def validate_input_fields(df, cache = None):
     """
     ## Inputs:
     - `df` (pd.DataFrame): DataFrame created from the input_csv containing patient records.
+    - `cache` (NormalizationCache, optional): Reuse sanitized values across calls.
 
     ## Returns:
     - `df_valid` (pd.DataFrame): DataFrame containing only valid, correctly formatted records, where all fields are present.
     - `df_invalid` (pd.DataFrame): DataFrame containing all invalid records with a column indicating which fields are invalid.
 
     ## Notes:
-        The input DataFrame is copied, then each row has `_clean_row()` applied. which performs validation checks using the following:
+        Each column with a sanitizer is cleaned and checked as a whole, using vectorized string operations that reproduce the following:
 
         1. `_sanitize_string()`: All strings are capitalized, symbols removed, whitespace stripped.
 
@@ -104,12 +317,14 @@ def validate_input_fields(df):
 
         3. `_sanitize_zip()`: Properly formatted zipcodes. (`#####`, not `#####-####`)
 
-        Rows and their sanitizer functions are defined in the `sanitizer_config` dict and this should be updated to reflect the expected schema.
-        Each sanitizer function outputs the cleaned row and a boolean flag for validity.
+        Columns and their sanitizer functions are defined in the `SANITIZER_CONFIG` dict and this should be updated to reflect the expected schema.
+        Each column sanitizer outputs the cleaned column and a boolean mask flagging the invalid values.
+        Columns are factorized first, so each distinct value is only sanitized once.
+        The results are identical to applying the scalar sanitizers to every row (see `_validate_input_fields_by_row()`).
 
     ## Config:
         ```
-            sanitizer_config = {
+            SANITIZER_CONFIG = {
                 "first": _sanitize_string,
                 "last": _sanitize_string,
                 "city": _sanitize_string,
@@ -119,103 +334,280 @@ def validate_input_fields(df):
         }
         ```
     """
-    # define our sanitization functions.
-    def _sanitize_string(value):
-        """
-        This will autocapitalize and sanitize all string fields.
-        """
-        raw_str = str(value).strip()
-        # check for missing vals. if we've got nothing, return whatever that nothing is, and flag it.
-        if not raw_str or raw_str.lower() in ('nan', 'none', '999'):
-            return (value , False)
-        # If we've got something here, capitalize everything, keep only internal spaces, dashes, apostraphs, and periods, drop all other characters. (if we need to add more, this is trivial)
-        clean_value = ''.join(c for c in raw_str if c.isalnum() or c in (' ', '-', "'", '.')).upper()
-        # check to see that we've still got something, if length after cleaning is 0 then it's invalid.
-        is_valid = True if len(clean_value) > 0 else False
-        return clean_value, is_valid
-
-    def _sanitize_zip(value):
-        """
-        This will sanitize and correctly format zipcodes.
-        """
-        raw_zip = value.strip() # strip padding
-        components = raw_zip.split('-')
-        # check for single zip case where it's already valid, is numeric, and is only 5 long.
-        if len(components) == 1 and components[0].isnumeric() and len(components[0]) == 5:
-            clean_value = raw_zip
+    # This operates on the DataFrame created by read_dataframe_from_CSV()
+    # which already has checks for blank inputs and determines delim automatically.
+
+    sanitized_cols = [col for col in SANITIZER_CONFIG if col in df.columns]
+
+    # run the sanitizers, one column at a time
+    cleaned = {}
+    invalid_masks = {}
+    for col in sanitized_cols:
+        cleaned[col], invalid_masks[col] = _sanitize_column(df[col], SANITIZER_CONFIG[col], cache)
+
+    invalid_mask = np.zeros(len(df), dtype=bool)
+    for col in sanitized_cols:
+        invalid_mask |= invalid_masks[col]
+
+    # keep the cleaned and sanitized values of the valid rows.
+    # (the boolean selection is already a new frame, so only a shallow copy is needed to write to it)
+    df_valid = df[~invalid_mask].copy(deep=False)
+    for col in sanitized_cols:
+        df_valid[col] = cleaned[col][~invalid_mask]
+
+    # pull invalid rows, then pull the raw data and return a dataframe with the original inputs and the list of invalid cols.
+    invalid_rows = np.flatnonzero(invalid_mask)
+    invalid_cols = [[] for _ in invalid_rows]
+    for col in sanitized_cols:
+        for n in np.flatnonzero(invalid_masks[col][invalid_rows]):
+            invalid_cols[n].append(col)
+    invalid_meta = pd.DataFrame({
+        "row_id": df["row_id"].to_numpy()[invalid_rows],
+        "invalid_cols": pd.Series(invalid_cols, dtype=object),
+        })
+    df_invalid = df.merge(invalid_meta, on="row_id", how="inner")
+    # return the valid dataframe and invalid dataframe.
+    return df_valid, df_invalid
+
+# define our sanitization functions.
+def _sanitize_string(value):
+    """
+    This will autocapitalize and sanitize all string fields.
+    """
+    raw_str = str(value).strip()
+    # check for missing vals. if we've got nothing, return whatever that nothing is, and flag it.
+    if not raw_str or raw_str.lower() in ('nan', 'none', '999'):
+        return (value , False)
+    # If we've got something here, capitalize everything, keep only internal spaces, dashes, apostraphs, and periods, drop all other characters. (if we need to add more, this is trivial)
+    clean_value = ''.join(c for c in raw_str if c.isalnum() or c in (' ', '-', "'", '.')).upper()
+    # check to see that we've still got something, if length after cleaning is 0 then it's invalid.
+    is_valid = True if len(clean_value) > 0 else False
+    return clean_value, is_valid
+
+def _sanitize_zip(value):
+    """
+    This will sanitize and correctly format zipcodes.
+    """
+    raw_zip = value.strip() # strip padding
+    components = raw_zip.split('-')
+    # check for single zip case where it's already valid, is numeric, and is only 5 long.
+    if len(components) == 1 and components[0].isnumeric() and len(components[0]) == 5:
+        clean_value = raw_zip
+        is_valid = True
+    # check for zip+4, split by '-' and then check lengths of each component.
+    elif len(components) == 2:
+        # if both are groovy and both are numeric, pull the first component
+        if (len(components[0]) == 5 and len(components[1]) == 4) and (components[0].isnumeric() and components[1].isnumeric()):
+            clean_value = components[0]
             is_valid = True
-        # check for zip+4, split by '-' and then check lengths of each component.
-        elif len(components) == 2:
-            # if both are groovy and both are numeric, pull the first component
-            if (len(components[0]) == 5 and len(components[1]) == 4) and (components[0].isnumeric() and components[1].isnumeric()):
-                clean_value = components[0]
-                is_valid = True
-            # if something of the above is not true, then pull the first component anyway but flag as invalid.
-            else:
-                clean_value = components[0]
-                is_valid = False
-        # otherwise, something is wrong and this should be flagged. return the original input value and flag as invalid.
+        # if something of the above is not true, then pull the first component anyway but flag as invalid.
         else:
-            clean_value = value
+            clean_value = components[0]
             is_valid = False
+    # otherwise, something is wrong and this should be flagged. return the original input value and flag as invalid.
+    else:
+        clean_value = value
+        is_valid = False
 
-        return clean_value, is_valid
+    return clean_value, is_valid
 
-    def _sanitize_date(value):
-        """
-        This will sanitize and correctly format dates.
-        """
-        try:
-            date_string = str(value).strip()
-            if not date_string or date_string.lower() in ('nan', 'none', 'nat', '999'):
-                return (value, False)
-            # we're gonna ignore day/month/year formatting because it shouldn't be output that way. if this is an issue
-            # then add it to the list below but it shouldn't be stored that way in epic.
-            formats = [
-                '%Y/%m/%d',
-                '%Y-%m-%d',
-                '%m-%d-%Y',
-                '%m/%d/%Y',
-            ]
-
-            for fmt in formats:
-                try:
-                    clean_date = datetime.strptime(date_string, fmt).strftime('%Y-%m-%d')
-                    return (clean_date, True)
-                except ValueError:
-                    continue
-
-            # Excel dates are annoying and require separate handling.
-            # to keep from treating these years as taking place in 2000,
-            # compare with current timestamp and knock it back 100 if it's in the future.
+def _sanitize_date(value):
+    """
+    This will sanitize and correctly format dates.
+    """
+    try:
+        date_string = str(value).strip()
+        if not date_string or date_string.lower() in ('nan', 'none', 'nat', '999'):
+            return (value, False)
+        # we're gonna ignore day/month/year formatting because it shouldn't be output that way. if this is an issue
+        # then add it to the list below but it shouldn't be stored that way in epic.
+        formats = [
+            '%Y/%m/%d',
+            '%Y-%m-%d',
+            '%m-%d-%Y',
+            '%m/%d/%Y',
+        ]
+
+        for fmt in formats:
             try:
-                parsed = datetime.strptime(date_string, '%m/%d/%y')
-                if parsed > datetime.now():
-                    parsed = parsed.replace(year=parsed.year - 100)
-                clean_date = parsed.strftime('%Y-%m-%d')
+                clean_date = datetime.strptime(date_string, fmt).strftime('%Y-%m-%d')
                 return (clean_date, True)
-
             except ValueError:
-                pass
-
-            # If we get nothing. return nothing and flag as invalid.
-            return (None, False)
-
-        # if any of the above fails, return nothing and flag as invalid.
-        except Exception:
-            return (None, False)
-
-    # define which rows get which sanitizing function.
-    # This will need to be linked with whatever is expected in the schema
-    sanitizer_config = {
-        "first": _sanitize_string,
-        "last": _sanitize_string,
-        "city": _sanitize_string,
-        "state": _sanitize_string,
-        "zip": _sanitize_zip,
-        "dob": _sanitize_date,
-    }
+                continue
+
+        # Excel dates are annoying and require separate handling.
+        # to keep from treating these years as taking place in 2000,
+        # compare with current timestamp and knock it back 100 if it's in the future.
+        try:
+            parsed = datetime.strptime(date_string, '%m/%d/%y')
+            if parsed > datetime.now():
+                parsed = parsed.replace(year=parsed.year - 100)
+            clean_date = parsed.strftime('%Y-%m-%d')
+            return (clean_date, True)
+
+        except ValueError:
+            pass
+
+        # If we get nothing. return nothing and flag as invalid.
+        return (None, False)
+
+    # if any of the above fails, return nothing and flag as invalid.
+    except Exception:
+        return (None, False)
+
+# define which rows get which sanitizing function.
+# This will need to be linked with whatever is expected in the schema
+SANITIZER_CONFIG = {
+    "first": _sanitize_string,
+    "last": _sanitize_string,
+    "city": _sanitize_string,
+    "state": _sanitize_string,
+    "zip": _sanitize_zip,
+    "dob": _sanitize_date,
+}
+
+# Column-wise versions of the sanitizers.
+# Each takes a Series and returns an array of cleaned values and a boolean array flagging invalid values.
+# Values are only cleaned exactly where they're valid, since invalid records are reported with their raw values.
+# Anything outside of ASCII goes through the scalar sanitizer, so that Unicode-aware checks
+# such as `str.isalnum()` and `str.isnumeric()` give the same answers as before.
+
+def _apply_scalar_sanitizer(sanitizer, values, cleaned, invalid, rows):
+    for n in rows:
+        cleaned[n], is_valid = sanitizer(values[n])
+        invalid[n] = not is_valid
+
+def _non_ascii_rows(stripped):
+    return np.flatnonzero([isinstance(value, str) and not value.isascii() for value in stripped.to_numpy(dtype=object)])
+
+def _sanitize_string_column(column):
+    stripped = column.astype(str).str.strip()
+    missing = (stripped == '') | stripped.str.lower().isin(('nan', 'none', '999'))
+    clean = stripped.str.replace(r"[^0-9A-Za-z '.\-]", '', regex=True).str.upper()
+
+    cleaned = clean.to_numpy(dtype=object)
+    invalid = (missing | (clean.str.len() == 0)).to_numpy(dtype=bool)
+    _apply_scalar_sanitizer(_sanitize_string, column.to_numpy(dtype=object), cleaned, invalid, _non_ascii_rows(stripped))
+    return cleaned, invalid
+
+def _sanitize_zip_column(column):
+    stripped = column.str.strip()
+    zip5 = stripped.str.fullmatch(r'[0-9]{5}').to_numpy(dtype=bool, na_value=False)
+    zip9 = stripped.str.fullmatch(r'[0-9]{5}-[0-9]{4}').to_numpy(dtype=bool, na_value=False)
+
+    cleaned = np.where(zip9, stripped.str.slice(0, 5), stripped).astype(object)
+    invalid = ~(zip5 | zip9)
+    _apply_scalar_sanitizer(_sanitize_zip, column.to_numpy(dtype=object), cleaned, invalid, _non_ascii_rows(stripped))
+    return cleaned, invalid
+
+# The date formats tried by `_sanitize_date()`, in the same order, as regular expressions that match exactly what
+# `datetime.strptime()` accepts for each format. The 4-digit year comes first in two of them and last in the other three,
+# and the separators differ, so no value can match more than one format.
+_MONTH = r'(?P<month>1[0-2]|0[1-9]|[1-9])'
+_DAY = r'(?P<day>3[01]|[12][0-9]|0[1-9]|[1-9]| [1-9])'
+_DATE_FORMAT_PATTERNS = {
+    '%Y/%m/%d': rf'(?P<year>[0-9]{{4}})/{_MONTH}/{_DAY}',
+    '%Y-%m-%d': rf'(?P<year>[0-9]{{4}})-{_MONTH}-{_DAY}',
+    '%m-%d-%Y': rf'{_MONTH}-{_DAY}-(?P<year>[0-9]{{4}})',
+    '%m/%d/%Y': rf'{_MONTH}/{_DAY}/(?P<year>[0-9]{{4}})',
+    '%m/%d/%y': rf'{_MONTH}/{_DAY}/(?P<year>[0-9]{{2}})',
+}
+
+# How many distinct values of a date column are checked to infer its format.
+DATE_FORMAT_SAMPLE_SIZE = 1000
+
+_DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+def _infer_date_format(stripped):
+    """
+    Return the format matched by most of a sample of date strings, or None if none of them match any format
+    """
+    step = max(1, len(stripped) // DATE_FORMAT_SAMPLE_SIZE)
+    sample = stripped.iloc[::step]
+    counts = {fmt: int(sample.str.fullmatch(pattern).sum()) for fmt, pattern in _DATE_FORMAT_PATTERNS.items()}
+    date_format = max(counts, key=counts.get)
+    return date_format if counts[date_format] > 0 else None
 
+def _sanitize_date_column(column):
+    """
+    Parse every date in the column's dominant format in one pass.
+    Anything that format can't parse on its own goes through `_sanitize_date()`.
+    """
+    values = column.to_numpy(dtype=object)
+    stripped = column.astype(str).str.strip()
+    missing = ((stripped == '') | stripped.str.lower().isin(('nan', 'none', 'nat', '999'))).to_numpy(dtype=bool)
+
+    cleaned = np.where(missing, values, None).astype(object)
+    invalid = np.ones(len(column), dtype=bool)
+    stragglers = ~missing
+    ascii_dates = ~missing & np.array([value.isascii() for value in stripped], dtype=bool)
+
+    date_format = _infer_date_format(stripped[ascii_dates])
+    if date_format is not None:
+        logger.debug("Parsing dates as %s", date_format)
+        parts = stripped.str.extract(f'^{_DATE_FORMAT_PATTERNS[date_format]}$')
+        matched = parts['year'].notna().to_numpy(dtype=bool) & ascii_dates
+        year = parts['year'].fillna('0').astype(int).to_numpy()
+        month = parts['month'].fillna('0').astype(int).to_numpy()
+        day = parts['day'].fillna('0').astype(int).to_numpy()
+
+        if date_format == '%m/%d/%y':
+            # strptime puts 69-99 in the 1900s and 00-68 in the 2000s; _sanitize_date() then moves future dates back a century.
+            year = np.where(year < 69, 2000 + year, 1900 + year)
+            today = datetime.now()
+            in_future = (year * 10000 + month * 100 + day) > (today.year * 10000 + today.month * 100 + today.day)
+            year = np.where(in_future, year - 100, year)
+            # 29 February may not exist a century earlier, which _sanitize_date() handles
+            matched &= ~((month == 2) & (day == 29))
+
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        days_in_month = _DAYS_IN_MONTH[month] + ((month == 2) & leap)
+        # strftime() doesn't zero-pad years before 1000 the same way on every platform, so leave those to _sanitize_date()
+        parsed = matched & (day <= days_in_month) & (year >= 1000)
+
+        rows = np.flatnonzero(parsed)
+        cleaned[rows] = (
+            pd.Series(year[rows]).astype(str)
+            + '-' + pd.Series(month[rows]).astype(str).str.zfill(2)
+            + '-' + pd.Series(day[rows]).astype(str).str.zfill(2)
+            ).to_numpy(dtype=object)
+        invalid[rows] = False
+        stragglers &= ~parsed
+
+    _apply_scalar_sanitizer(_sanitize_date, values, cleaned, invalid, np.flatnonzero(stragglers))
+    return cleaned, invalid
+
+_COLUMN_SANITIZERS = {
+    _sanitize_string: _sanitize_string_column,
+    _sanitize_zip: _sanitize_zip_column,
+    _sanitize_date: _sanitize_date_column,
+}
+
+def _sanitize_column(column, sanitizer, cache = None):
+    """
+    Run the column-wise version of `sanitizer` once for each distinct value, then map the results back onto every row
+    """
+    column_sanitizer = _COLUMN_SANITIZERS[sanitizer]
+    codes, uniques = pd.factorize(column, use_na_sentinel=False)
+
+    if cache is None:
+        clean_uniques, invalid_uniques = column_sanitizer(pd.Series(uniques, dtype=object))
+    else:
+        def sanitize(values):
+            return list(zip(*column_sanitizer(pd.Series(values, dtype=object))))
+
+        sanitized = cache.get_many(sanitizer.__name__, uniques.tolist(), sanitize)
+        clean_uniques = np.array([clean for clean, _ in sanitized], dtype=object)
+        invalid_uniques = np.array([invalid for _, invalid in sanitized], dtype=bool)
+
+    return _expand_distinct(clean_uniques, codes, column), invalid_uniques[codes]
+
+def _validate_input_fields_by_row(df):
+    """
+    The original row-by-row implementation of `validate_input_fields()`.
+
+    This is far slower, and is only kept to check and benchmark the column-wise implementation.
+    """
     # define the function to use in df.apply()
     def _clean_row(row):
         """
@@ -226,7 +618,7 @@ def validate_input_fields(df):
             which will be used downstream to split rows into valid/invalid.
         """
         invalid_cols = []
-        for col, func in sanitizer_config.items():
+        for col, func in SANITIZER_CONFIG.items():
             if col not in row.keys():
                 continue
             else:
@@ -238,9 +630,6 @@ def validate_input_fields(df):
                 row["_invalid_cols"] = invalid_cols
         return row
 
-    # This operates on the DataFrame created by read_dataframe_from_CSV()
-    # which already has checks for blank inputs and determines delim automatically.
-
     raw_df = df.copy()
 
     # run the sanitizers